@@ -25,6 +25,9 @@ def main():
     # Create a view and show it.
     view = AppWindow(app_state=app_state)
     view.show()
+    # Follow the run executed in the background if the application was
+    # closed while it was running.
+    app_state.attach_to_service()
 
     app.start()
 
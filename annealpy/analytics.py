@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Thermal budget of the recorded runs.
+
+The thermal budget of a run characterizes the heat treatment actually
+received by the samples:
+- the Arrhenius weighted thermal dose, ie the time at a reference temperature
+  having the same effect on a thermally activated process
+- the time spent above some thresholds
+- the integrated degree-seconds above a base temperature
+- the distribution of the ramp rates, as the time spent in each rate bin
+
+The temperature is read by chunks and treated as a piecewise linear signal
+(the recordings may be compressed). The ramp rates are computed on the signal
+sampled on a regular grid.
+
+Results are cached per content hash of the run (and settings) in the runs
+directory, and the runs missing from the cache are processed in parallel on
+a pool of processes.
+
+"""
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from atom.api import Atom, Float, List
+
+from .catalog import _Connection
+from .recording import META_FILE, TELEMETRY_FILE, RunRecording
+
+#: Version of the computations, part of the cache key.
+ANALYTICS_VERSION = 1
+
+#: Name of the cache database file, stored in the runs directory.
+CACHE_FILE = 'analytics.sqlite'
+
+#: Gas constant in J/mol/K.
+GAS_CONSTANT = 8.314462618
+
+#: Offset between Celsius and Kelvin.
+ZERO_CELSIUS = 273.15
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    directory TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    content_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    content_hash TEXT,
+    settings_hash TEXT,
+    result TEXT,
+    PRIMARY KEY (content_hash, settings_hash)
+);
+"""
+
+
+class BudgetConfig(Atom):
+    """Settings of the thermal budget computation.
+
+    """
+    #: Activation energy in J/mol of the process weighting the dose.
+    activation_energy = Float(100e3)
+
+    #: Temperature in C at which the dose is expressed.
+    reference_temperature = Float(400.0)
+
+    #: Temperatures in C above which the time spent is computed.
+    thresholds = List(Float(), [100.0, 300.0, 500.0])
+
+    #: Temperature in C above which the degree-seconds are integrated.
+    base_temperature = Float(25.0)
+
+    #: Period in s of the grid on which the ramp rates are computed.
+    rate_window = Float(10.0)
+
+    #: Width in C/s of the bins of the ramp rate distribution.
+    rate_bin_width = Float(0.5)
+
+    #: Largest ramp rate in C/s of the distribution, faster ramps being
+    #: counted in the first or last bin.
+    max_rate = Float(10.0)
+
+    def to_dict(self):
+        """Settings as a JSON serializable dict.
+
+        """
+        return {name: getattr(self, name) for name in self.members()}
+
+    def settings_hash(self):
+        """Hash identifying the settings and the version of the code.
+
+        """
+        settings = dict(self.to_dict(), version=ANALYTICS_VERSION)
+        text = json.dumps(settings, sort_keys=True)
+        return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+    def rate_edges(self):
+        """Edges of the bins of the ramp rate distribution.
+
+        """
+        count = max(int(round(self.max_rate/self.rate_bin_width)), 1)
+        return np.linspace(-count, count, 2*count + 1)*self.rate_bin_width
+
+
+class ThermalBudget(object):
+    """Accumulate the thermal budget of a temperature signal.
+
+    The samples are fed in chronological order by blocks of any size.
+
+    """
+    def __init__(self, config):
+        self.config = config
+        self.duration = 0.0
+        self.peak = -math.inf
+        self.dose = 0.0
+        self.degree_seconds = 0.0
+        self.time_above = np.zeros(len(config.thresholds))
+        self.edges = config.rate_edges()
+        self.rate_histogram = np.zeros(len(self.edges) - 1)
+        self.max_heating = 0.0
+        self.max_cooling = 0.0
+        self._thresholds = np.array(config.thresholds, dtype=float)
+        self._factor = config.activation_energy/GAS_CONSTANT
+        self._inverse_reference = 1/(config.reference_temperature +
+                                     ZERO_CELSIUS)
+        self._last = None
+        self._grid_next = None
+        self._grid_last = None
+
+    def add(self, times, temperatures):
+        """Add samples to the budget.
+
+        """
+        if not len(times):
+            return
+        self.peak = max(self.peak, float(temperatures.max()))
+        if self._last is not None:
+            times = np.concatenate(([self._last[0]], times))
+            temperatures = np.concatenate(([self._last[1]], temperatures))
+        else:
+            self._grid_next = times[0]
+        self._last = (times[-1], temperatures[-1])
+        if len(times) < 2:
+            return
+
+        dt = np.diff(times)
+        start = temperatures[:-1]
+        end = temperatures[1:]
+        self.duration += float(dt.sum())
+
+        # Trapezoidal integration of the Arrhenius factor.
+        weight = np.exp(-self._factor*(1/(temperatures + ZERO_CELSIUS) -
+                                       self._inverse_reference))
+        self.dose += float((dt*(weight[:-1] + weight[1:])).sum()/2)
+
+        self.degree_seconds += float(_positive_area(
+            start - self.config.base_temperature,
+            end - self.config.base_temperature, dt).sum())
+
+        if len(self._thresholds):
+            low = start[:, None] - self._thresholds
+            high = end[:, None] - self._thresholds
+            self.time_above += _positive_time(low, high,
+                                              dt[:, None]).sum(axis=0)
+
+        self._add_rates(times, temperatures)
+
+    def result(self):
+        """Thermal budget as a JSON serializable dict.
+
+        """
+        config = self.config
+        return dict(
+            duration=self.duration,
+            peak_temperature=(self.peak if math.isfinite(self.peak) else
+                              None),
+            thermal_dose=self.dose,
+            degree_seconds=self.degree_seconds,
+            time_above={f'{t:g}': float(v)
+                        for t, v in zip(config.thresholds, self.time_above)},
+            ramp_rate=dict(edges=self.edges.tolist(),
+                           histogram=self.rate_histogram.tolist(),
+                           max_heating=self.max_heating,
+                           max_cooling=self.max_cooling))
+
+    # --- Private API ---------------------------------------------------------
+
+    def _add_rates(self, times, temperatures):
+        """Sample the signal on the rate grid and accumulate the rates.
+
+        """
+        window = self.config.rate_window
+        count = int((times[-1] - self._grid_next)//window) + 1
+        if count <= 0:
+            return
+        grid = self._grid_next + window*np.arange(count)
+        values = np.interp(grid, times, temperatures)
+        self._grid_next = grid[-1] + window
+        if self._grid_last is not None:
+            values = np.concatenate(([self._grid_last], values))
+        self._grid_last = values[-1]
+        if len(values) < 2:
+            return
+        rates = np.diff(values)/window
+        self.max_heating = max(self.max_heating, float(rates.max()))
+        self.max_cooling = max(self.max_cooling, float(-rates.min()))
+        edges = self.edges
+        clipped = np.clip(rates, edges[0], np.nextafter(edges[-1], 0))
+        self.rate_histogram += np.histogram(clipped, edges)[0]*window
+
+
+def _positive_area(start, end, dt):
+    """Integral of the positive part of linear segments.
+
+    """
+    pos_start = np.maximum(start, 0)
+    pos_end = np.maximum(end, 0)
+    span = np.abs(start) + np.abs(end)
+    crossing = (start*end < 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        crossed = (pos_start**2 + pos_end**2)/(2*span)
+    return dt*np.where(crossing, crossed, (pos_start + pos_end)/2)
+
+
+def _positive_time(start, end, dt):
+    """Time during which linear segments are positive.
+
+    """
+    span = np.abs(start) + np.abs(end)
+    crossing = (start*end < 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.maximum(np.maximum(start, end), 0)/span
+    above = (start > 0) | ((start == 0) & (end > 0))
+    return dt*np.where(crossing, fraction, above)
+
+
+def run_content_hash(directory, block_size=1 << 20):
+    """Hash of the content (metadata and telemetry) of a recorded run.
+
+    """
+    digest = hashlib.sha1()
+    for name in (META_FILE, TELEMETRY_FILE):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def analyze_run(directory, config, channel='temperature'):
+    """Compute the thermal budget of a recorded run, reading it by chunks.
+
+    """
+    recording = RunRecording(directory)
+    budget = ThermalBudget(config)
+    if channel in recording.channels:
+        index = recording.channels.index(channel)
+        for _, chunk in recording.iter_chunks():
+            chunk = chunk[chunk['channel'] == index]
+            budget.add(chunk['time'], chunk['value'])
+    result = budget.result()
+    meta = recording.meta
+    result.update(directory=os.path.abspath(directory),
+                  description=meta.get('description', ''),
+                  start_time=meta.get('start_time'),
+                  status=meta.get('status'))
+    return result
+
+
+class AnalyticsCache(object):
+    """Cache of the thermal budgets, stored in the runs directory.
+
+    The results are stored per content hash of the run. The hashes
+    themselves are stored along with the size and modification time of the
+    files of the run so that the runs are not read again until they change.
+
+    """
+    def __init__(self, runs_directory):
+        self.path = os.path.join(runs_directory, CACHE_FILE)
+        os.makedirs(runs_directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    def known_hash(self, directory):
+        """Content hash of a run if it did not change since it was computed.
+
+        """
+        key = _file_key(directory)
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT size, mtime_ns, content_hash FROM hashes '
+                'WHERE directory = ?', (key[0],)).fetchone()
+        if row is None or tuple(row[:2]) != key[1:]:
+            return None
+        return row[2]
+
+    def set_hashes(self, hashes):
+        """Record the content hashes of runs, given as a directory: hash dict.
+
+        """
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)',
+                [_file_key(d) + (h,) for d, h in hashes.items()])
+
+    def get(self, content_hash, settings_hash):
+        """Cached result, None if missing.
+
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT result FROM results WHERE content_hash = ? AND '
+                'settings_hash = ?', (content_hash, settings_hash)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, results):
+        """Store results, given as a dict keyed by the hashes.
+
+        """
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                [k + (json.dumps(r),) for k, r in results.items()])
+
+    # --- Private API ---------------------------------------------------------
+
+    def _connect(self):
+        """Open a connection to the database.
+
+        """
+        return _Connection(self.path)
+
+
+def analyze_runs(directories, config=None, cache=None, workers=None):
+    """Compute the thermal budget of several runs.
+
+    Parameters
+    ----------
+    directories : list[str]
+        Directories of the runs.
+    config : BudgetConfig, optional
+        Settings of the computation.
+    cache : AnalyticsCache, optional
+        Cache from which results are retrieved and in which the new ones are
+        stored.
+    workers : int, optional
+        Number of processes used, by default the number of CPUs. The runs
+        are processed in the calling process if it is 1 or if a single run
+        is missing from the cache.
+
+    Returns
+    -------
+    results : list[dict]
+        Thermal budget of each run, in the order of the directories. Each
+        result also holds the content hash of the run.
+
+    """
+    config = config or BudgetConfig()
+    directories = [os.path.abspath(d) for d in directories]
+    settings = config.to_dict()
+    settings_hash = config.settings_hash()
+
+    hashes = {}
+    if cache is not None:
+        for directory in directories:
+            known = cache.known_hash(directory)
+            if known is not None:
+                hashes[directory] = known
+    missing = [d for d in directories if d not in hashes]
+    new_hashes = dict(zip(missing, _map(run_content_hash, missing, workers)))
+    hashes.update(new_hashes)
+    if cache is not None and new_hashes:
+        cache.set_hashes(new_hashes)
+
+    results = {}
+    if cache is not None:
+        for directory in directories:
+            cached = cache.get(hashes[directory], settings_hash)
+            if cached is not None:
+                # The same content may have been analyzed in another place.
+                cached['directory'] = directory
+                results[directory] = cached
+    missing = [d for d in directories if d not in results]
+    computed = dict(zip(missing, _map(_analyze, missing, workers,
+                                      [settings]*len(missing))))
+    for directory, result in computed.items():
+        result['content_hash'] = hashes[directory]
+    results.update(computed)
+    if cache is not None and computed:
+        cache.put({(hashes[d], settings_hash): r for d, r in computed.items()})
+
+    return [results[d] for d in directories]
+
+
+def compare(results):
+    """Statistics of the scalar metrics across runs.
+
+    Returns a dict mapping the name of each metric to a dict holding its
+    mean, standard deviation, minimum and maximum.
+
+    """
+    columns = {}
+    for result in results:
+        for name, value in flatten(result).items():
+            columns.setdefault(name, []).append(value)
+    stats = {}
+    for name, values in columns.items():
+        values = np.array([np.nan if v is None else v for v in values],
+                          dtype=float)
+        if np.isnan(values).all():
+            continue
+        stats[name] = dict(mean=float(np.nanmean(values)),
+                           std=float(np.nanstd(values)),
+                           min=float(np.nanmin(values)),
+                           max=float(np.nanmax(values)))
+    return stats
+
+
+def flatten(result):
+    """Scalar metrics of a result as a flat dict.
+
+    """
+    flat = {name: result[name] for name in ('duration', 'peak_temperature',
+                                            'thermal_dose', 'degree_seconds')}
+    for threshold, value in result['time_above'].items():
+        flat[f'time_above_{threshold}'] = value
+    flat['max_heating_rate'] = result['ramp_rate']['max_heating']
+    flat['max_cooling_rate'] = result['ramp_rate']['max_cooling']
+    return flat
+
+
+def _analyze(directory, settings):
+    """Analyze a run in a worker process.
+
+    """
+    return analyze_run(directory, BudgetConfig(**settings))
+
+
+def _map(function, items, workers, *args):
+    """Apply a function to items, using a pool of processes if worthwhile.
+
+    """
+    if not items:
+        return []
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(items) == 1:
+        return [function(item, *extra) for item, *extra in
+                zip(items, *args)]
+    with ProcessPoolExecutor(min(workers, len(items))) as executor:
+        return list(executor.map(function, items, *args,
+                                 chunksize=max(len(items)//(4*workers), 1)))
+
+
+def _file_key(directory):
+    """Directory, total size and latest modification time of a run files.
+
+    """
+    stats = [os.stat(os.path.join(directory, name))
+             for name in (META_FILE, TELEMETRY_FILE)
+             if os.path.isfile(os.path.join(directory, name))]
+    return (directory, sum(s.st_size for s in stats),
+            max((s.st_mtime_ns for s in stats), default=0))
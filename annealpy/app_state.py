@@ -11,12 +11,21 @@
 """
 import os
 import json
+import time
 
 import numpy as np
-from atom.api import Atom, Enum, Int, Str, Typed, Event, Bool, Float, Dict
+from atom.api import (Atom, Enum, Int, Str, Typed, Event, Bool, Float, Dict,
+                      List)
 from enaml.application import timed_call
 
+from .catalog import RunCatalog, load_decimated
+from .channels import DTYPES, ChannelRegistry
+from .loadgen import LoadTest
 from .process import AnnealerProcess
+from .replay import ReplayController
+from .service import find_service
+from .streaming import TelemetryStreamServer
+from .telemetry import POLICIES
 
 
 class ChannelStatus(Atom):
@@ -75,7 +84,8 @@ class ChannelStatus(Atom):
         index = self.current_index
         if self.kind == 'stepped':
             self.times[index:index+2] = time
-            self.values[index] = self.values[index-1]
+            # Without a previous value, the first step starts at the value.
+            self.values[index] = self.values[index-1] if index else value
             self.values[index+1] = value
             self.current_index += 2
         else:
@@ -83,14 +93,35 @@ class ChannelStatus(Atom):
             self.values[index] = value
             self.current_index += 1
 
-        if self.current_index + 1 >= self.allocated_size:
-            old_time = self.times
-            self.times = np.empty(int(1.5*self.allocated_size))
-            self.times[:len(old_time)+1] = old_time
-            old_values = self.values
-            self.values = np.empty(int(1.5*self.allocated_size),
-                                   old_values.dtype)
-            self.values[:len(old_values)+1] = old_values
+        self._ensure_capacity(2)
+
+    def extend(self, times, values):
+        """Append several values to the records at once.
+
+        This is equivalent to calling append_value for each value but
+        vectorized.
+
+        """
+        count = len(times)
+        if not count:
+            return
+
+        index = self.current_index
+        if self.kind == 'stepped':
+            self._ensure_capacity(2*count + 2)
+            self.times[index:index+2*count] = np.repeat(times, 2)
+            new = self.values[index:index+2*count]
+            new[1::2] = values
+            new[2::2] = values[:-1]
+            new[0] = self.values[index-1] if index else values[0]
+            self.current_index += 2*count
+        else:
+            self._ensure_capacity(count + 2)
+            self.times[index:index+count] = times
+            self.values[index:index+count] = values
+            self.current_index += count
+
+        self._ensure_capacity(2)
 
     def get_data(self, time=None):
         """Retrieve data in a way consistent with their kind.
@@ -108,6 +139,41 @@ class ChannelStatus(Atom):
             return (self.times[:index+1],
                     self.values[:index+1])
 
+    def get_samples(self):
+        """Retrieve the samples as they were appended.
+
+        For stepped channels, the values duplicated to draw the steps are
+        discarded.
+
+        """
+        times, values = self.get_data()
+        if self.kind != 'stepped':
+            return times, values
+        # Each sample is stored as a (previous value, new value) pair, after
+        # the first value if one was added.
+        start = 1 - len(times) % 2
+        return times[start::2], values[start::2]
+
+    # --- Private API ---------------------------------------------------------
+
+    def _ensure_capacity(self, count):
+        """Grow the arrays if less than count values can be added.
+
+        """
+        if self.current_index + count < self.allocated_size:
+            return
+
+        size = max(int(1.5*self.allocated_size),
+                   self.current_index + count + 1)
+        index = self.current_index
+        old_times = self.times
+        self.times = np.empty(size)
+        self.times[:index] = old_times[:index]
+        old_values = self.values
+        self.values = np.empty(size, old_values.dtype)
+        self.values[:index] = old_values[:index]
+        self.allocated_size = size
+
 
 class ApplicationState(Atom):
     """Object storing the current state of the application.
@@ -123,26 +189,101 @@ class ApplicationState(Atom):
     #: Path to the last loaded process.
     process_config_path = Str().tag(pref=True)
 
+    #: Directory under which the runs are recorded.
+    runs_directory = Str().tag(pref=True)
+
+    #: Compression settings per channel (see compression.CompressionConfig).
+    #: Channels absent from this dict are not compressed.
+    compression = Dict().tag(pref=True)
+
+    #: Filter settings per input channel (see filtering.FilterConfig).
+    #: Channels absent from this dict are read without oversampling.
+    filters = Dict().tag(pref=True)
+
     #: Plot refresh interval in s.
     plot_refresh_interval = Float(2).tag(pref=True)
 
-    #: Plot colors.
+    #: Plot colors per channel, overriding the colors of the channel configs.
     plot_colors = Typed(dict, ({'temperature': '#f9f9f9',
                                 'heater_switch': '#9bceee',
                                 'heater_regulation': '#59c3b1'},)
                         ).tag(pref=True)
 
+    #: Policy used when the application cannot keep up with the telemetry
+    #: produced by the actuator.
+    telemetry_policy = Enum(*POLICIES).tag(pref=True)
+
+    #: Maximal number of telemetry batches waiting to be processed.
+    telemetry_queue_size = Int(100).tag(pref=True)
+
+    #: Whether to stream the telemetry to local viewers over HTTP.
+    streaming_enabled = Bool().tag(pref=True)
+
+    #: Port on which the telemetry is streamed.
+    streaming_port = Int(8765).tag(pref=True)
+
+    #: Whether to execute the processes in a service independent of the
+    #: application, which can then be closed without interrupting the run.
+    detached_runs = Bool(True).tag(pref=True)
+
+    #: Maximal difference in C between the current and the checkpointed
+    #: temperature for a run to be resumed.
+    resume_tolerance = Float(25.0).tag(pref=True)
+
+    #: Settings of the profiler used when profiling a run (see
+    #: profiling.ProfileConfig).
+    profiling = Dict().tag(pref=True)
+
+    #: Whether to profile the runs started from now on.
+    profile_runs = Bool()
+
+    #: Whether to also trace the allocations of the profiled runs.
+    profile_allocations = Bool()
+
+    #: Server streaming the telemetry, None if streaming is disabled.
+    stream_server = Typed(TelemetryStreamServer)
+
+    #: Number of samples dropped by the telemetry transport during the run.
+    telemetry_dropped = Int()
+
+    #: Number of samples merged by the telemetry transport during the run.
+    telemetry_coalesced = Int()
+
+    #: Delay in s between the acquisition of the last received sample and its
+    #: processing by the application.
+    telemetry_lag = Float()
+
+    #: Number of samples received from the actuator during the run.
+    telemetry_received = Int()
+
+    #: Time in s spent redrawing the plots at the last refresh.
+    plot_frame_time = Float()
+
+    #: Metrics of the running step (see metrics.StepMetrics), with the index
+    #: and type of the step.
+    step_metrics = Dict()
+
+    #: Final metrics of the steps completed during the run.
+    step_results = List()
+
     #: Process being edited/run
     process = Typed(AnnealerProcess, ())
 
-    #: Measured temperature over time
-    temperature = Typed(ChannelStatus, (np.float, 'continuous', 36000))
+    #: Channels of the DAQ (see channels.ChannelRegistry).
+    channel_registry = Typed(ChannelRegistry)
+
+    #: Values of each channel over time as {name: ChannelStatus}.
+    channels = Dict()
 
-    #: Heater switch state over time
-    heater_switch = Typed(ChannelStatus, (np.int, 'stepped', 10000))
+    #: Controller used to replay recorded runs.
+    replay = Typed(ReplayController, ())
 
-    #: Measured temperature over time
-    heater_regulation = Typed(ChannelStatus, (np.float, 'stepped', 10000))
+    #: Controller used to stress-test the telemetry pipeline.
+    load_test = Typed(LoadTest, ())
+
+    #: Decimated temperature of past runs overlaid on the live plot, as
+    #: {label: (times, values)}.
+    overlays = Dict()
 
     #: Event signaling the plot should be updated.
     plot_update = Event()
@@ -150,8 +291,14 @@ class ApplicationState(Atom):
     def __init__(self):
         super().__init__()
         self.load_app_state()
+        try:
+            daq_config = self.get_daq_config()
+        except (OSError, ValueError):
+            daq_config = {}
+        self.configure_channels(ChannelRegistry.from_daq_config(daq_config))
         if self.process_config_path:
             self.process = AnnealerProcess.load(self.process_config_path)
+        self._update_stream_server()
 
     def load_app_state(self):
         """Load the application state.
@@ -190,30 +337,135 @@ class ApplicationState(Atom):
         with open(self.daq_config_path) as f:
             return json.load(f)
 
-    def start_plot_timer(self):
+    def get_profiling(self):
+        """Settings of the profiler for the next run, None if not profiled.
+
+        """
+        if not self.profile_runs:
+            return None
+        return dict(self.profiling, tracemalloc=self.profile_allocations)
+
+    def configure_channels(self, registry):
+        """Create the stores of the channels of a registry.
+
+        The stores of the channels whose description did not change are kept.
+
+        """
+        old = self.channel_registry
+        channels = {}
+        for config in registry:
+            ch_status = self.channels.get(config.name)
+            if (ch_status is None or old is None or
+                    ch_status.kind != config.kind or
+                    old[config.name].dtype != config.dtype):
+                ch_status = ChannelStatus(DTYPES[config.dtype], config.kind,
+                                          config.initial_size)
+            channels[config.name] = ch_status
+        self.channel_registry = registry
+        self.channels = channels
+
+    def reset_channels(self):
+        """Discard the data recorded for all channels.
+
+        """
+        for ch_status in self.channels.values():
+            ch_status.current_index = 0
+        self.step_metrics = {}
+        self.step_results = []
+        if self.stream_server is not None:
+            self.stream_server.publish_reset()
+
+    def get_catalog(self):
+        """Access the catalog of the runs recorded in the runs directory.
+
+        """
+        return RunCatalog(self.runs_directory)
+
+    def add_overlay(self, label, directory):
+        """Overlay the decimated temperature of a recorded run.
+
+        """
+        overlays = dict(self.overlays)
+        overlays[label] = load_decimated(directory)
+        self.overlays = overlays
+
+    def clear_overlays(self):
+        """Remove all the overlaid runs.
+
+        """
+        self.overlays = {}
+
+    def update_telemetry_stats(self, dropped, coalesced, lag, received):
+        """Update the statistics about the telemetry transport.
+
+        """
+        self.telemetry_dropped = dropped
+        self.telemetry_coalesced = coalesced
+        self.telemetry_lag = lag
+        self.telemetry_received = received
+
+    def attach_to_service(self):
+        """Follow the process executed by a running service, if any.
+
+        Returns True if a running process was found.
+
+        """
+        client = find_service(self.runs_directory)
+        if client is None:
+            return False
+        self.process = AnnealerProcess.load(
+            client.info['process_config_path'])
+        self.process.attach(self, client)
+        return True
+
+    def add_step_result(self, step, type, metrics):
+        """Store the final metrics of a completed step.
+
+        """
+        metrics = dict(metrics, step=step, type=type)
+        self.step_results = self.step_results + [metrics]
+        self.step_metrics = {}
+
+    def start_plot_timer(self, owner):
         """Start a recurring timer that fire the plot_update event.
 
+        The timer is shared by the live runs, the replays and the load tests,
+        and runs until all the owners that started it stopped it.
+
         """
-        self._stop_timer = False
-        self._fire_plot_update(schedule_only=True)
+        running = bool(self._plot_timer_owners)
+        self._plot_timer_owners.add(owner)
+        if not running:
+            self._stop_timer = False
+            self._fire_plot_update(schedule_only=True)
 
-    def stop_plot_timer(self):
+    def stop_plot_timer(self, owner):
         """Stop the recurring timer that fire the plot_update event.
 
+        The timer keeps running as long as other owners use it.
+
         """
-        self._stop_timer = True
+        self._plot_timer_owners.discard(owner)
+        if not self._plot_timer_owners:
+            self._stop_timer = True
 
     # --- Private API ---------------------------------------------------------
 
     #: Boolean indicating the timer not to re-schedule itself.
     _stop_timer = Bool()
 
+    #: Names of the users of the plot timer ('run', 'replay', ...).
+    _plot_timer_owners = Typed(set, ())
+
     def _fire_plot_update(self, schedule_only=False):
         """Fire the plot update event and reschedule a new call.
 
         """
         if not schedule_only:
+            # The plots are redrawn by the observers of the event.
+            start = time.perf_counter()
             self.plot_update = True
+            self.plot_frame_time = time.perf_counter() - start
         if not self._stop_timer:
             timed_call(1000*self.plot_refresh_interval, self._fire_plot_update)
 
@@ -234,3 +486,91 @@ class ApplicationState(Atom):
 
         """
         self.save_app_state()
+
+    def _default_runs_directory(self):
+        """Record the runs in the user directory by default.
+
+        """
+        return os.path.join(os.path.expanduser('~'), 'annealpy_runs')
+
+    def _post_setattr_runs_directory(self, old, new):
+        """Save the app state when the user change the runs directory.
+
+        """
+        self.save_app_state()
+
+    def _post_setattr_compression(self, old, new):
+        """Save the app state when the user change the compression settings.
+
+        """
+        self.save_app_state()
+
+    def _post_setattr_telemetry_policy(self, old, new):
+        """Save the app state when the user change the telemetry policy.
+
+        """
+        self.save_app_state()
+
+    def _post_setattr_telemetry_queue_size(self, old, new):
+        """Save the app state when the user change the telemetry queue size.
+
+        """
+        self.save_app_state()
+
+    def _post_setattr_filters(self, old, new):
+        """Save the app state when the user change the filter settings.
+
+        """
+        self.save_app_state()
+
+    def _post_setattr_detached_runs(self, old, new):
+        """Save the app state when the user change the execution mode.
+
+        """
+        self.save_app_state()
+
+    def _post_setattr_resume_tolerance(self, old, new):
+        """Save the app state when the user change the resume tolerance.
+
+        """
+        self.save_app_state()
+
+    def _post_setattr_profiling(self, old, new):
+        """Save the app state when the user change the profiler settings.
+
+        """
+        self.save_app_state()
+
+    def _post_setattr_streaming_enabled(self, old, new):
+        """Start/stop the streaming server and save the app state.
+
+        """
+        self._update_stream_server()
+        self.save_app_state()
+
+    def _post_setattr_streaming_port(self, old, new):
+        """Restart the streaming server and save the app state.
+
+        """
+        self._update_stream_server()
+        self.save_app_state()
+
+    def _update_stream_server(self):
+        """Start, stop or restart the streaming server to match the settings.
+
+        """
+        server = self.stream_server
+        if server is not None:
+            if self.streaming_enabled and server.port == self.streaming_port:
+                return
+            self.stream_server = None
+            server.close()
+        if self.streaming_enabled:
+            try:
+                server = TelemetryStreamServer(self, port=self.streaming_port)
+            except OSError as e:
+                print(f'Failed to start the telemetry server on port '
+                      f'{self.streaming_port}: {e}')
+                return
+            server.start()
+            self.stream_server = server
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""SQLite catalog of the recorded runs.
+
+The catalog stores for each run its metadata and summary statistics computed
+once when the run finishes, so that runs can be queried without opening the
+recordings.
+
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from .recording import META_FILE, RunRecording
+from .service import read_service_info
+
+#: Name of the catalog database file, stored in the runs directory.
+CATALOG_FILE = 'catalog.sqlite'
+
+#: Default tolerance in C used to compute the time spent at target.
+DEFAULT_TOLERANCE = 2.0
+
+#: Status of the runs whose actuator ended without closing the recording
+#: (e.g. when it was force terminated).
+ABORTED_STATUS = 'Aborted'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    directory TEXT PRIMARY KEY,
+    recipe_hash TEXT,
+    recipe_path TEXT,
+    description TEXT,
+    start_time REAL,
+    end_time REAL,
+    device_id TEXT,
+    status TEXT,
+    peak_temperature REAL,
+    overshoot REAL,
+    time_in_tolerance REAL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    directory TEXT,
+    step INTEGER,
+    type TEXT,
+    target_temperature REAL,
+    duration REAL,
+    PRIMARY KEY (directory, step)
+);
+CREATE INDEX IF NOT EXISTS runs_start ON runs (start_time);
+CREATE INDEX IF NOT EXISTS runs_recipe ON runs (recipe_hash);
+CREATE INDEX IF NOT EXISTS steps_target ON steps (target_temperature);
+"""
+
+#: Columns of the runs table, in order.
+RUN_COLUMNS = ('directory', 'recipe_hash', 'recipe_path', 'description',
+               'start_time', 'end_time', 'device_id', 'status',
+               'peak_temperature', 'overshoot', 'time_in_tolerance')
+
+
+def recipe_hash(process_config):
+    """Hash identifying the content of a recipe (its steps).
+
+    """
+    steps = json.dumps(process_config.get('steps', []), sort_keys=True)
+    return hashlib.sha1(steps.encode('utf8')).hexdigest()
+
+
+def step_targets(recording):
+    """Start times and target temperatures (or nan) of the executed steps.
+
+    """
+    steps = recording.meta.get('process', {}).get('steps', [])
+    starts, targets = [], []
+    for event in recording.meta.get('events', []):
+        if event['kind'] == 'step_start':
+            config = steps[event['step']] if event['step'] < len(steps) else {}
+            starts.append(event['time'])
+            targets.append(config.get('target_temperature', np.nan))
+    return np.array(starts, dtype=float), np.array(targets, dtype=float)
+
+
+def summarize_run(recording, tolerance=DEFAULT_TOLERANCE):
+    """Compute the summary statistics of a run, reading it by chunks.
+
+    The overshoot is the largest excursion beyond the target of the running
+    step in the direction of its approach (as in metrics.StepMetrics) and the
+    time in tolerance the time spent within tolerance of that target.
+
+    """
+    starts, targets = step_targets(recording)
+    # Direction of the approach of the target of each step (1 when heating
+    # up to it, -1 when cooling down), set by its first sample.
+    directions = np.zeros(len(starts))
+    channel = recording.channels.index('temperature')
+    peak = -np.inf
+    overshoot = 0.0
+    in_tolerance = 0.0
+    last = None
+    for _, chunk in recording.iter_chunks():
+        chunk = chunk[chunk['channel'] == channel]
+        if not len(chunk):
+            continue
+        times = chunk['time']
+        temps = chunk['value']
+        peak = max(peak, temps.max())
+        if not len(starts):
+            continue
+
+        # Carry the last sample of the previous chunk to integrate over time.
+        if last is not None:
+            times = np.concatenate(([last[0]], times))
+            temps = np.concatenate(([last[1]], temps))
+        last = (times[-1], temps[-1])
+
+        indexes = np.searchsorted(starts, times, 'right') - 1
+        target = np.where(indexes >= 0, targets[np.maximum(indexes, 0)],
+                          np.nan)
+        error = temps - target
+        valid = ~np.isnan(error)
+        if valid.any():
+            steps, first = np.unique(indexes[valid], return_index=True)
+            unset = directions[steps] == 0
+            directions[steps[unset]] = np.where(
+                error[valid][first[unset]] <= 0, 1.0, -1.0)
+            excursion = directions[indexes[valid]]*error[valid]
+            overshoot = max(overshoot, excursion.max())
+        within = valid[:-1] & (np.abs(error[:-1]) <= tolerance)
+        in_tolerance += np.diff(times)[within].sum()
+
+    return dict(peak_temperature=float(peak) if np.isfinite(peak) else None,
+                overshoot=float(overshoot),
+                time_in_tolerance=float(in_tolerance))
+
+
+def load_decimated(directory, channel='temperature', max_points=2000):
+    """Load a decimated version of a channel of a recorded run.
+
+    The run is read by chunks and the min and max values over max_points/2
+    time bins are kept so that the shape of the curve is preserved.
+
+    """
+    recording = RunRecording(directory)
+    index = recording.channels.index(channel)
+    bins = max(max_points // 2, 1)
+    width = (recording.duration or 1.0)/bins
+    mins = np.full(bins, np.inf)
+    maxs = np.full(bins, -np.inf)
+    for _, chunk in recording.iter_chunks():
+        chunk = chunk[chunk['channel'] == index]
+        if not len(chunk):
+            continue
+        positions = np.minimum((chunk['time']//width).astype(int), bins - 1)
+        np.minimum.at(mins, positions, chunk['value'])
+        np.maximum.at(maxs, positions, chunk['value'])
+
+    filled = np.isfinite(mins)
+    centers = (np.arange(bins) + 0.5)*width
+    times = np.repeat(centers[filled], 2)
+    values = np.empty(len(times))
+    values[0::2] = mins[filled]
+    values[1::2] = maxs[filled]
+    return times, values
+
+
+class RunCatalog(object):
+    """SQLite index of the runs recorded under a directory.
+
+    """
+    def __init__(self, runs_directory):
+        self.runs_directory = runs_directory
+        self.path = os.path.join(runs_directory, CATALOG_FILE)
+        os.makedirs(runs_directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    def add_run(self, directory, tolerance=DEFAULT_TOLERANCE):
+        """Add (or update) a finished run to the catalog.
+
+        A run left 'Running' by an actuator which did not close the recording
+        is indexed as aborted, unless a service is still executing it.
+
+        """
+        recording = RunRecording(directory)
+        meta = recording.meta
+        status = meta.get('status')
+        end_time = meta.get('end_time')
+        if status == 'Running' and not self._is_executed(directory):
+            status = ABORTED_STATUS
+            if meta.get('start_time') is not None:
+                end_time = meta['start_time'] + recording.duration
+        row = dict(directory=os.path.abspath(directory),
+                   recipe_hash=recipe_hash(meta.get('process', {})),
+                   recipe_path=meta.get('process_path', ''),
+                   description=meta.get('description', ''),
+                   start_time=meta.get('start_time'),
+                   end_time=end_time,
+                   device_id=meta.get('daq_config', {}).get('device_id',
+                                                            'Dev1'),
+                   status=status)
+        row.update(summarize_run(recording, tolerance))
+
+        steps = meta.get('process', {}).get('steps', [])
+        with self._connect() as connection:
+            connection.execute(
+                f'INSERT OR REPLACE INTO runs VALUES '
+                f'({", ".join("?"*len(RUN_COLUMNS))})',
+                [row[c] for c in RUN_COLUMNS])
+            connection.execute('DELETE FROM steps WHERE directory = ?',
+                               (row['directory'],))
+            connection.executemany(
+                'INSERT INTO steps VALUES (?, ?, ?, ?, ?)',
+                [(row['directory'], i, s.get('type'),
+                  s.get('target_temperature'), s.get('duration'))
+                 for i, s in enumerate(steps)])
+        return row
+
+    def rebuild(self):
+        """Index all the runs found in the runs directory.
+
+        """
+        count = 0
+        for name in sorted(os.listdir(self.runs_directory)):
+            directory = os.path.join(self.runs_directory, name)
+            if os.path.isfile(os.path.join(directory, META_FILE)):
+                self.add_run(directory)
+                count += 1
+        return count
+
+    def query(self, description=None, recipe=None, status=None,
+              device_id=None, since=None, until=None, target=None,
+              target_tolerance=1.0, step_type=None):
+        """Find the runs matching all the specified criteria.
+
+        Parameters
+        ----------
+        description : str, optional
+            Substring of the run description.
+        recipe : str, optional
+            Prefix of the recipe hash or substring of the recipe path.
+        status : str, optional
+            Final status of the run.
+        device_id : str, optional
+            Id of the DAQ used.
+        since, until : float, optional
+            Bounds on the start time of the run (POSIX timestamps), until
+            being excluded.
+        target : float, optional
+            Target temperature of at least one of the steps.
+        target_tolerance : float
+            Tolerance used when matching the target temperature.
+        step_type : str, optional
+            Type of the step that should match the target.
+
+        Returns
+        -------
+        runs : list[dict]
+            Matching runs, the most recent first.
+
+        """
+        clauses, args = [], []
+        if description:
+            clauses.append('description LIKE ?')
+            args.append(f'%{description}%')
+        if recipe:
+            clauses.append('(recipe_hash LIKE ? OR recipe_path LIKE ?)')
+            args += [f'{recipe}%', f'%{recipe}%']
+        if status:
+            clauses.append('status = ?')
+            args.append(status)
+        if device_id:
+            clauses.append('device_id = ?')
+            args.append(device_id)
+        if since is not None:
+            clauses.append('start_time >= ?')
+            args.append(since)
+        if until is not None:
+            clauses.append('start_time < ?')
+            args.append(until)
+        if target is not None or step_type:
+            step_clauses = ['steps.directory = runs.directory']
+            if target is not None:
+                step_clauses.append('target_temperature BETWEEN ? AND ?')
+                args += [target - target_tolerance, target + target_tolerance]
+            if step_type:
+                step_clauses.append('type = ?')
+                args.append(step_type)
+            clauses.append('EXISTS (SELECT 1 FROM steps WHERE ' +
+                           ' AND '.join(step_clauses) + ')')
+
+        sql = f'SELECT {", ".join(RUN_COLUMNS)} FROM runs'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY start_time DESC'
+        with self._connect() as connection:
+            return [dict(zip(RUN_COLUMNS, r))
+                    for r in connection.execute(sql, args)]
+
+    # --- Private API ---------------------------------------------------------
+
+    def _is_executed(self, directory):
+        """Whether a run is being executed by the service of the directory.
+
+        """
+        info = read_service_info(self.runs_directory)
+        return (info is not None and
+                os.path.abspath(info['run_directory']) ==
+                os.path.abspath(directory))
+
+    def _connect(self):
+        """Open a connection to the database.
+
+        """
+        return _Connection(self.path)
+
+
+class _Connection(object):
+    """Context manager committing and closing an SQLite connection.
+
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._connection = sqlite3.connect(self.path)
+        return self._connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._connection.commit()
+        self._connection.close()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Declarative description of the channels handled by the DAQ.
+
+The channels are listed under the 'channels' key of the DAQ config, each entry
+being the settings of a ChannelConfig, for example:
+
+    {"name": "pressure", "physical_id": "ai3", "terminal": "rse",
+     "sample_rate": 2, "conversion": {"scale": 100, "offset": -50},
+     "unit": "mbar", "plot": "secondary"}
+
+The DAQ tasks, the telemetry and recording schema, the stores of the
+application and the plots are generated from this list. The temperature,
+heater_switch and heater_regulation channels are used by the control loops
+and must always be present: when they are not listed (which is the case of
+older configs), they are built from the legacy temperature_id, heater_switch_id
+and heater_reg_id keys.
+
+Furnaces with several heater zones declare, for each zone, an input (the
+thermocouple of the zone) and an output (the regulator of the zone) sharing
+the same zone index. Zone channels are read and written all at once by the
+multi-zone steps.
+
+The other input channels are acquired in the background at their own sample
+rate.
+
+"""
+import numpy as np
+from atom.api import Atom, Dict, Enum, Float, Int, Str
+
+#: Channels driven or read by the control loops.
+CONTROL_CHANNELS = ('temperature', 'heater_switch', 'heater_regulation')
+
+#: Terminal configurations of the analog inputs.
+TERMINALS = ('differential', 'rse', 'nrse', 'pseudodifferential')
+
+#: Numpy types of the values stored for each dtype.
+DTYPES = {'float': np.float64, 'int': np.int64}
+
+
+class ChannelConfig(Atom):
+    """Settings of a DAQ channel.
+
+    """
+    #: Name of the channel, used in the telemetry and the recordings.
+    name = Str()
+
+    #: Id of the physical channel on the device (ai2, ao0, ...).
+    physical_id = Str()
+
+    #: For outputs, id of the input channel used to read the output back.
+    readback_id = Str()
+
+    #: Whether the channel is read or written.
+    direction = Enum('input', 'output')
+
+    #: Terminal configuration of the input (or of the readback input).
+    terminal = Enum(*TERMINALS)
+
+    #: Continuous channels can vary in between recorded values, stepped
+    #: channels do not.
+    kind = Enum('continuous', 'stepped')
+
+    #: Type of the values.
+    dtype = Enum(*DTYPES)
+
+    #: Rate in Hz at which auxiliary inputs are acquired. The control
+    #: channels are read or written by the control loops.
+    sample_rate = Float(1.0)
+
+    #: Conversion from the measured voltage, either {'scale', 'offset'} or
+    #: {'polynomial': coefficients by increasing degree}. Empty for none.
+    conversion = Dict()
+
+    #: Unit of the converted values.
+    unit = Str()
+
+    #: Label used in the user interface (the capitalized name by default).
+    label = Str()
+
+    #: Default color of the curve of the channel.
+    color = Str('w')
+
+    #: Plot in which the channel is drawn.
+    plot = Enum('main', 'secondary')
+
+    #: Initial number of values allocated to store the channel data.
+    initial_size = Int(10000)
+
+    #: Index of the heater zone of the channel, -1 if it does not belong to
+    #: a zone.
+    zone = Int(-1)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if not self.label:
+            self.label = self.name.capitalize().replace('_', ' ')
+
+    def create_converter(self):
+        """Create a function converting voltages to values.
+
+        The function works on floats and numpy arrays.
+
+        """
+        conversion = self.conversion
+        if 'polynomial' in conversion:
+            coefficients = list(conversion['polynomial'])
+            return lambda volts: np.polynomial.polynomial.polyval(
+                volts, coefficients)
+        scale = conversion.get('scale', 1.0)
+        offset = conversion.get('offset', 0.0)
+        if scale == 1.0 and offset == 0.0:
+            return lambda volts: volts
+        return lambda volts: volts*scale + offset
+
+    def to_dict(self):
+        """Settings of the channel as stored in the DAQ config.
+
+        """
+        return {name: getattr(self, name) for name in self.members()}
+
+
+def create_array_converter(configs):
+    """Create a function converting an array of voltages, one per channel.
+
+    Linear conversions are applied to the whole array at once.
+
+    """
+    if all('polynomial' not in c.conversion for c in configs):
+        scales = np.array([c.conversion.get('scale', 1.0) for c in configs])
+        offsets = np.array([c.conversion.get('offset', 0.0) for c in configs])
+        return lambda volts: volts*scales + offsets
+    converters = [c.create_converter() for c in configs]
+    return lambda volts: np.array([conv(v) for conv, v in
+                                   zip(converters, volts)])
+
+
+class ChannelRegistry(object):
+    """Ordered collection of the channels of a DAQ.
+
+    Parameters
+    ----------
+    channels : iterable
+        ChannelConfig of the channels.
+
+    """
+    def __init__(self, channels):
+        self.channels = tuple(channels)
+        #: Position of each channel, used as index in the recordings.
+        self.index = {c.name: i for i, c in enumerate(self.channels)}
+        if len(self.index) != len(self.channels):
+            raise ValueError('The names of the channels must be unique.')
+        missing = [n for n in CONTROL_CHANNELS if n not in self.index]
+        if missing:
+            raise ValueError(f'The channels {missing} used by the control '
+                             f'loops are missing.')
+        self._by_name = {c.name: c for c in self.channels}
+        inputs = self._zone_channels('input')
+        outputs = self._zone_channels('output')
+        if ([z for z, _ in inputs] != [z for z, _ in outputs] or
+                [z for z, _ in inputs] != list(range(len(inputs)))):
+            raise ValueError('Each heater zone (numbered from 0) must have '
+                             'exactly one input and one output.')
+        #: Input channels of the heater zones, ordered by zone.
+        self.zone_inputs = [c for _, c in inputs]
+        #: Output channels of the heater zones, ordered by zone.
+        self.zone_outputs = [c for _, c in outputs]
+
+    @classmethod
+    def from_daq_config(cls, config):
+        """Build the registry described by a DAQ config.
+
+        """
+        channels = [ChannelConfig(**c) for c in config.get('channels', ())]
+        names = {c.name for c in channels}
+        switch_id = config.get('heater_switch_id', ['ai0', 'ao0'])
+        reg_id = config.get('heater_reg_id', ['ai1', 'ao1'])
+        legacy = [
+            ChannelConfig(name='temperature',
+                          physical_id=config.get('temperature_id', 'ai2'),
+                          terminal='differential',
+                          conversion=config.get('temperature_conversion', {}),
+                          unit='C', color='#f9f9f9', initial_size=36000),
+            ChannelConfig(name='heater_switch', direction='output',
+                          physical_id=switch_id[1], readback_id=switch_id[0],
+                          terminal='rse', kind='stepped', dtype='int',
+                          color='#9bceee', plot='secondary'),
+            ChannelConfig(name='heater_regulation', direction='output',
+                          physical_id=reg_id[1], readback_id=reg_id[0],
+                          terminal='rse', kind='stepped', color='#59c3b1',
+                          plot='secondary'),
+        ]
+        return cls([c for c in legacy if c.name not in names] + channels)
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def __len__(self):
+        return len(self.channels)
+
+    @property
+    def names(self):
+        """Names of the channels in order.
+
+        """
+        return [c.name for c in self.channels]
+
+    @property
+    def kinds(self):
+        """{name: kind} of the channels.
+
+        """
+        return {c.name: c.kind for c in self.channels}
+
+    @property
+    def schema(self):
+        """(name, kind) pairs describing the recorded channels.
+
+        """
+        return [(c.name, c.kind) for c in self.channels]
+
+    @property
+    def auxiliary_inputs(self):
+        """Input channels which are not used by the control loops.
+
+        """
+        return [c for c in self.channels
+                if c.direction == 'input' and c.zone < 0 and
+                c.name not in CONTROL_CHANNELS]
+
+    def to_list(self):
+        """Settings of all the channels as stored in the DAQ config.
+
+        """
+        return [c.to_dict() for c in self.channels]
+
+    # --- Private API ---------------------------------------------------------
+
+    def _zone_channels(self, direction):
+        """(zone, config) of the zone channels in a direction.
+
+        """
+        return sorted(((c.zone, c) for c in self.channels
+                       if c.zone >= 0 and c.direction == direction),
+                      key=lambda item: item[0])
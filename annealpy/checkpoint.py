@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Checkpointing of the execution of a process.
+
+The actuator periodically saves, in the run directory, the index of the
+running step, the time elapsed in it, the state of the PID in use and the last
+outputs. This allows to resume a process after a crash or a forced stop.
+
+"""
+import json
+import os
+from threading import Event, Thread
+
+#: Name of the checkpoint file, stored in the run directory.
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def write_checkpoint(directory, state):
+    """Atomically (re-)write the checkpoint of a run.
+
+    """
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_checkpoint(directory):
+    """Read the checkpoint of a run, None if the run cannot be resumed.
+
+    """
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def clear_checkpoint(directory):
+    """Remove the checkpoint of a run, which can then no longer be resumed.
+
+    """
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+class Checkpointer(object):
+    """Periodically write a checkpoint from a background thread.
+
+    Parameters
+    ----------
+    directory : str
+        Run directory in which to write the checkpoint.
+    collect : callable
+        Function returning the state to save (a JSON serializable dict).
+    interval : float
+        Interval in s between two checkpoints.
+
+    """
+    def __init__(self, directory, collect, interval=1.0):
+        self.directory = directory
+        self.collect = collect
+        self.interval = interval
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start checkpointing.
+
+        """
+        self._thread.start()
+
+    def stop(self, write=True):
+        """Stop checkpointing, writing a last checkpoint if requested.
+
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        if write:
+            write_checkpoint(self.directory, self.collect())
+
+    # --- Private API ---------------------------------------------------------
+
+    def _run(self):
+        """Write a checkpoint every interval.
+
+        """
+        while not self._stop.wait(self.interval):
+            write_checkpoint(self.directory, self.collect())
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Command line interface giving access to the recorded runs.
+
+"""
+import argparse
+import json
+import os
+import time
+
+from .analytics import (AnalyticsCache, BudgetConfig, analyze_runs, compare,
+                        flatten)
+from .catalog import RUN_COLUMNS, RunCatalog
+from .dryrun import dry_run, format_prediction
+from .export import FORMATS, export, recording_chunks
+from .identification import (ORDERS, ModelStore, ThermalModel, identify,
+                             load_run)
+from .process import AnnealerProcess
+from .profiling import (PROFILE_DIRECTORY, allocation_growth, read_profile,
+                        top_functions)
+from .recording import META_FILE, RunRecording, read_meta
+from .service import find_service
+from .streaming import FRAME_RESET, follow
+
+
+def parse_date(text):
+    """Convert a YYYY-MM-DD date to a timestamp.
+
+    """
+    return time.mktime(time.strptime(text, '%Y-%m-%d'))
+
+
+def parse_end_date(text):
+    """Convert a YYYY-MM-DD date to the timestamp of the end of that day.
+
+    """
+    day = list(time.strptime(text, '%Y-%m-%d'))
+    # mktime normalizes the day following the last one of a month.
+    day[2] += 1
+    return time.mktime(tuple(day))
+
+
+def catalog_rebuild(args):
+    """Index all the runs found in the runs directory.
+
+    """
+    count = RunCatalog(args.runs_directory).rebuild()
+    print(f'{count} run(s) indexed')
+
+
+def catalog_query(args):
+    """Print the runs matching the query as tab separated values.
+
+    """
+    runs = RunCatalog(args.runs_directory).query(
+        description=args.description, recipe=args.recipe, status=args.status,
+        device_id=args.device, since=args.since, until=args.until,
+        target=args.target, target_tolerance=args.target_tolerance,
+        step_type=args.step_type)
+    print('\t'.join(RUN_COLUMNS))
+    for run in runs:
+        print('\t'.join('' if run[c] is None else str(run[c])
+                        for c in RUN_COLUMNS))
+
+
+def identify_model(args):
+    """Fit a thermal model to recorded runs.
+
+    """
+    runs = [load_run(d, args.dt) for d in args.runs]
+    furnace = (args.furnace or
+               read_meta(args.runs[0]).get('daq_config', {}).get('device_id',
+                                                                 'Dev1'))
+    model = identify(runs, args.order, args.dt, args.max_delay, args.band,
+                     furnace)
+    print(f'Model for {furnace} ({args.order}): gain {model.gain:.1f} C, '
+          f'time constant {model.time_constant:.1f} s, '
+          f'dead time {model.dead_time:.1f} s, '
+          f'ambient {model.ambient:.1f} C')
+    for name, value in model.quality.items():
+        print(f'  {name}: {value:.4g}')
+    if args.save:
+        ModelStore.in_directory(args.runs_directory).save(model)
+        print('Model saved')
+
+
+def export_run(args):
+    """Export the data of a recorded run to CSV, Parquet or HDF5.
+
+    """
+    start = time.time()
+    recording = RunRecording(args.run)
+    rows = export(recording_chunks(recording), recording.kinds, args.output,
+                  args.format, args.period)
+    print(f'{rows} row(s) written to {args.output} in '
+          f'{time.time() - start:.1f} s')
+
+
+def predict_process(args):
+    """Predict the execution of a process using a thermal model.
+
+    """
+    with open(args.daq_config) as f:
+        daq_config = json.load(f)
+    furnace = daq_config.get('device_id', 'Dev1')
+    models = ModelStore.in_directory(args.runs_directory).models(furnace)
+    if not models and daq_config.get('simulation_model'):
+        models = [ThermalModel.from_dict(daq_config['simulation_model'])]
+    if not models:
+        print(f'No thermal model of {furnace} was found')
+        return
+    process = AnnealerProcess.load(args.process)
+    start = time.time()
+    prediction = dry_run(process.steps, models, daq_config,
+                         args.initial_temperature)
+    print(format_prediction(prediction))
+    print(f'Predicted in {time.time() - start:.1f} s')
+
+
+def thermal_budget(args):
+    """Compute the thermal budget of recorded runs and compare them.
+
+    """
+    runs = args.runs
+    if not runs:
+        runs = [os.path.join(args.runs_directory, name)
+                for name in sorted(os.listdir(args.runs_directory))
+                if os.path.isfile(os.path.join(args.runs_directory, name,
+                                               META_FILE))]
+    config = BudgetConfig(activation_energy=args.activation_energy,
+                          reference_temperature=args.reference_temperature,
+                          base_temperature=args.base_temperature,
+                          rate_window=args.rate_window)
+    if args.threshold:
+        config.thresholds = args.threshold
+    cache = None if args.no_cache else AnalyticsCache(args.runs_directory)
+    start = time.time()
+    results = analyze_runs(runs, config, cache, args.workers)
+    if args.json:
+        print(json.dumps(dict(settings=config.to_dict(), runs=results,
+                              comparison=compare(results)), indent=2))
+        return
+
+    rows = [flatten(r) for r in results]
+    columns = list(rows[0]) if rows else []
+    print('\t'.join(['run'] + columns))
+    for result, row in zip(results, rows):
+        print('\t'.join([os.path.basename(result['directory'])] +
+                        ['' if row[c] is None else f'{row[c]:.6g}'
+                         for c in columns]))
+    stats = compare(results)
+    for name in ('mean', 'std', 'min', 'max'):
+        print('\t'.join([name] + [f'{stats[c][name]:.6g}' if c in stats
+                                  else '' for c in columns]))
+    print(f'{len(results)} run(s) analyzed in {time.time() - start:.1f} s')
+
+
+def attach_service(args):
+    """Follow (or stop) the process executed in the background.
+
+    """
+    client = find_service(args.runs_directory)
+    if client is None:
+        print('No process is running')
+        return
+    print(f'Attached to the run recorded in {client.run_directory}')
+    if args.stop:
+        client.stop_event.set()
+        print('Stop requested')
+    if args.profile:
+        client.send(('profile', dict(tracemalloc=args.allocations)))
+        print('Profiling started')
+    if args.stop_profile:
+        client.send('stop_profile')
+        print('Profiling stopped')
+    while True:
+        batch = client.get()
+        if batch is None:
+            break
+        for _, kind, infos in batch.events:
+            details = ', '.join(f'{k}={v}' for k, v in infos.items()
+                                if k != 'metrics')
+            print(f'{kind}: {details}')
+        latest = {}
+        for channel, _, value in batch.samples:
+            latest[channel] = value
+        if latest and args.verbose:
+            print('  '.join(f'{name}: {value:.4g}'
+                            for name, value in latest.items()))
+    print(f'Run ended: {client.status}')
+
+
+def show_profile(args):
+    """Summarize the profiles saved with a run.
+
+    """
+    directory = os.path.join(args.run, PROFILE_DIRECTORY)
+    names = (sorted(f[:-len('.folded')] for f in os.listdir(directory)
+                    if f.endswith('.folded'))
+             if os.path.isdir(directory) else [])
+    if not names:
+        print(f'No profile was saved with {args.run}')
+        return
+    for name in names:
+        with open(os.path.join(directory, f'{name}.json')) as f:
+            summary = json.load(f)
+        print(f'{name}: {summary["samples"]} samples over '
+              f'{summary["duration"]:.1f} s, overhead '
+              f'{100*summary["overhead"]:.2f} %')
+        stacks = read_profile(args.run, name)
+        total = sum(stacks.values()) or 1
+        print('  self %  total %  function')
+        for label, own, cumulated in top_functions(stacks, args.top):
+            print(f'{100*own/total:8.1f} {100*cumulated/total:8.1f}  {label}')
+        growth = allocation_growth(args.run, name, args.top)
+        if growth:
+            print('  allocation growth')
+        for stat in growth:
+            print(f'{stat.size_diff/1024:+12.1f} KiB {stat.count_diff:+9d} '
+                  f'blocks  {stat.traceback[0]}')
+
+
+def watch_stream(args):
+    """Print the latest values streamed by a running application.
+
+    """
+    for kind, channels in follow(args.url, args.history):
+        if kind == FRAME_RESET:
+            print('New run started')
+            continue
+        print('  '.join(f'{name}: {values[-1]:.4g} ({len(values)} pts)'
+                        for name, (_, values) in channels.items()
+                        if len(values)))
+
+
+def build_parser():
+    """Build the parser of the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(prog='annealpy-cli',
+                                     description=__doc__.strip())
+    parser.add_argument('--runs-directory',
+                        default=os.path.join(os.path.expanduser('~'),
+                                             'annealpy_runs'),
+                        help='Directory in which the runs are recorded.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    catalog = commands.add_parser('catalog', help='Query the run catalog.')
+    catalog_commands = catalog.add_subparsers(dest='catalog_command')
+    catalog_commands.required = True
+
+    rebuild = catalog_commands.add_parser('rebuild',
+                                          help=catalog_rebuild.__doc__.strip())
+    rebuild.set_defaults(func=catalog_rebuild)
+
+    query = catalog_commands.add_parser('query',
+                                        help=catalog_query.__doc__.strip())
+    query.add_argument('--description', help='Substring of the description.')
+    query.add_argument('--recipe',
+                       help='Recipe hash prefix or substring of its path.')
+    query.add_argument('--status', help='Final status of the run.')
+    query.add_argument('--device', help='Id of the DAQ device.')
+    query.add_argument('--since', type=parse_date,
+                       help='Earliest start date (YYYY-MM-DD).')
+    query.add_argument('--until', type=parse_end_date,
+                       help='Latest start date (YYYY-MM-DD).')
+    query.add_argument('--target', type=float,
+                       help='Target temperature of one of the steps.')
+    query.add_argument('--target-tolerance', type=float, default=1.0,
+                       help='Tolerance used to match the target.')
+    query.add_argument('--step-type',
+                       help='Type of the step matching the target.')
+    query.set_defaults(func=catalog_query)
+
+    ident = commands.add_parser('identify',
+                                help=identify_model.__doc__.strip())
+    ident.add_argument('runs', nargs='+', help='Directories of the runs.')
+    ident.add_argument('--order', choices=list(ORDERS), default='fopdt')
+    ident.add_argument('--dt', type=float, default=1.0,
+                       help='Resampling period in s.')
+    ident.add_argument('--max-delay', type=float, default=60.0,
+                       help='Largest dead time considered in s.')
+    ident.add_argument('--band', type=float, nargs=2,
+                       metavar=('LOW', 'HIGH'),
+                       help='Temperature band to which the fit is restricted.')
+    ident.add_argument('--furnace',
+                       help='Furnace id, by default the DAQ of the first run.')
+    ident.add_argument('--save', action='store_true',
+                       help='Save the model in the runs directory.')
+    ident.set_defaults(func=identify_model)
+
+    exp = commands.add_parser('export', help=export_run.__doc__.strip())
+    exp.add_argument('run', help='Directory of the run.')
+    exp.add_argument('output', help='Path of the file to create.')
+    exp.add_argument('--format', choices=list(FORMATS),
+                     help='Format of the file, guessed from its extension by '
+                          'default.')
+    exp.add_argument('--period', type=float,
+                     help='Resample all channels with this period in s.')
+    exp.set_defaults(func=export_run)
+
+    dry = commands.add_parser('dry-run', help=predict_process.__doc__.strip())
+    dry.add_argument('process', help='Path of the process file.')
+    dry.add_argument('--daq-config',
+                     default=os.path.join(os.path.dirname(__file__), 'daq',
+                                          'daq_config.json'),
+                     help='Path of the DAQ config.')
+    dry.add_argument('--initial-temperature', type=float,
+                     help='Temperature at the start, by default the ambient '
+                          'temperature of the model.')
+    dry.set_defaults(func=predict_process)
+
+    budget = commands.add_parser('analytics',
+                                 help=thermal_budget.__doc__.strip())
+    budget.add_argument('runs', nargs='*',
+                        help='Directories of the runs, by default all the '
+                             'runs of the runs directory.')
+    budget.add_argument('--activation-energy', type=float, default=100e3,
+                        help='Activation energy in J/mol weighting the '
+                             'thermal dose.')
+    budget.add_argument('--reference-temperature', type=float,
+                        default=400.0,
+                        help='Temperature in C at which the dose is '
+                             'expressed.')
+    budget.add_argument('--threshold', type=float, action='append',
+                        help='Temperature in C above which the time spent '
+                             'is computed (can be repeated).')
+    budget.add_argument('--base-temperature', type=float, default=25.0,
+                        help='Temperature in C above which the '
+                             'degree-seconds are integrated.')
+    budget.add_argument('--rate-window', type=float, default=10.0,
+                        help='Period in s over which the ramp rates are '
+                             'computed.')
+    budget.add_argument('--workers', type=int,
+                        help='Number of processes, by default the number of '
+                             'CPUs.')
+    budget.add_argument('--no-cache', action='store_true',
+                        help='Do not use nor update the cache.')
+    budget.add_argument('--json', action='store_true',
+                        help='Print the full results as JSON.')
+    budget.set_defaults(func=thermal_budget)
+
+    attach = commands.add_parser('attach',
+                                 help=attach_service.__doc__.strip())
+    attach.add_argument('--stop', action='store_true',
+                        help='Request the process to stop.')
+    attach.add_argument('--verbose', action='store_true',
+                        help='Print the latest values of each batch.')
+    attach.add_argument('--profile', action='store_true',
+                        help='Start profiling the actuator.')
+    attach.add_argument('--allocations', action='store_true',
+                        help='Also trace the allocations when profiling.')
+    attach.add_argument('--stop-profile', action='store_true',
+                        help='Stop profiling the actuator.')
+    attach.set_defaults(func=attach_service)
+
+    prof = commands.add_parser('profile', help=show_profile.__doc__.strip())
+    prof.add_argument('run', help='Directory of the run.')
+    prof.add_argument('--top', type=int, default=20,
+                      help='Number of functions and allocation sites shown.')
+    prof.set_defaults(func=show_profile)
+
+    watch = commands.add_parser('watch', help=watch_stream.__doc__.strip())
+    watch.add_argument('--url', default='http://127.0.0.1:8765',
+                       help='URL of the telemetry server.')
+    watch.add_argument('--history', type=int, default=0,
+                       help='Number of points of history to fetch first.')
+    watch.set_defaults(func=watch_stream)
+
+    return parser
+
+
+def main(argv=None):
+
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
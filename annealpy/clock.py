@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Clock shared by the actuator, the steps and the recorder.
+
+All the times of a run are measured using the monotonic clock of the system,
+as integer nanoseconds elapsed since the start of the run, and are hence not
+affected by adjustments of the wall clock. The wall clock time at the start is
+recorded as an anchor to convert run times to dates.
+
+"""
+import time
+
+
+class Clock(object):
+    """Monotonic clock counting from the start of a run.
+
+    """
+    __slots__ = ('start_ns', 'wall_anchor')
+
+    def __init__(self):
+        self.start_ns = time.monotonic_ns()
+        # Wall clock time (in s since the epoch) at start_ns.
+        self.wall_anchor = time.time()
+
+    def now_ns(self):
+        """Integer number of nanoseconds elapsed since the start.
+
+        """
+        return time.monotonic_ns() - self.start_ns
+
+    def now(self):
+        """Number of seconds elapsed since the start.
+
+        """
+        return (time.monotonic_ns() - self.start_ns)*1e-9
+
+    def from_monotonic_ns(self, timestamp):
+        """Convert a time.monotonic_ns timestamp to the time of the run.
+
+        """
+        return timestamp - self.start_ns
+
+    def to_wall(self, seconds):
+        """Convert a time of the run in s to a wall clock time.
+
+        """
+        return self.wall_anchor + seconds
+
+    def anchor(self):
+        """Description of the anchor stored with the recordings.
+
+        """
+        return dict(monotonic_ns=self.start_ns, wall_time=self.wall_anchor)
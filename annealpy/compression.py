@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Online compression of the samples of continuous channels.
+
+Compressors receive the raw samples one by one and return the points that
+should be kept. Reconstructing the signal by linear interpolation between the
+kept points yields an error bounded by max_error for every raw sample.
+
+To keep the plots responsive, a point is kept at least every max_interval s.
+Around events (step transitions, ...) the compression can be suspended to keep
+full resolution windows.
+
+"""
+from collections import deque
+
+from atom.api import Atom, Enum, Float
+
+
+class CompressionConfig(Atom):
+    """Compression settings of a channel.
+
+    """
+    #: Compression algorithm to use.
+    method = Enum('swinging_door', 'deadband')
+
+    #: Maximal reconstruction error in the channel unit.
+    max_error = Float(0.1)
+
+    #: Maximal time in s between two kept points.
+    max_interval = Float(60)
+
+    #: Duration in s of the full resolution windows kept before and after an
+    #: event.
+    event_window = Float(30)
+
+    def create_compressor(self):
+        """Create a compressor matching the settings.
+
+        """
+        cls = (SwingingDoorCompressor if self.method == 'swinging_door' else
+               DeadbandCompressor)
+        return cls(self.max_error, self.max_interval, self.event_window)
+
+
+class BaseCompressor(object):
+    """Base class for online compressors.
+
+    Parameters
+    ----------
+    max_error : float
+        Maximal reconstruction error.
+    max_interval : float
+        Maximal time in s between two kept points.
+    event_window : float
+        Duration in s of the full resolution windows kept around events.
+
+    """
+    def __init__(self, max_error, max_interval=60, event_window=30):
+        self.max_error = max_error
+        self.max_interval = max_interval
+        self.event_window = event_window
+        self._archived = None
+        self._buffer = deque()
+        self._full_resolution_until = float('-inf')
+
+    def add(self, time, value):
+        """Add a raw sample and return the points that should be kept.
+
+        """
+        if self._archived is None or time < self._full_resolution_until:
+            return self._archive(time, value)
+
+        dt = time - self._archived[0]
+        if dt <= 0:
+            return []
+
+        entry = self._extend(time, value, dt)
+        if entry is not None and dt <= self.max_interval:
+            self._buffer.append(entry)
+            return []
+
+        if not self._buffer:
+            return self._archive(time, value)
+
+        kept = self._archive(*self._close(self._buffer[-1]))
+        return kept + self.add(time, value)
+
+    def mark_event(self, time):
+        """Keep full resolution around an event occuring at time.
+
+        The samples buffered within event_window before the event are returned
+        and the compression is suspended for event_window after it.
+
+        """
+        kept = []
+        start = time - self.event_window
+        buffered = list(self._buffer)
+        index = 0
+        while index < len(buffered) and buffered[index][0] < start:
+            index += 1
+        if index:
+            kept += self._archive(*self._close(buffered[index - 1]))
+        for entry in buffered[index:]:
+            kept += self._archive(entry[0], entry[1])
+        self._full_resolution_until = time + self.event_window
+        return kept
+
+    def flush(self):
+        """Return the last point which is not yet kept.
+
+        """
+        if not self._buffer:
+            return []
+        return self._archive(*self._close(self._buffer[-1]))
+
+    # --- Private API ---------------------------------------------------------
+
+    def _archive(self, time, value):
+        """Keep a point and restart the compression from it.
+
+        """
+        self._archived = (time, value)
+        self._buffer.clear()
+        self._reset()
+        return [(time, value)]
+
+    def _reset(self):
+        """Reset the algorithm state after a point has been kept.
+
+        """
+        pass
+
+    def _extend(self, time, value, dt):
+        """Try to add a sample to the current segment.
+
+        Should return the entry to buffer or None if the sample cannot be
+        represented by the current segment.
+
+        """
+        raise NotImplementedError()
+
+    def _close(self, entry):
+        """Compute the point to keep to close the segment at a buffered entry.
+
+        """
+        raise NotImplementedError()
+
+
+class SwingingDoorCompressor(BaseCompressor):
+    """Swinging door compression.
+
+    We keep track of the range of slopes for which a line starting from the
+    last kept point passes within max_error of all the samples. When this range
+    becomes empty, a point is kept at the time of the previous sample, its
+    value being chosen on a line whose slope lies within the range. This
+    guarantees the bound on the reconstruction error.
+
+    """
+    def _reset(self):
+        self._low = float('-inf')
+        self._high = float('inf')
+
+    def _extend(self, time, value, dt):
+        archived_value = self._archived[1]
+        low = max(self._low, (value - self.max_error - archived_value)/dt)
+        high = min(self._high, (value + self.max_error - archived_value)/dt)
+        if low > high:
+            return None
+        self._low, self._high = low, high
+        return (time, value, low, high)
+
+    def _close(self, entry):
+        time, value, low, high = entry
+        archived_time, archived_value = self._archived
+        dt = time - archived_time
+        slope = min(max((value - archived_value)/dt, low), high)
+        return time, archived_value + slope*dt
+
+
+class DeadbandCompressor(BaseCompressor):
+    """Deadband compression.
+
+    A point is kept when a sample differs from the last kept value by more than
+    max_error. The last kept value is repeated at the end of the plateau so
+    that the reconstruction is valid both for linear interpolation and
+    sample-and-hold.
+
+    """
+    def _extend(self, time, value, dt):
+        if abs(value - self._archived[1]) > self.max_error:
+            return None
+        return (time, value)
+
+    def _close(self, entry):
+        return entry[0], self._archived[1]
@@ -9,12 +9,27 @@
 """Wrapper around NiDAQmx to control the annealer.
 
 """
-from typing import Optional
+import os
+import time
+from typing import Callable, Optional, Sequence, Tuple
 
-from atom.api import Atom, Bool, Dict, Float, Str, Typed, FloatRange, List
+import numpy as np
+
+from atom.api import (Atom, Bool, Dict, Enum, Float, Str, Typed, FloatRange,
+                      List, Int, Value)
+
+from ..channels import ChannelRegistry, create_array_converter
+from ..identification import ThermalModel
+from .waveform import (HardwareWaveformPlayer, ThreadWaveformPlayer,
+                       WaveformPlayer)
 
 try:
-    import nidaqmx
+    # The fake driver is used for tests and benchmarks without hardware.
+    if os.environ.get('ANNEALPY_FAKE_NIDAQMX'):
+        from ..testing import fake_nidaqmx as nidaqmx
+    else:
+        import nidaqmx
+        import nidaqmx.stream_writers
 except ImportError:
     print('NIDAQmx does not seem to be installed. Running in simulation mode.')
     nidaqmx = None
@@ -34,6 +49,14 @@ class AnnealerDaq(Atom):
     regulator is meant to be used for slow ramps or when a stable temperature
     is required over extended periods of time.
 
+    Additional input channels can be declared in the channel registry of the
+    config (see channels.ChannelRegistry) and read using the function returned
+    by create_inputs_reader. Furnaces with several heater zones are controlled
+    through the functions returned by create_zones_reader and
+    create_zones_writer, the heater switch being shared by all the zones.
+    Precomputed regulator commands can be played at a fixed rate using
+    create_heater_reg_waveform.
+
     """
     #: Id of the NI-DAQ used to control the annealer.
     device_id = Str('Dev1')
@@ -76,14 +99,78 @@ class AnnealerDaq(Atom):
     #: Minimal value that can be used by the regulator.
     heater_reg_min_value = FloatRange(low=0.0, high=5.0)
 
+    #: Resolution in bits of the analog outputs (0-5 V range).
+    ao_resolution_bits = Int(12)
+
+    #: Maximal time in s between two writes to an output. Outputs are
+    #: re-written at least this often even if their value did not change.
+    output_refresh_interval = Float(10.0)
+
+    #: Thermal model (see identification.ThermalModel.to_dict) used to
+    #: simulate the furnace when NIDAQmx is not available. If empty the
+    #: simulated temperature is constant.
+    simulation_model = Dict()
+
+    #: Standard deviation in C of the noise added to the simulated
+    #: temperature.
+    simulation_noise = Float()
+
+    #: Fraction of the command of the neighbouring zones felt by a zone of
+    #: the simulated furnace.
+    simulation_coupling = Float()
+
+    #: Gain applied to the command of each zone of the simulated furnace
+    #: (1 for the zones which are not listed).
+    simulation_zone_gains = List(Float())
+
+    #: Number of temperature samples acquired per read (1 for on demand
+    #: reads, see read_temperature_block).
+    temperature_oversampling = Int(1)
+
+    #: Rate in Hz at which oversampled temperature samples are acquired.
+    temperature_sample_rate = Float(1000.0)
+
+    #: Timing of the regulator waveforms: 'hardware' uses the sample clock of
+    #: the DAQ, 'software' a writer thread and 'auto' the sample clock when
+    #: the analog outputs of the device support it.
+    ao_waveform_timing = Enum('auto', 'hardware', 'software')
+
+    #: Size in samples of the output buffer used by hardware timed
+    #: waveforms, longer waveforms being streamed.
+    waveform_buffer_size = Int(4096)
+
+    #: Channels of the DAQ. The ids of the control channels are taken from it.
+    channels = Typed(ChannelRegistry)
+
     def __init__(self, config: dict) -> None:
         for attr in ('device_id', 'heater_switch_id',
-                     'heater_reg_id', 'temperature_id'):
+                     'heater_reg_id', 'temperature_id',
+                     'heater_switch_on_value', 'heater_switch_off_value',
+                     'heater_reg_max_value', 'heater_reg_min_value',
+                     'ao_resolution_bits', 'output_refresh_interval',
+                     'simulation_model', 'simulation_noise',
+                     'simulation_coupling', 'simulation_zone_gains',
+                     'ao_waveform_timing', 'waveform_buffer_size'):
             if attr in config:
                 setattr(self, attr, config[attr])
 
+        self.channels = channels = ChannelRegistry.from_daq_config(config)
+        self.temperature_id = channels['temperature'].physical_id
+        for attr, name in (('heater_switch_id', 'heater_switch'),
+                           ('heater_reg_id', 'heater_regulation')):
+            setattr(self, attr, [channels[name].readback_id,
+                                 channels[name].physical_id])
+        self._convert_temperature = \
+            channels['temperature'].create_converter()
+
     def initialize(self) -> None:
         if nidaqmx is None:
+            if self.simulation_model:
+                model = ThermalModel.from_dict(self.simulation_model)
+                self._simulator = model.create_simulator(model.ambient)
+                self._zone_simulators = [
+                    model.create_simulator(model.ambient)
+                    for _ in self.channels.zone_inputs]
             return
         # Validate that the device we will use exist.
         devices = nidaqmx.system.System.local().devices
@@ -100,16 +187,23 @@ class AnnealerDaq(Atom):
                 full_id = self.device_id + '/' + getattr(self, ch_id)
                 task = nidaqmx.Task()
                 self._tasks[task_id] = task
-                mode = nidaqmx.constants.TerminalConfiguration.DIFFERENTIAL
+                mode = self._terminal_configuration('temperature')
                 task.ai_channels.add_ai_voltage_chan(full_id,
                                                      terminal_config=mode)
+                if self.temperature_oversampling > 1:
+                    finite = nidaqmx.constants.AcquisitionType.FINITE
+                    task.timing.cfg_samp_clk_timing(
+                        self.temperature_sample_rate, sample_mode=finite,
+                        samps_per_chan=self.temperature_oversampling)
             else:
                 tasks = (nidaqmx.Task(), nidaqmx.Task())
                 self._tasks[task_id] = tasks
 
                 # Input channel
                 full_id = self.device_id + '/' + getattr(self, ch_id)[0]
-                mode = nidaqmx.constants.TerminalConfiguration.RSE
+                mode = self._terminal_configuration(
+                    'heater_switch' if task_id == 'heater_switch' else
+                    'heater_regulation')
                 tasks[0].ai_channels.add_ai_voltage_chan(full_id,
                                                          terminal_config=mode)
 
@@ -132,7 +226,11 @@ class AnnealerDaq(Atom):
 
         """
         if not nidaqmx:
-            return 20
+            temperature = (20 if self._simulator is None else
+                           self._simulator.read(time.monotonic()))
+            if self.simulation_noise and self.temperature_oversampling <= 1:
+                temperature += np.random.normal(0, self.simulation_noise)
+            return temperature
 
         if 'temperature' not in self._tasks:
             msg = ('The connection to the DAQ must be established prior to '
@@ -141,16 +239,367 @@ class AnnealerDaq(Atom):
 
         temp_volt = self._tasks['temperature'].read()
 
-        # XXX do conversion
-        temperature = temp_volt
+        return self._convert_temperature(temp_volt)
+
+    def read_temperature_block(self) -> Tuple[int, list]:
+        """Acquire temperature_oversampling temperature samples at once.
+
+        The samples are acquired at temperature_sample_rate using the DAQ
+        sample clock. Returns the time.monotonic_ns timestamp at which the
+        acquisition started along with the samples, sample i being acquired
+        i/temperature_sample_rate s later.
+
+        """
+        count = self.temperature_oversampling
+        start = time.monotonic_ns()
+        if count <= 1:
+            return start, [self.read_temperature()]
+
+        if not nidaqmx:
+            temperature = self.read_temperature()
+            return start, ([temperature]*count if not self.simulation_noise
+                           else (temperature + np.random.normal(
+                               0, self.simulation_noise, count)).tolist())
+
+        if 'temperature' not in self._tasks:
+            msg = ('The connection to the DAQ must be established prior to '
+                   'reading the temperature by calling `initialize`')
+            raise RuntimeError(msg)
+
+        task = self._tasks['temperature']
+        temp_volts = task.read(number_of_samples_per_channel=count)
+        task.stop()
+
+        return start, self._convert_temperature(np.asarray(temp_volts))
+
+    def create_inputs_reader(self,
+                             names: Sequence[str]) -> Callable[[], list]:
+        """Create a function reading auxiliary input channels at once.
 
-        return temperature
+        The function returns the converted values in the order of names. All
+        the channels are read by a single task, created on the first call.
+
+        """
+        configs = [self.channels[name] for name in names]
+        converters = [c.create_converter() for c in configs]
+        if not nidaqmx:
+            noise = self.simulation_noise
+            values = [conv(0.0) for conv in converters]
+            if not noise:
+                return lambda: list(values)
+            return lambda: (np.asarray(values) +
+                            np.random.normal(0, noise, len(values))).tolist()
+
+        key = 'inputs:' + ','.join(names)
+        if key not in self._tasks:
+            task = nidaqmx.Task()
+            self._tasks[key] = task
+            for config in configs:
+                task.ai_channels.add_ai_voltage_chan(
+                    self.device_id + '/' + config.physical_id,
+                    terminal_config=self._terminal_configuration(config.name))
+        read = self._tasks[key].read
+        if len(converters) == 1:
+            convert = converters[0]
+            return lambda: [convert(read())]
+
+        def reader() -> list:
+            return [conv(v) for conv, v in zip(converters, read())]
+
+        return reader
+
+    def create_zones_reader(self) -> Callable[[], np.ndarray]:
+        """Create a function reading the temperatures of all the heater zones.
+
+        All the zone inputs are acquired by a single read of a multi-channel
+        task and converted at once. The function returns an array ordered by
+        zone.
+
+        """
+        inputs = self.channels.zone_inputs
+        if not inputs:
+            raise ValueError('The DAQ config does not declare heater zones.')
+        count = len(inputs)
+
+        if not nidaqmx:
+            simulators = self._zone_simulators
+            noise = self.simulation_noise
+
+            def simulate() -> np.ndarray:
+                now = time.monotonic()
+                temperatures = (np.array([s.read(now) for s in simulators])
+                                if simulators else np.full(count, 20.0))
+                if noise:
+                    temperatures += np.random.normal(0, noise, count)
+                return temperatures
+
+            return simulate
+
+        if 'zones_in' not in self._tasks:
+            task = nidaqmx.Task()
+            self._tasks['zones_in'] = task
+            for config in inputs:
+                task.ai_channels.add_ai_voltage_chan(
+                    self.device_id + '/' + config.physical_id,
+                    terminal_config=self._terminal_configuration(config.name))
+        read = self._tasks['zones_in'].read
+        convert = create_array_converter(inputs)
+        return lambda: convert(np.asarray(read()))
+
+    def create_zones_writer(self) -> Callable[[np.ndarray], None]:
+        """Create a function writing the regulator states of all the zones.
+
+        The states (in [0, 1] and ordered by zone) are written by a single
+        call to a multi-channel task. As for create_heater_reg_writer, the
+        caller is responsible for keeping track of the states.
+
+        """
+        outputs = self.channels.zone_outputs
+        if not outputs:
+            raise ValueError('The DAQ config does not declare heater zones.')
+
+        if not nidaqmx:
+            return lambda values: self._simulate_command(zones=values)
+
+        if 'zones_out' not in self._tasks:
+            task = nidaqmx.Task()
+            self._tasks['zones_out'] = task
+            for config in outputs:
+                task.ao_channels.add_ao_voltage_chan(
+                    self.device_id + '/' + config.physical_id,
+                    min_val=0, max_val=5)
+        write = self._tasks['zones_out'].write
+        offset = self.heater_reg_min_value
+        span = self.heater_reg_max_value - offset
+
+        def writer(values: np.ndarray) -> None:
+            write((values*span + offset).tolist())
+
+        return writer
+
+    def quantize_heater_reg_state(self, value: float) -> float:
+        """Round a regulator state to the closest value the DAC can produce.
+
+        """
+        return self.create_heater_reg_quantizer()(value)
+
+    def create_heater_reg_quantizer(self) -> Callable[[float], float]:
+        """Create a function rounding a regulator state to the DAC resolution.
+
+        The returned function does not access the Atom members and is meant
+        to be used in control loops.
+
+        """
+        offset = self.heater_reg_min_value
+        span = self.heater_reg_max_value - offset
+        if span <= 0:
+            return lambda value: 1.0 if value > 1.0 else max(value, 0.0)
+
+        # Work in units of the least significant bit of the DAC.
+        lsb = 5.0/(2**self.ao_resolution_bits - 1)
+        low = offset/lsb
+        high = low + span/lsb
+        to_lsb = span/lsb
+        from_lsb = lsb/span
+
+        def quantize(value: float) -> float:
+            code = value*to_lsb + low
+            if code >= high:
+                return 1.0
+            elif code <= low:
+                return 0.0
+            state = (int(code + 0.5) - low)*from_lsb
+            # The code closest to a bound may lie slightly beyond it.
+            if state > 1.0:
+                return 1.0
+            return state if state > 0.0 else 0.0
+
+        return quantize
+
+    def create_heater_reg_writer(self) -> Callable[[float], None]:
+        """Create a function writing a regulator state to the DAQ.
+
+        The function directly writes to the underlying task, bypassing the
+        validation and the heater_reg_state member (which is not updated). It
+        is meant to be used in control loops, in which case the caller is
+        responsible for keeping track of the state and passing values in
+        [0, 1].
+
+        """
+        if not nidaqmx:
+            return lambda value: self._simulate_command(regulation=value)
+
+        if 'heater_reg' not in self._tasks:
+            msg = ('The connection to the DAQ must be established prior to '
+                   'writing the heater regulator state by calling `initialize`'
+                   )
+            raise RuntimeError(msg)
+
+        write = self._tasks['heater_reg'][1].write
+        offset = self.heater_reg_min_value
+        span = self.heater_reg_max_value - offset
+
+        def writer(value: float) -> None:
+            write(value*span + offset)
+
+        return writer
+
+    def create_heater_reg_waveform(self, commands: Sequence[float],
+                                   rate: float,
+                                   report: Optional[Callable] = None,
+                                   on_done: Optional[Callable] = None
+                                   ) -> WaveformPlayer:
+        """Create a player generating regulator states at a fixed rate.
+
+        The states are quantized to the DAC resolution (the samples of the
+        player). They are clocked by the DAQ sample clock if the device
+        supports it (see ao_waveform_timing) and written by a dedicated
+        thread otherwise. The player must be started and, as the writer
+        returned by create_heater_reg_writer, bypasses heater_reg_state. No
+        other write to the regulator should occur until it is done.
+
+        """
+        quantize = self.create_heater_reg_quantizer()
+        samples = np.array([quantize(c) for c in commands])
+        if not len(samples):
+            raise ValueError('A waveform requires at least one sample.')
+        if not nidaqmx or not self._hardware_timed_waveforms():
+            return ThreadWaveformPlayer(samples, rate,
+                                        self.create_heater_reg_writer(),
+                                        report, on_done)
+
+        if 'heater_reg' not in self._tasks:
+            msg = ('The connection to the DAQ must be established prior to '
+                   'writing the heater regulator state by calling `initialize`'
+                   )
+            raise RuntimeError(msg)
+
+        # The output is generated by a dedicated task, the on demand one
+        # being idle meanwhile.
+        task = nidaqmx.Task()
+        try:
+            task.ao_channels.add_ao_voltage_chan(
+                self.device_id + '/' + self.heater_reg_id[1],
+                min_val=0, max_val=5)
+            size = self.waveform_buffer_size
+            task.timing.cfg_samp_clk_timing(
+                rate, sample_mode=nidaqmx.constants.AcquisitionType.CONTINUOUS,
+                samps_per_chan=size)
+            task.out_stream.output_buf_size = size
+            task.out_stream.regen_mode = \
+                nidaqmx.constants.RegenerationMode.DONT_ALLOW_REGENERATION
+        except Exception:
+            task.close()
+            raise
+        writer = nidaqmx.stream_writers.AnalogSingleChannelWriter(
+            task.out_stream, auto_start=False)
+        offset = self.heater_reg_min_value
+        span = self.heater_reg_max_value - offset
+        # Waiting for space in the buffer takes at most a buffer duration.
+        timeout = 2*size/rate + 10.0
+
+        def close():
+            try:
+                task.stop()
+            finally:
+                task.close()
+
+        return HardwareWaveformPlayer(
+            samples, rate, samples*span + offset, size,
+            lambda volts: writer.write_many_sample(volts, timeout=timeout),
+            lambda: task.out_stream.total_samp_per_chan_generated,
+            task.start, close, report, on_done)
+
+    def create_heater_switch_writer(self) -> Callable[[bool], None]:
+        """Create a function writing the heater switch state to the DAQ.
+
+        Similar to create_heater_reg_writer.
+
+        """
+        if not nidaqmx:
+            return lambda value: self._simulate_command(switch=value)
+
+        if 'heater_switch' not in self._tasks:
+            msg = ('The connection to the DAQ must be established prior to '
+                   'writing the heater switch state by calling `initialize`')
+            raise RuntimeError(msg)
+
+        write = self._tasks['heater_switch'][1].write
+        on_value = self.heater_switch_on_value
+        off_value = self.heater_switch_off_value
+
+        def writer(value: bool) -> None:
+            write(on_value if value else off_value)
+
+        return writer
 
     # --- Private API ---------------------------------------------------------
 
     #: NiDAQ tasks used to control the physical DAQ
     _tasks = Dict(Str())
 
+    #: Simulator of the furnace used in simulation mode.
+    _simulator = Value()
+
+    #: Conversion of the temperature channel voltages.
+    _convert_temperature = Value()
+
+    def _hardware_timed_waveforms(self) -> bool:
+        """Whether the waveforms are clocked by the DAQ.
+
+        """
+        if self.ao_waveform_timing != 'auto':
+            return self.ao_waveform_timing == 'hardware'
+        try:
+            device = nidaqmx.system.System.local().devices[self.device_id]
+            return bool(device.ao_samp_clk_supported)
+        except Exception:
+            return False
+
+    def _terminal_configuration(self, name: str):
+        """Terminal configuration of the input of a channel.
+
+        """
+        return getattr(nidaqmx.constants.TerminalConfiguration,
+                       self.channels[name].terminal.upper())
+
+    #: Simulated (switch, regulation) outputs.
+    _simulated_outputs = Value((False, 0.0))
+
+    #: Simulators of the zones of the furnace used in simulation mode.
+    _zone_simulators = List()
+
+    #: Simulated regulator states of the zones.
+    _simulated_zones = Value()
+
+    def _simulate_command(self, switch=None, regulation=None,
+                          zones=None) -> None:
+        """Update the command of the simulated furnace.
+
+        """
+        old_switch, old_regulation = self._simulated_outputs
+        switch = old_switch if switch is None else switch
+        regulation = old_regulation if regulation is None else regulation
+        self._simulated_outputs = (switch, regulation)
+        if self._simulator is not None:
+            self._simulator.command = float(switch)*regulation
+
+        if zones is not None:
+            self._simulated_zones = zones
+        zones = self._simulated_zones
+        if zones is not None and self._zone_simulators:
+            # Each zone also receives part of the power of its neighbours.
+            neighbours = np.zeros(len(zones))
+            neighbours[1:] += zones[:-1]
+            neighbours[:-1] += zones[1:]
+            gains = np.ones(len(zones))
+            given = self.simulation_zone_gains[:len(zones)]
+            gains[:len(given)] = given
+            commands = float(switch)*gains*(
+                zones + self.simulation_coupling*neighbours)
+            for simulator, command in zip(self._zone_simulators, commands):
+                simulator.command = float(command)
+
     def _default_heater_switch_state(self) -> bool:
         """Get the value from the DAQ on first read.
 
@@ -173,6 +622,7 @@ class AnnealerDaq(Atom):
 
         """
         if not nidaqmx:
+            self._simulate_command(switch=new)
             return new
 
         if 'heater_switch' not in self._tasks:
@@ -200,9 +650,11 @@ class AnnealerDaq(Atom):
             raise RuntimeError(msg)
 
         value = self._tasks['heater_reg'][0].read()
-        return round(((value - self.heater_reg_min_value) /
-                     (self.heater_reg_max_value - self.heater_reg_min_value)),
-                     2)
+        state = round(((value - self.heater_reg_min_value) /
+                      (self.heater_reg_max_value - self.heater_reg_min_value)),
+                      2)
+        # The output idles at 0 V, which can lie below the minimal value.
+        return min(max(state, 0.0), 1.0)
 
     def _post_validate_heater_reg_state(self,
                                         old: Optional[float],
@@ -211,6 +663,7 @@ class AnnealerDaq(Atom):
 
         """
         if not nidaqmx:
+            self._simulate_command(regulation=new)
             return new
 
         if 'heater_reg' not in self._tasks:
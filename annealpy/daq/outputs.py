@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Output layer avoiding redundant writes to the DAQ outputs.
+
+"""
+from threading import Lock
+
+
+class DeduplicatedOutput(object):
+    """Output skipping writes that would not change the hardware state.
+
+    Commands are first quantized to the resolution of the output. A command
+    equal to the last written value is not written, unless the last write is
+    older than the refresh interval in which case it is written again to act
+    as a safety heartbeat. While the output is driven by another writer (a
+    waveform player), the values it generates are tracked and the refresh is
+    suspended.
+
+    Parameters
+    ----------
+    write : callable
+        Callable taking the new value and writing it to the hardware.
+    quantize : callable, optional
+        Callable mapping a command to the value actually produced by the
+        hardware.
+    refresh_interval : float
+        Maximal time in s between two hardware writes. Zero disables the
+        refresh.
+
+    """
+    def __init__(self, write, quantize=None, refresh_interval=10.0):
+        self.value = None
+        self.last_write = 0.0
+        self.writes = 0
+        self.skipped = 0
+        self.refresh_interval = refresh_interval
+        #: Whether the output is driven by another writer.
+        self.external = False
+        self._write = write
+        self._quantize = quantize
+        self._lock = Lock()
+
+    def update(self, value, now):
+        """Request a new value for the output.
+
+        Returns
+        -------
+        changed : bool
+            Whether the output value changed, ie whether the new value should
+            be reported in the telemetry.
+
+        """
+        if self._quantize is not None:
+            value = self._quantize(value)
+
+        # Fast path, the refresh thread only ever re-writes the same value so
+        # there is no need to lock.
+        if value == self.value and not self._refresh_due(now):
+            self.skipped += 1
+            return False
+
+        with self._lock:
+            changed = value != self.value
+            self._write(value)
+            self.value = value
+            self.last_write = now
+            self.writes += 1
+        return changed
+
+    def refresh(self, now):
+        """Re-write the current value if the last write is too old.
+
+        """
+        with self._lock:
+            if (self.value is not None and not self.external and
+                    self._refresh_due(now)):
+                self._write(self.value)
+                self.last_write = now
+                self.writes += 1
+
+    def track(self, value, now):
+        """Record a value written to the hardware by another writer.
+
+        Returns whether the output value changed.
+
+        """
+        with self._lock:
+            changed = value != self.value
+            self.value = value
+            self.last_write = now
+        return changed
+
+    # --- Private API ---------------------------------------------------------
+
+    def _refresh_due(self, now):
+        """Check whether the refresh interval elapsed since the last write.
+
+        """
+        return (self.refresh_interval > 0 and
+                now - self.last_write >= self.refresh_interval)
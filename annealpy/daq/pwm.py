@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Time-proportioning (slow PWM) drive of an on/off output.
+
+The output is cycled with a fixed period, being on for duty*period s at the
+start of each cycle. A dedicated thread schedules the edges against their
+deadlines, sleeping until shortly before them and spinning for the remaining
+time as the waveform writer thread does (see waveform.ThreadWaveformPlayer).
+
+"""
+import time
+from threading import Event, Thread
+
+from .waveform import raise_thread_priority
+
+
+def effective_duty(duty, period, min_pulse):
+    """Duty actually applied during a cycle.
+
+    The duty is clipped to [0, 1] and the pulses (on or off) shorter than
+    min_pulse are suppressed, to spare the switch.
+
+    """
+    duty = min(max(duty, 0.0), 1.0)
+    if min_pulse > 0:
+        fraction = min_pulse/period
+        if duty < fraction:
+            return 0.0
+        if duty > 1.0 - fraction:
+            return 1.0
+    return duty
+
+
+class TimeProportioningOutput(object):
+    """On/off output driven with a duty cycle.
+
+    The duty is read at the start of each cycle and can be changed at any
+    time from another thread through the duty attribute.
+
+    Parameters
+    ----------
+    write : callable
+        Function writing the state (bool) of the output.
+    period : float
+        Duration of a cycle in s.
+    min_pulse : float
+        Minimal duration of a pulse in s.
+    report : callable, optional
+        Callback called from the timing thread with the new state and the
+        time.monotonic_ns timestamp of each edge once written.
+
+    """
+    #: Time in s before an edge during which the thread spins instead of
+    #: sleeping, to compensate for the inaccuracy of the sleep.
+    spin = 2e-3
+
+    def __init__(self, write, period, min_pulse=0.0, report=None):
+        if period <= 0:
+            raise ValueError('The cycle period must be positive.')
+        self.period = period
+        self.min_pulse = min_pulse
+        self.report = report
+        #: Requested duty between 0 and 1.
+        self.duty = 0.0
+        #: Current state of the output, None before the first edge.
+        self.state = None
+        #: Number of cycles started.
+        self.cycles = 0
+        #: Largest delay in s between the deadline of an edge and its write.
+        self.max_lateness = 0.0
+        #: Error which interrupted the timing thread, if any.
+        self.error = None
+        self._write = write
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start the timing thread.
+
+        """
+        self._thread.start()
+
+    def stop(self):
+        """Stop cycling the output and wait for the thread to end.
+
+        The output keeps its current state.
+
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    # --- Private API ---------------------------------------------------------
+
+    def _run(self):
+        """Cycle the output until stopped.
+
+        """
+        try:
+            self._cycle()
+        except Exception as e:
+            self.error = e
+
+    def _cycle(self):
+        """Write the edges of each cycle at their deadline.
+
+        """
+        raise_thread_priority()
+        period = round(self.period*1e9)
+        start = time.monotonic_ns() + round(self.spin*1e9)
+        cycle = 0
+        while True:
+            cycle_start = start + cycle*period
+            if not self._wait_until(cycle_start):
+                return
+            self.cycles += 1
+            duty = effective_duty(self.duty, self.period, self.min_pulse)
+            on = round(duty*period)
+            self._set(on > 0, cycle_start)
+            if 0 < on < period:
+                if not self._wait_until(cycle_start + on):
+                    return
+                self._set(False, cycle_start + on)
+            # Skip the cycles missed when the thread was held up for more
+            # than a period.
+            cycle = max(cycle + 1, (time.monotonic_ns() - start)//period)
+
+    def _wait_until(self, deadline):
+        """Wait for a time.monotonic_ns deadline.
+
+        Returns False if the output was stopped meanwhile.
+
+        """
+        remaining = deadline - time.monotonic_ns() - self.spin*1e9
+        if remaining > 0 and self._stop.wait(remaining*1e-9):
+            return False
+        while time.monotonic_ns() < deadline:
+            pass
+        return not self._stop.is_set()
+
+    def _set(self, state, deadline):
+        """Write the state of the output if it changed.
+
+        """
+        if state == self.state:
+            return
+        before = time.monotonic_ns()
+        self._write(state)
+        # The edge is stamped at the middle of the write.
+        edge = (before + time.monotonic_ns())//2
+        self.state = state
+        lateness = (before - deadline)*1e-9
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        if self.report is not None:
+            self.report(state, edge)
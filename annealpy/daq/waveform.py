@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Generation of precomputed command waveforms on an analog output.
+
+When the device supports it, the waveform is clocked by the sample clock of
+the DAQ (HardwareWaveformPlayer): the samples are written to the buffer of the
+output and streamed in chunks as the buffer empties, so that waveforms longer
+than the buffer can be played. Otherwise a dedicated writer thread
+(ThreadWaveformPlayer) writes each sample at its time, sleeping until shortly
+before it and spinning for the remaining time.
+
+In both cases, the report callback is called from the thread of the player
+with the range [start, stop) of the samples generated since the last call,
+sample i being generated at start_ns + i/rate s (start_ns being a
+time.monotonic_ns timestamp).
+
+"""
+import os
+import sys
+import threading
+import time
+from threading import Event, Thread
+
+import numpy as np
+
+
+class WaveformPlayer(object):
+    """Base class of the waveform players.
+
+    Parameters
+    ----------
+    samples : np.ndarray
+        Commands to generate.
+    rate : float
+        Rate in Hz at which the samples are generated.
+    report : callable, optional
+        Callback called with the range of the newly generated samples.
+    on_done : callable, optional
+        Callback called once the generation ended.
+
+    """
+    def __init__(self, samples, rate, report=None, on_done=None):
+        self.samples = np.asarray(samples, dtype=float)
+        self.rate = rate
+        self.report = report
+        self.on_done = on_done
+        #: time.monotonic_ns timestamp at which the first sample is generated.
+        self.start_ns = 0
+        #: Number of samples generated so far.
+        self.generated = 0
+        #: Error which interrupted the generation, if any.
+        self.error = None
+        self._stop = Event()
+        self._done = Event()
+        self._thread = Thread(target=self._play, daemon=True)
+
+    @property
+    def hardware_timed(self):
+        """Whether the samples are clocked by the DAQ.
+
+        """
+        return False
+
+    @property
+    def done(self):
+        """Whether the generation ended.
+
+        """
+        return self._done.is_set()
+
+    @property
+    def duration(self):
+        """Duration of the waveform in s.
+
+        """
+        return len(self.samples)/self.rate
+
+    def start(self):
+        """Start the generation.
+
+        """
+        self._thread.start()
+
+    def stop(self):
+        """Interrupt the generation and wait for the thread to end.
+
+        The output keeps the last generated value.
+
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def wait(self, timeout=None):
+        """Wait for the end of the generation.
+
+        Returns True if the generation ended.
+
+        """
+        return self._done.wait(timeout)
+
+    # --- Private API ---------------------------------------------------------
+
+    def _play(self):
+        """Generate the samples, signaling the end of the generation.
+
+        """
+        try:
+            self._generate()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+            if self.on_done is not None:
+                self.on_done()
+
+    def _generate(self):
+        """Generate the samples.
+
+        """
+        raise NotImplementedError()
+
+    def _report(self, start, stop):
+        """Report the generation of the samples in [start, stop).
+
+        """
+        self.generated = stop
+        if self.report is not None and stop > start:
+            self.report(start, stop)
+
+
+class HardwareWaveformPlayer(WaveformPlayer):
+    """Player relying on the sample clock of the DAQ.
+
+    The task must be configured for a timed generation of buffer_size samples
+    (regenerating the buffer being disallowed) before being passed.
+
+    Parameters
+    ----------
+    volts : np.ndarray
+        Voltages corresponding to the samples.
+    buffer_size : int
+        Size of the buffer of the output in samples.
+    write : callable
+        Function writing an array of voltages to the buffer, blocking until
+        there is space in it.
+    generated : callable
+        Function returning the number of samples generated by the device.
+    start_task : callable
+        Function starting the generation.
+    close_task : callable
+        Function stopping the generation and releasing the task.
+
+    """
+    #: Maximal interval in s at which the progress is polled.
+    poll_interval = 0.05
+
+    def __init__(self, samples, rate, volts, buffer_size, write, generated,
+                 start_task, close_task, report=None, on_done=None):
+        super().__init__(samples, rate, report, on_done)
+        # The buffer is padded with the last value so that the generation
+        # does not underflow between its end and the stop of the task.
+        self._volts = np.concatenate((volts, np.full(buffer_size,
+                                                     volts[-1])))
+        self._buffer_size = buffer_size
+        self._write = write
+        self._generated = generated
+        self._start_task = start_task
+        self._close_task = close_task
+
+    @property
+    def hardware_timed(self):
+        """Whether the samples are clocked by the DAQ.
+
+        """
+        return True
+
+    def start(self):
+        """Fill the buffer and start the generation.
+
+        """
+        written = min(len(self._volts), self._buffer_size)
+        self._write(self._volts[:written])
+        self.start_ns = time.monotonic_ns()
+        self._start_task()
+        self._written = written
+        super().start()
+
+    # --- Private API ---------------------------------------------------------
+
+    #: Number of samples written to the buffer.
+    _written = 0
+
+    def _generate(self):
+        """Refill the buffer as it empties until all samples are generated.
+
+        """
+        count = len(self.samples)
+        volts = self._volts
+        chunk = max(self._buffer_size//2, 1)
+        interval = min(self.poll_interval, chunk/self.rate/2)
+        try:
+            while not self._stop.is_set():
+                generated = min(self._generated(), count)
+                self._report(self.generated, generated)
+                if generated >= count:
+                    break
+                written = self._written
+                space = self._buffer_size - (written - self._generated())
+                if written < len(volts) and space >= chunk:
+                    self._write(volts[written:written + chunk])
+                    self._written = min(written + chunk, len(volts))
+                else:
+                    self._stop.wait(interval)
+        finally:
+            self._close_task()
+
+
+class ThreadWaveformPlayer(WaveformPlayer):
+    """Player writing each sample from a dedicated thread.
+
+    When the thread falls behind, the samples whose time passed are skipped
+    and the most recent one is written.
+
+    Parameters
+    ----------
+    write : callable
+        Function writing a single sample.
+
+    """
+    #: Time in s before a sample during which the thread spins instead of
+    #: sleeping, to compensate for the inaccuracy of the sleep.
+    spin = 2e-3
+
+    def __init__(self, samples, rate, write, report=None, on_done=None):
+        super().__init__(samples, rate, report, on_done)
+        self._write_sample = write
+
+    def start(self):
+        """Start the writer thread.
+
+        """
+        # Leave the thread some time to start before the first sample.
+        self.start_ns = time.monotonic_ns() + round(self.spin*1e9)
+        super().start()
+
+    # --- Private API ---------------------------------------------------------
+
+    def _generate(self):
+        """Write the samples at their time.
+
+        """
+        raise_thread_priority()
+        samples = self.samples.tolist()
+        count = len(samples)
+        write = self._write_sample
+        wait = self._stop.wait
+        monotonic_ns = time.monotonic_ns
+        start = self.start_ns
+        period = 1e9/self.rate
+        spin = self.spin*1e9
+        index = 0
+        while index < count:
+            deadline = start + round(index*period)
+            remaining = deadline - monotonic_ns()
+            if remaining > spin and wait((remaining - spin)*1e-9):
+                return
+            while monotonic_ns() < deadline:
+                pass
+            if self._stop.is_set():
+                return
+            # Skip the samples whose time already passed.
+            index = max(index, min(int((monotonic_ns() - start)/period),
+                                   count - 1))
+            write(samples[index])
+            self._report(index, index + 1)
+            index += 1
+
+
+def raise_thread_priority():
+    """Raise the priority of the calling thread, if allowed.
+
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        # THREAD_PRIORITY_TIME_CRITICAL
+        kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 15)
+        return
+    # A real-time scheduling policy is avoided on purpose: the thread spins
+    # before each sample and would starve the other threads of the process.
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), -10)
+    except (AttributeError, OSError):
+        pass
@@ -0,0 +1,566 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Prediction of the outcome of a process using a thermal model.
+
+The steps of the process are executed against a VirtualActuator, which
+exposes the same interface as the actuator driving the DAQ but simulates the
+furnace using a thermal model (see identification.ThermalModel) and runs in
+virtual time: sleeping only advances a virtual clock. The time resolution of
+the simulation is the period of the model, so that a control loop running
+faster than the model is executed once per period, which allows to simulate a
+day long process in a few seconds at most.
+
+The prediction gives for each step its duration, the heater energy, the peak
+temperature and the overshoot, and flags the steps which end before the
+temperature reaches their target.
+
+"""
+import math
+from collections import deque
+from threading import Event
+
+import numpy as np
+
+from .channels import ChannelRegistry
+from .daq.pwm import effective_duty
+from .identification import select_model
+from .metrics import DEFAULT_TOLERANCE, StepMetrics, estimate_slope
+
+
+class VirtualClock(object):
+    """Clock of a virtual run, only advancing when asked to.
+
+    """
+    __slots__ = ('time',)
+
+    def __init__(self):
+        self.time = 0.0
+
+    def now_ns(self):
+        """Integer number of nanoseconds elapsed since the start.
+
+        """
+        return round(self.time*1e9)
+
+    def now(self):
+        """Number of seconds elapsed since the start.
+
+        """
+        return self.time
+
+
+class VirtualWaveform(object):
+    """Regulator waveform played in virtual time.
+
+    Mimics the interface of the waveform players (see daq.waveform), the
+    samples being applied as the virtual clock advances.
+
+    """
+    hardware_timed = False
+
+    def __init__(self, samples, rate, start):
+        self.samples = np.asarray(samples, dtype=float)
+        self.rate = rate
+        self.start = start
+        self.generated = 0
+        self.error = None
+
+    @property
+    def done(self):
+        """Whether all the samples were applied.
+
+        """
+        return self.generated >= len(self.samples)
+
+    def next_time(self):
+        """Virtual time of the next sample.
+
+        """
+        return self.start + self.generated/self.rate
+
+    def apply(self, actuator):
+        """Apply the next sample.
+
+        """
+        actuator.set_heater_reg(float(self.samples[self.generated]))
+        self.generated += 1
+
+    def stop(self):
+        """Stop applying the samples.
+
+        """
+        self.generated = len(self.samples)
+
+    def wait(self, timeout=None):
+        """Whether the waveform is done, the virtual time not advancing.
+
+        """
+        return self.done
+
+
+class VirtualPWM(object):
+    """Time-proportioned heater switch driven in virtual time.
+
+    Mimics daq.pwm.TimeProportioningOutput, the edges being applied as the
+    virtual clock advances.
+
+    """
+    max_lateness = 0.0
+    error = None
+
+    def __init__(self, period, min_pulse, start):
+        self.period = period
+        self.min_pulse = min_pulse
+        self.duty = 0.0
+        self.cycles = 0
+        self.done = False
+        self._cycle_start = start
+        self._off = None
+
+    def next_time(self):
+        """Virtual time of the next edge.
+
+        """
+        if self._off is not None:
+            return self._off
+        return self._cycle_start
+
+    def apply(self, actuator):
+        """Apply the next edge.
+
+        """
+        if self._off is not None:
+            self._off = None
+            actuator.heater_switch_state = False
+            return
+        duty = effective_duty(self.duty, self.period, self.min_pulse)
+        actuator.heater_switch_state = duty > 0
+        if 0 < duty < 1:
+            self._off = self._cycle_start + duty*self.period
+        self._cycle_start += self.period
+        self.cycles += 1
+
+    def stop(self):
+        """Stop cycling the switch.
+
+        """
+        self.done = True
+
+
+class VirtualActuator(object):
+    """Actuator simulating the furnace in virtual time.
+
+    Parameters
+    ----------
+    models : list
+        ThermalModel of the furnace. The widest one is used to simulate the
+        furnace, the steps get the one best suited to their target.
+    initial_temperature : float
+        Temperature of the furnace at the start.
+    resolution : float
+        Minimal time in s by which the clock advances when sleeping.
+    zone_count : int
+        Number of heater zones of the furnace.
+    coupling : float
+        Fraction of the command of the neighbouring zones felt by a zone.
+    heater_power : float
+        Power of the heater in W when fully on.
+    max_duration : float
+        Virtual time in s after which a stop is requested, used to end the
+        steps waiting for a temperature that is never reached.
+
+    """
+    def __init__(self, models, initial_temperature, resolution, zone_count=0,
+                 coupling=0.0, heater_power=1.0, max_duration=math.inf):
+        self.clock = VirtualClock()
+        self.stop_event = Event()
+        self.checkpoint_pid = None
+        self.temperature_group_delay = 0.0
+        self.resolution = resolution
+        self.max_duration = max_duration
+        self.heater_power = heater_power
+        self.models = models
+        model = select_model(models)
+        self._simulator = model.create_simulator(initial_temperature)
+        self._simulator.read(0.0)
+        self._zone_simulators = [model.create_simulator(initial_temperature)
+                                 for _ in range(zone_count)]
+        for simulator in self._zone_simulators:
+            simulator.read(0.0)
+        self._coupling = coupling
+        self._switch = False
+        self._regulation = 0.0
+        self._zone_outputs = np.zeros(zone_count)
+        self._metrics = None
+        self._waveform = None
+        self._pwm = None
+        self._peak = -math.inf
+        #: Times and temperatures read by the steps.
+        self.times = []
+        self.temperatures = []
+        #: Events marked by the steps as (time, kind, infos).
+        self.events = []
+
+    def read_temperature(self):
+        """Simulated temperature at the current virtual time.
+
+        """
+        now = self.clock.time
+        temperature = self._simulator.read(now)
+        self._add_temperature(now, temperature, temperature)
+        return temperature
+
+    def wait_until(self, threshold, rising=True, timeout=None, interval=0.01,
+                   anticipation=0.0):
+        """Wait for the temperature to cross a threshold.
+
+        See ActuatorSubprocess.wait_until.
+
+        """
+        predicate = threshold if callable(threshold) else None
+        clock = self.clock
+        deadline = None if timeout is None else clock.time + timeout
+        history = deque(maxlen=4)
+        while True:
+            now = clock.time
+            value = self.read_temperature()
+            if predicate is not None:
+                if predicate(value):
+                    return True
+            else:
+                distance = threshold - value if rising else value - threshold
+                if distance <= 0:
+                    return True
+                history.append((now, value))
+                slope = estimate_slope(history)
+                speed = slope if rising else -slope
+                if speed > 0 and distance/speed <= anticipation:
+                    return True
+
+            delay = interval
+            if deadline is not None:
+                if deadline - now <= 0:
+                    return False
+                delay = min(delay, deadline - now)
+            if not self.sleep(delay):
+                return False
+
+    def sleep(self, duration):
+        """Advance the virtual clock by at least the resolution.
+
+        Returns False once the maximal duration is exceeded.
+
+        """
+        clock = self.clock
+        end = clock.time + max(duration, self.resolution)
+        # Apply the changes of the outputs driven in the background in
+        # chronological order.
+        drivers = [d for d in (self._waveform, self._pwm) if d is not None]
+        while True:
+            pending = [(d.next_time(), i) for i, d in enumerate(drivers)
+                       if not d.done]
+            if not pending:
+                break
+            at, index = min(pending)
+            if at > end:
+                break
+            clock.time = max(at, clock.time)
+            drivers[index].apply(self)
+        clock.time = end
+        if clock.time > self.max_duration:
+            self.stop_event.set()
+        return not self.stop_event.is_set()
+
+    def mark_event(self, kind, **infos):
+        """Record an event.
+
+        """
+        self.events.append((self.clock.time, kind, infos))
+
+    def get_thermal_model(self, temperature=None):
+        """Get the model best suited to a temperature.
+
+        """
+        return select_model(self.models, temperature)
+
+    @property
+    def heater_switch_state(self):
+        """State of the simulated heater switch.
+
+        """
+        return self._switch
+
+    @heater_switch_state.setter
+    def heater_switch_state(self, value):
+        self._switch = bool(value)
+        self._update_command()
+
+    @property
+    def heater_reg_state(self):
+        """State of the simulated heater regulation.
+
+        """
+        return self._regulation
+
+    @heater_reg_state.setter
+    def heater_reg_state(self, value):
+        self.set_heater_reg(value)
+
+    def set_heater_reg(self, value):
+        """Set the state of the heater regulation.
+
+        """
+        value = min(max(value, 0.0), 1.0)
+        if value != self._regulation:
+            self._regulation = value
+            self._update_command()
+
+    def play_heater_reg(self, commands, rate):
+        """Play states of the heater regulation as the clock advances.
+
+        """
+        self._waveform = VirtualWaveform(commands, rate, self.clock.time)
+        return self._waveform
+
+    def start_switch_pwm(self, period, min_pulse=0.0):
+        """Cycle the heater switch as the clock advances.
+
+        """
+        self._pwm = VirtualPWM(period, min_pulse, self.clock.time)
+        return self._pwm
+
+    def stop_switch_pwm(self, pwm):
+        """Stop cycling the heater switch.
+
+        """
+        pwm.stop()
+
+    def read_zone_temperatures(self):
+        """Simulated temperatures of the heater zones.
+
+        """
+        now = self.clock.time
+        temperatures = np.array([s.read(now) for s in self._zone_simulators])
+        self._add_temperature(now, float(temperatures.mean()),
+                              float(temperatures.max()))
+        return temperatures
+
+    @property
+    def zone_outputs(self):
+        """Regulator states of the heater zones as an array.
+
+        """
+        return self._zone_outputs.copy()
+
+    def set_zone_outputs(self, values):
+        """Set the regulator states of all the heater zones.
+
+        """
+        self._zone_outputs = np.clip(values, 0.0, 1.0)
+        self._update_command()
+
+    def start_step(self, step):
+        """Start computing the metrics of a step.
+
+        """
+        now = self.clock.time
+        tolerance = getattr(step, 'allowed_error', 0) or DEFAULT_TOLERANCE
+        self._metrics = StepMetrics(now,
+                                    getattr(step, 'target_temperature', None),
+                                    tolerance, self.heater_power)
+        self._metrics.set_command(now, self._command())
+        self._peak = -math.inf
+
+    def end_step(self):
+        """Metrics of the step started last, with its peak temperature.
+
+        """
+        metrics = self._metrics.as_dict(self.clock.time)
+        metrics['peak_temperature'] = (self._peak if self._peak > -math.inf
+                                       else None)
+        self._metrics = None
+        return metrics
+
+    # --- Private API ---------------------------------------------------------
+
+    def _add_temperature(self, now, temperature, peak):
+        """Record a temperature read by a step.
+
+        """
+        self.times.append(now)
+        self.temperatures.append(temperature)
+        if peak > self._peak:
+            self._peak = peak
+        if self._metrics is not None:
+            self._metrics.add_temperature(now, temperature)
+
+    def _command(self):
+        """Heater command between 0 and 1 (mean of the zones if any).
+
+        """
+        if len(self._zone_outputs):
+            return float(self._switch)*float(self._zone_outputs.mean())
+        return float(self._switch)*self._regulation
+
+    def _update_command(self):
+        """Apply the current outputs to the simulated furnace.
+
+        """
+        now = self.clock.time
+        # Advance the simulation up to now with the previous command.
+        self._simulator.read(now)
+        self._simulator.command = float(self._switch)*self._regulation
+
+        zones = self._zone_outputs
+        if len(zones):
+            neighbours = np.zeros(len(zones))
+            neighbours[1:] += zones[:-1]
+            neighbours[:-1] += zones[1:]
+            commands = float(self._switch)*(zones +
+                                            self._coupling*neighbours)
+            for simulator, command in zip(self._zone_simulators,
+                                          commands.tolist()):
+                simulator.read(now)
+                simulator.command = command
+
+        if self._metrics is not None:
+            self._metrics.set_command(now, self._command())
+
+
+def dry_run(steps, models, daq_config=None, initial_temperature=None,
+            resolution=None, max_duration=None):
+    """Predict the outcome of the execution of steps.
+
+    Parameters
+    ----------
+    steps : list
+        Steps of the process.
+    models : list
+        ThermalModel of the furnace.
+    daq_config : dict, optional
+        Config of the DAQ, giving the heater zones and power.
+    initial_temperature : float, optional
+        Temperature at the start, the ambient temperature of the model by
+        default.
+    resolution : float, optional
+        Time resolution of the simulation, the period of the model by default.
+    max_duration : float, optional
+        Virtual time after which the execution is interrupted, by default
+        twice the sum of the durations of the steps plus one day.
+
+    Returns
+    -------
+    prediction : dict
+        Predicted 'duration', 'energy' and 'peak_temperature' of the whole
+        process, 'steps' the metrics of each step (see StepMetrics) with the
+        peak temperature, the planned duration, the time the furnace needs to
+        reach the target ('required_time', inf if it cannot reach it) and
+        whether the step is too short to reach its target ('too_short'),
+        'truncated' whether the execution was interrupted and 'times' and
+        'temperatures' the predicted temperature curve.
+
+    """
+    daq_config = daq_config or {}
+    model = select_model(models)
+    if model is None:
+        raise ValueError('A thermal model is required to predict the '
+                         'execution of a process.')
+    if initial_temperature is None:
+        initial_temperature = model.ambient
+    if max_duration is None:
+        max_duration = 2*sum(getattr(s, 'duration', 0.0) for s in steps)
+        max_duration += 86400
+    registry = ChannelRegistry.from_daq_config(daq_config)
+    actuator = VirtualActuator(
+        models, initial_temperature, resolution or model.dt,
+        len(registry.zone_inputs), daq_config.get('simulation_coupling', 0.0),
+        daq_config.get('heater_power', 1.0), max_duration)
+
+    results = []
+    temperature = initial_temperature
+    for i, step in enumerate(steps):
+        if actuator.stop_event.is_set():
+            break
+        actuator.start_step(step)
+        step.run(actuator)
+        metrics = actuator.end_step()
+        metrics.update(step=i, type=type(step).__name__,
+                       planned_duration=getattr(step, 'duration', None))
+        target = metrics.get('target')
+        if target is not None:
+            reached = metrics['time_to_band']
+            metrics['required_time'] = (
+                reached if reached is not None else
+                time_to_reach(actuator.get_thermal_model(target), temperature,
+                              target, metrics['duration']))
+            metrics['too_short'] = reached is None
+        results.append(metrics)
+        if actuator.temperatures:
+            temperature = actuator.temperatures[-1]
+
+    peaks = [m['peak_temperature'] for m in results
+             if m['peak_temperature'] is not None]
+    return dict(duration=actuator.clock.time,
+                energy=sum(m['energy'] for m in results),
+                peak_temperature=max(peaks) if peaks else None,
+                steps=results,
+                truncated=actuator.stop_event.is_set(),
+                times=np.array(actuator.times),
+                temperatures=np.array(actuator.temperatures))
+
+
+def time_to_reach(model, initial_temperature, target, horizon):
+    """Time needed by the furnace to reach a target at full power.
+
+    The furnace is heated (or cooled) at full power from the initial
+    temperature, the dead time of the model included. Returns inf if the
+    target is beyond the steady state of the model or is not reached within
+    ten times the horizon.
+
+    """
+    heating = target > initial_temperature
+    steady = model.ambient + (model.gain if heating else 0.0)
+    if (steady - target)*(1 if heating else -1) < 0:
+        return math.inf
+    count = int(10*max(horizon, model.dt)/model.dt) + 1
+    # The full power only acts on the temperature after the dead time.
+    temperatures = model.simulate(np.full(count, 1.0 if heating else 0.0),
+                                  initial_temperature,
+                                  [0.0 if heating else 1.0])
+    crossed = np.flatnonzero(temperatures >= target if heating else
+                             temperatures <= target)
+    return float(crossed[0]*model.dt) if len(crossed) else math.inf
+
+
+def format_prediction(prediction):
+    """Format a prediction, one line per step.
+
+    """
+    def fmt(value, unit, digits='.3g'):
+        return '-' if value is None else f'{value:{digits}}{unit}'
+
+    lines = [f"Duration {fmt(prediction['duration'], ' s', '.0f')}, "
+             f"energy {fmt(prediction['energy'], '')}, "
+             f"peak {fmt(prediction['peak_temperature'], ' C', '.1f')}"]
+    if prediction['truncated']:
+        lines.append('The execution was interrupted: a step waits for a '
+                     'temperature the furnace does not reach.')
+    for m in prediction['steps']:
+        line = (f"step {m['step']} ({m['type']}): "
+                f"{fmt(m['duration'], ' s', '.0f')}, "
+                f"energy {fmt(m['energy'], '')}, "
+                f"peak {fmt(m['peak_temperature'], ' C', '.1f')}")
+        if 'target' in m:
+            line += f", overshoot {fmt(m['overshoot'], ' C')}"
+            if m['too_short']:
+                line += (f", TOO SHORT: needs "
+                         f"{fmt(m['required_time'], ' s', '.0f')} to reach "
+                         f"{m['target']:.1f} C")
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Export of the run data to CSV, Parquet or HDF5 files.
+
+The data are processed by chunks of {channel: (times, values)} arrays, read
+either from a recording or from the data held by the application, so that the
+memory used does not depend on the length of the run.
+
+Without resampling, the samples are written in long format (time, channel,
+value). When resampling, all channels are brought onto a common time base of
+fixed period and written in wide format (time followed by one column per
+channel): continuous channels are linearly interpolated and stepped channels
+forward-filled.
+
+Parquet requires pyarrow and HDF5 requires h5py.
+
+"""
+import os
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+#: Supported formats with their file extensions.
+FORMATS = {'csv': ('.csv',),
+           'parquet': ('.parquet', '.pq'),
+           'hdf5': ('.h5', '.hdf5')}
+
+
+def guess_format(path):
+    """Determine the export format from the extension of a file.
+
+    """
+    extension = os.path.splitext(path)[1].lower()
+    for name, extensions in FORMATS.items():
+        if extension in extensions:
+            return name
+    raise ValueError(f'Cannot determine the export format of {path}, valid '
+                     f'formats are {list(FORMATS)}.')
+
+
+def recording_chunks(recording):
+    """Iterate over the data of a RunRecording by chunks.
+
+    """
+    for _, records in recording.iter_chunks():
+        yield recording.split_by_channel(records)
+
+
+def channel_status_chunks(channels, chunk_size=65536):
+    """Iterate over the data held by the application by chunks.
+
+    Parameters
+    ----------
+    channels : dict
+        {name: ChannelStatus} of the channels to export.
+    chunk_size : int
+        Number of samples of the densest channel per chunk.
+
+    """
+    data = {}
+    for name, ch_status in channels.items():
+        data[name] = ch_status.get_samples()
+
+    # Split on time windows so that each chunk contains all the channels.
+    densest = max((t for t, _ in data.values()), key=len, default=())
+    edges = list(densest[chunk_size::chunk_size]) + [np.inf]
+    start = {name: 0 for name in data}
+    for edge in edges:
+        chunk = {}
+        for name, (times, values) in data.items():
+            stop = int(np.searchsorted(times, edge, 'left'))
+            if stop > start[name]:
+                chunk[name] = (times[start[name]:stop],
+                               values[start[name]:stop])
+                start[name] = stop
+        yield chunk
+
+
+class Resampler(object):
+    """Bring chunks of samples onto a common time base.
+
+    Grid points are emitted once all continuous channels have samples beyond
+    them, the samples needed for later grid points being kept between chunks.
+    The channels without samples yet and the ones without samples for more
+    than max_gap (such as the channels of a finished step) do not hold the
+    grid points back, their last value being held.
+
+    Parameters
+    ----------
+    kinds : dict
+        {name: kind} of the channels, kind being 'continuous' or 'stepped'.
+    period : float
+        Period of the time base in s.
+    max_gap : float
+        Duration in s after which a silent continuous channel is considered
+        finished.
+
+    """
+    def __init__(self, kinds, period, max_gap=60.0):
+        if period <= 0:
+            raise ValueError('The resampling period must be positive.')
+        self.kinds = kinds
+        self.period = period
+        self.max_gap = max_gap
+        self._buffers = {name: (np.empty(0), np.empty(0)) for name in kinds}
+        self._next = 0
+
+    def add(self, chunk):
+        """Add a chunk of samples and return the resampled values available.
+
+        Returns the times of the grid points and {name: values}.
+
+        """
+        for name, (times, values) in chunk.items():
+            old_times, old_values = self._buffers[name]
+            self._buffers[name] = (np.concatenate((old_times, times)),
+                                   np.concatenate((old_values, values)))
+
+        newest = max((t[-1] for t, _ in self._buffers.values() if len(t)),
+                     default=-np.inf)
+        lasts = (self._buffers[n][0][-1] for n, k in self.kinds.items()
+                 if k == 'continuous' and len(self._buffers[n][0]))
+        bound = min((t for t in lasts if newest - t <= self.max_gap),
+                    default=newest)
+        return self._emit(bound)
+
+    def flush(self):
+        """Resample up to the last sample of all the channels.
+
+        """
+        bound = max((t[-1] for t, _ in self._buffers.values() if len(t)),
+                    default=-np.inf)
+        return self._emit(bound)
+
+    # --- Private API ---------------------------------------------------------
+
+    def _emit(self, bound):
+        """Compute the values at the grid points up to bound.
+
+        """
+        last = int(np.floor(bound/self.period)) if np.isfinite(bound) else -1
+        grid = np.arange(self._next, last + 1)*self.period
+        if not len(grid):
+            return grid, {name: np.empty(0) for name in self.kinds}
+        self._next = last + 1
+
+        columns = {}
+        for name, kind in self.kinds.items():
+            times, values = self._buffers[name]
+            if not len(times):
+                columns[name] = np.full(len(grid), np.nan)
+                continue
+            index = np.searchsorted(times, grid, 'right') - 1
+            if kind == 'continuous':
+                column = np.interp(grid, times, values)
+            else:
+                column = values[np.maximum(index, 0)].astype(float)
+            # No value is known before the first sample.
+            column[index < 0] = np.nan
+            columns[name] = column
+            # Keep the last sample preceding the next grid point.
+            keep = max(int(np.searchsorted(times, grid[-1], 'right')) - 1, 0)
+            self._buffers[name] = (times[keep:], values[keep:])
+        return grid, columns
+
+
+class CSVWriter(object):
+    """Write the exported data as CSV.
+
+    """
+    def __init__(self, path, columns=None):
+        self._file = open(path, 'w')
+        self._columns = columns
+        header = ('time,channel,value' if columns is None else
+                  ','.join(['time'] + list(columns)))
+        self._file.write(header + '\n')
+
+    def write_samples(self, name, times, values):
+        """Write samples of a channel in long format.
+
+        """
+        if len(times):
+            row = f'%.6f,{name},%.9g\n'
+            flat = np.empty(2*len(times))
+            flat[0::2] = times
+            flat[1::2] = values
+            # Format the whole chunk at once rather than row by row.
+            self._file.write((row*len(times)) % tuple(flat.tolist()))
+
+    def write_rows(self, times, columns):
+        """Write resampled values in wide format.
+
+        """
+        if len(times):
+            table = np.column_stack([times] +
+                                    [columns[c] for c in self._columns])
+            row = ','.join(['%.6f'] + ['%.9g']*len(self._columns)) + '\n'
+            self._file.write((row*len(times)) % tuple(table.ravel().tolist()))
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(object):
+    """Write the exported data as Parquet (requires pyarrow).
+
+    """
+    def __init__(self, path, columns=None):
+        if pyarrow is None:
+            raise RuntimeError('pyarrow is required to export to Parquet.')
+        self._columns = columns
+        if columns is None:
+            schema = pyarrow.schema(
+                [('time', pyarrow.float64()),
+                 ('channel', pyarrow.dictionary(pyarrow.int8(),
+                                                pyarrow.string())),
+                 ('value', pyarrow.float64())])
+        else:
+            schema = pyarrow.schema([('time', pyarrow.float64())] +
+                                    [(c, pyarrow.float64()) for c in columns])
+        self._schema = schema
+        self._writer = pyarrow.parquet.ParquetWriter(path, schema)
+
+    def write_samples(self, name, times, values):
+        if len(times):
+            channel = pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array(np.zeros(len(times), np.int8)),
+                pyarrow.array([name]))
+            self._writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(times), channel, pyarrow.array(values)],
+                schema=self._schema))
+
+    def write_rows(self, times, columns):
+        if len(times):
+            arrays = [pyarrow.array(times)]
+            arrays += [pyarrow.array(columns[c]) for c in self._columns]
+            self._writer.write_table(pyarrow.Table.from_arrays(
+                arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class HDF5Writer(object):
+    """Write the exported data as HDF5 (requires h5py).
+
+    Samples are stored in a group per channel holding time and value
+    datasets. Resampled values are stored in a time dataset and a dataset per
+    channel.
+
+    """
+    def __init__(self, path, columns=None):
+        if h5py is None:
+            raise RuntimeError('h5py is required to export to HDF5.')
+        self._file = h5py.File(path, 'w')
+        self._columns = columns
+
+    def write_samples(self, name, times, values):
+        if len(times):
+            self._append(f'{name}/time', times)
+            self._append(f'{name}/value', values)
+
+    def write_rows(self, times, columns):
+        if len(times):
+            self._append('time', times)
+            for c in self._columns:
+                self._append(c, columns[c])
+
+    def close(self):
+        self._file.close()
+
+    def _append(self, name, data):
+        """Append data to a resizable dataset, creating it if necessary.
+
+        """
+        if name not in self._file:
+            self._file.create_dataset(name, data=data, maxshape=(None,),
+                                      chunks=True)
+        else:
+            dataset = self._file[name]
+            size = len(dataset)
+            dataset.resize((size + len(data),))
+            dataset[size:] = data
+
+
+#: Writer class of each format.
+WRITERS = {'csv': CSVWriter, 'parquet': ParquetWriter, 'hdf5': HDF5Writer}
+
+
+def export(chunks, kinds, path, format=None, period=None):
+    """Export chunks of data to a file.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Chunks of {channel: (times, values)} arrays.
+    kinds : dict
+        {name: kind} of the exported channels.
+    path : str
+        Path of the file to create.
+    format : str, optional
+        One of FORMATS, guessed from the extension of the path by default.
+    period : float, optional
+        Period in s of the common time base, None to export the samples as
+        recorded.
+
+    Returns
+    -------
+    rows : int
+        Number of rows written.
+
+    """
+    format = format or guess_format(path)
+    if period is None:
+        writer = WRITERS[format](path)
+        rows = 0
+        try:
+            for chunk in chunks:
+                for name, (times, values) in chunk.items():
+                    writer.write_samples(name, times, values)
+                    rows += len(times)
+        finally:
+            writer.close()
+        return rows
+
+    resampler = Resampler(kinds, period)
+    writer = WRITERS[format](path, list(kinds))
+    rows = 0
+    try:
+        for chunk in chunks:
+            times, columns = resampler.add(chunk)
+            writer.write_rows(times, columns)
+            rows += len(times)
+        times, columns = resampler.flush()
+        writer.write_rows(times, columns)
+        rows += len(times)
+    finally:
+        writer.close()
+    return rows
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Filtering of oversampled inputs ahead of the control loops.
+
+At each loop iteration a block of oversampling samples is acquired at
+sample_rate and processed at once by the filter, which returns a single clean
+value. Stateful filters carry their state from one block to the next as if the
+blocks were contiguous.
+
+Each filter exposes its group delay in s (at low frequency), ie by how much
+the filtered value lags behind the measured signal.
+
+"""
+import math
+
+import numpy as np
+from atom.api import Atom, Enum, Float, Int
+
+try:
+    from scipy import signal
+except ImportError:
+    signal = None
+
+
+class FilterConfig(Atom):
+    """Filter settings of an input channel.
+
+    """
+    #: Filter to use.
+    method = Enum('boxcar', 'median', 'ema', 'butterworth')
+
+    #: Number of samples acquired per loop iteration.
+    oversampling = Int(10)
+
+    #: Rate in Hz at which the samples of a block are acquired.
+    sample_rate = Float(1000.0)
+
+    #: Cutoff frequency in Hz of the EMA and Butterworth filters.
+    cutoff = Float(10.0)
+
+    #: Order of the Butterworth filter.
+    order = Int(2)
+
+    def create_filter(self):
+        """Create a filter matching the settings.
+
+        """
+        if self.method == 'boxcar':
+            return BoxcarFilter(self.sample_rate)
+        elif self.method == 'median':
+            return MedianFilter(self.sample_rate)
+        elif self.method == 'ema':
+            return EMAFilter(self.sample_rate, self.cutoff)
+        return ButterworthFilter(self.sample_rate, self.cutoff, self.order)
+
+
+class BaseFilter(object):
+    """Base class for the filters.
+
+    Parameters
+    ----------
+    sample_rate : float
+        Rate in Hz at which the samples of a block are acquired.
+
+    """
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+
+    def group_delay(self, block_size):
+        """Group delay in s for blocks of block_size samples.
+
+        """
+        raise NotImplementedError()
+
+    def process(self, block):
+        """Filter a block of samples and return the value at its end.
+
+        """
+        raise NotImplementedError()
+
+
+class BoxcarFilter(BaseFilter):
+    """Average of the block (boxcar filter followed by decimation).
+
+    """
+    def group_delay(self, block_size):
+        return (block_size - 1)/2/self.sample_rate
+
+    def process(self, block):
+        return float(np.mean(block))
+
+
+class MedianFilter(BaseFilter):
+    """Median of the block, robust to isolated spikes.
+
+    """
+    def group_delay(self, block_size):
+        return (block_size - 1)/2/self.sample_rate
+
+    def process(self, block):
+        return float(np.median(block))
+
+
+class EMAFilter(BaseFilter):
+    """First order low-pass filter (exponential moving average).
+
+    The value at the end of the block is computed as a dot product with
+    precomputed weights.
+
+    """
+    def __init__(self, sample_rate, cutoff):
+        super().__init__(sample_rate)
+        tau = 1/(2*math.pi*cutoff)
+        self.alpha = 1 - math.exp(-1/(sample_rate*tau))
+        self._value = None
+        self._weights = {}
+
+    def group_delay(self, block_size):
+        return (1 - self.alpha)/self.alpha/self.sample_rate
+
+    def process(self, block):
+        block = np.asarray(block, dtype=float)
+        size = len(block)
+        if self._value is None:
+            self._value = float(block[0])
+        weights = self._weights.get(size)
+        if weights is None:
+            decay = (1 - self.alpha)**np.arange(size - 1, -1, -1)
+            weights = self._weights[size] = (self.alpha*decay,
+                                             (1 - self.alpha)**size)
+        self._value = float(weights[0] @ block + weights[1]*self._value)
+        return self._value
+
+
+class ButterworthFilter(BaseFilter):
+    """Butterworth low-pass filter (requires scipy).
+
+    The filter is applied using second order sections whose state is kept
+    between blocks. The state is initialized to the steady state of the first
+    sample to avoid a start transient.
+
+    """
+    def __init__(self, sample_rate, cutoff, order=2):
+        if signal is None:
+            raise RuntimeError('scipy is required to use a Butterworth '
+                               'filter.')
+        super().__init__(sample_rate)
+        self.sos = signal.butter(order, cutoff, fs=sample_rate,
+                                 output='sos')
+        self._zi = None
+        b, a = signal.sos2tf(self.sos)
+        _, delay = signal.group_delay((b, a), w=[cutoff*1e-3],
+                                      fs=sample_rate)
+        self._delay = float(delay[0])/sample_rate
+
+    def group_delay(self, block_size):
+        return self._delay
+
+    def process(self, block):
+        block = np.asarray(block, dtype=float)
+        if self._zi is None:
+            self._zi = signal.sosfilt_zi(self.sos)*block[0]
+        filtered, self._zi = signal.sosfilt(self.sos, block, zi=self._zi)
+        return float(filtered[-1])
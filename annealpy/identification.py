@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Identification of the thermal dynamics of the furnace from recorded runs.
+
+The heater command is the product of the switch state and of the regulator
+state. The temperature and the command are resampled on a uniform grid of
+period dt and fitted with a discrete model:
+
+    T[k+1] = a1*T[k] (+ a2*T[k-1]) + b*u[k - delay] + c
+
+The first order version is the discrete equivalent of a first-order-plus-
+dead-time (FOPDT) model. The models for all the candidate delays are fitted at
+once by solving the stacked normal equations and the delay leading to the
+smallest residual is kept.
+
+"""
+import json
+import math
+import os
+
+import numpy as np
+from atom.api import Atom, Dict, Enum, Float, Int, List, Str
+
+from .recording import RunRecording
+
+#: Name of the file storing the identified models, in the runs directory.
+MODELS_FILE = 'thermal_models.json'
+
+#: Number of past temperatures used by each model order.
+ORDERS = {'fopdt': 1, 'second_order': 2}
+
+
+class ThermalModel(Atom):
+    """Discrete thermal model of the furnace.
+
+    """
+    #: Order of the model.
+    order = Enum(*ORDERS)
+
+    #: Sampling period of the model in s.
+    dt = Float(1.0)
+
+    #: Coefficients applied to the past temperatures.
+    a = List(Float())
+
+    #: Gain applied to the delayed command.
+    b = Float()
+
+    #: Constant term.
+    c = Float()
+
+    #: Dead time expressed in number of periods.
+    delay = Int()
+
+    #: Id of the furnace (DAQ device) the model describes.
+    furnace = Str()
+
+    #: Temperature range (low, high) over which the model was fitted, empty
+    #: if the model was fitted on all the samples.
+    temperature_band = List(Float())
+
+    #: Fit quality indicators (see identify).
+    quality = Dict()
+
+    @property
+    def gain(self):
+        """Steady state temperature increase in C for a full command.
+
+        """
+        return self.b/(1 - sum(self.a))
+
+    @property
+    def ambient(self):
+        """Steady state temperature in C with no command.
+
+        """
+        return self.c/(1 - sum(self.a))
+
+    @property
+    def time_constant(self):
+        """Dominant time constant of the model in s.
+
+        """
+        pole = max(abs(r) for r in np.roots([1.0] + [-x for x in self.a]))
+        if pole <= 0 or pole >= 1:
+            return math.inf
+        return -self.dt/math.log(pole)
+
+    @property
+    def dead_time(self):
+        """Dead time of the model in s.
+
+        """
+        return self.delay*self.dt
+
+    def contains(self, temperature):
+        """Check whether a temperature lies in the band of the model.
+
+        """
+        if not self.temperature_band:
+            return True
+        low, high = self.temperature_band
+        return low <= temperature <= high
+
+    def simulate(self, commands, initial_temperature, past_commands=None):
+        """Simulate the temperature for commands sampled every dt.
+
+        Parameters
+        ----------
+        commands : np.ndarray
+            Commands applied at each period.
+        initial_temperature : float
+            Temperature at the first period (the furnace is assumed to be at
+            equilibrium before).
+        past_commands : np.ndarray, optional
+            Commands applied before the first one, used to account for the
+            dead time. By default the first command is assumed.
+
+        Returns
+        -------
+        temperatures : np.ndarray
+            Temperature at each period (same length as commands).
+
+        """
+        commands = np.asarray(commands, dtype=float)
+        if past_commands is None:
+            past = np.full(self.delay, commands[0] if len(commands) else 0.0)
+        elif not self.delay:
+            # Without dead time, the past commands play no role.
+            past = np.empty(0)
+        else:
+            past = np.asarray(past_commands, dtype=float)[-self.delay:]
+            past = np.concatenate((np.full(self.delay - len(past), past[0]
+                                           if len(past) else 0.0), past))
+        delayed = np.concatenate((past, commands))[:len(commands)]
+        drive = (self.b*delayed + self.c).tolist()
+
+        temperatures = [initial_temperature]*len(commands)
+        if self.order == 'fopdt':
+            a1 = self.a[0]
+            current = initial_temperature
+            for k in range(len(commands) - 1):
+                current = a1*current + drive[k]
+                temperatures[k + 1] = current
+        else:
+            a1, a2 = self.a
+            previous = current = initial_temperature
+            for k in range(len(commands) - 1):
+                previous, current = (current,
+                                     a1*current + a2*previous + drive[k])
+                temperatures[k + 1] = current
+        return np.array(temperatures)
+
+    def create_simulator(self, initial_temperature):
+        """Create a simulator advancing the model in real time.
+
+        """
+        return ThermalSimulator(self, initial_temperature)
+
+    def to_dict(self):
+        """Serialize the model to a JSON compatible dict.
+
+        """
+        return {name: getattr(self, name) for name in self.members()}
+
+    @classmethod
+    def from_dict(cls, config):
+        """Rebuild a model serialized by to_dict.
+
+        """
+        return cls(**config)
+
+
+class ThermalSimulator(object):
+    """Simulate the furnace temperature in real time using a thermal model.
+
+    The command is set at any time and the temperature computed when read by
+    advancing the model by whole periods.
+
+    """
+    def __init__(self, model, initial_temperature):
+        self.model = model
+        self.command = 0.0
+        self._temperatures = [initial_temperature]*len(model.a)
+        self._commands = [0.0]*model.delay
+        self._last_time = None
+
+    def read(self, now):
+        """Temperature at time now (in s, on any monotonic clock).
+
+        """
+        if self._last_time is None:
+            self._last_time = now
+        model = self.model
+        steps = int((now - self._last_time)/model.dt)
+        if steps > 0:
+            self._last_time += steps*model.dt
+            a, b, c = model.a, model.b, model.c
+            temperatures = self._temperatures
+            commands = self._commands
+            for _ in range(steps):
+                commands.append(self.command)
+                delayed = commands.pop(0)
+                current = (sum(x*t for x, t in zip(a, temperatures)) +
+                           b*delayed + c)
+                temperatures.insert(0, current)
+                temperatures.pop()
+        return self._temperatures[0]
+
+
+def load_run(directory, dt=1.0):
+    """Load a recorded run resampled on a uniform grid.
+
+    Returns
+    -------
+    temperatures : np.ndarray
+        Temperature linearly interpolated at each period.
+    commands : np.ndarray
+        Heater command (switch state times regulator state) held at each
+        period.
+
+    """
+    recording = RunRecording(directory)
+    parts = {name: ([], []) for name in recording.channels}
+    for _, chunk in recording.iter_chunks():
+        for name, (times, values) in recording.split_by_channel(chunk).items():
+            parts[name][0].append(np.array(times))
+            parts[name][1].append(np.array(values))
+    channels = {name: (np.concatenate(t), np.concatenate(v))
+                for name, (t, v) in parts.items() if t}
+
+    if 'temperature' not in channels:
+        raise ValueError(f'No temperature recorded in {directory}')
+    times, temps = channels['temperature']
+    grid = np.arange(times[0], times[-1], dt)
+    temperatures = np.interp(grid, times, temps)
+
+    def hold(name):
+        if name not in channels:
+            return np.zeros(len(grid))
+        times, values = channels[name]
+        indexes = np.searchsorted(times, grid, 'right') - 1
+        return np.where(indexes >= 0, values[np.maximum(indexes, 0)], 0.0)
+
+    return temperatures, hold('heater_switch')*hold('heater_regulation')
+
+
+def identify(runs, order='fopdt', dt=1.0, max_delay=60.0,
+             temperature_band=None, furnace=''):
+    """Fit a thermal model to one or more resampled runs.
+
+    Parameters
+    ----------
+    runs : list
+        (temperatures, commands) pairs as returned by load_run.
+    order : {'fopdt', 'second_order'}
+        Order of the model.
+    dt : float
+        Period in s at which the runs were resampled.
+    max_delay : float
+        Largest dead time in s considered.
+    temperature_band : tuple, optional
+        (low, high) temperature range to which the fit is restricted.
+    furnace : str
+        Id of the furnace the runs were recorded on.
+
+    Returns
+    -------
+    model : ThermalModel
+        Best model. Its quality attribute holds the one step prediction rms
+        error, the free-running simulation rms error and coefficient of
+        determination (over the band) and the number of samples used.
+
+    """
+    n = ORDERS[order]
+    delays = np.arange(int(round(max_delay/dt)) + 1)
+    first = max(n - 1, delays[-1])
+    p = n + 2
+
+    # Accumulate the normal equations of all the candidate delays by blocks
+    # of rows to bound the memory usage.
+    gram = np.zeros((len(delays), p, p))
+    moments = np.zeros((len(delays), p))
+    squares = 0.0
+    count = 0
+    for rows, x, y in _iter_regressors(runs, n, delays, first,
+                                       temperature_band):
+        gram += np.einsum('dri,drj->dij', x, x)
+        moments += np.einsum('dri,r->di', x, y)
+        squares += y @ y
+        count += rows
+
+    if not count:
+        raise ValueError('No sample available to identify the model.')
+    try:
+        theta = np.linalg.solve(gram, moments)
+    except np.linalg.LinAlgError:
+        raise ValueError('The runs do not excite the furnace enough to '
+                         'identify a model.')
+    sse = (squares - 2*np.einsum('di,di->d', theta, moments) +
+           np.einsum('di,dij,dj->d', theta, gram, theta))
+    # Only the stable fits heating the furnace are usable: the others have
+    # no (or a negative) steady state.
+    for best in np.argsort(sse):
+        if _is_physical(theta[best], n):
+            break
+    else:
+        raise ValueError('No stable model with a positive gain fits the '
+                         'runs, they may not reach a steady state or not '
+                         'excite the furnace enough.')
+    coefficients = theta[best]
+
+    model = ThermalModel(order=order, dt=dt,
+                         a=[float(v) for v in coefficients[:n]],
+                         b=float(coefficients[n]),
+                         c=float(coefficients[n + 1]),
+                         delay=int(delays[best]), furnace=furnace,
+                         temperature_band=(list(temperature_band)
+                                           if temperature_band else []))
+
+    # Free running simulation, which is much more demanding than the one step
+    # ahead prediction used for the fit.
+    errors, measured = [], []
+    for temperatures, commands in runs:
+        simulated = model.simulate(commands, temperatures[0])
+        mask = np.ones(len(temperatures), dtype=bool)
+        if temperature_band is not None:
+            low, high = temperature_band
+            mask = (temperatures >= low) & (temperatures <= high)
+        errors.append((simulated - temperatures)[mask])
+        measured.append(temperatures[mask])
+    errors = np.concatenate(errors)
+    measured = np.concatenate(measured)
+    variance = measured.var()*len(measured)
+    residuals = sum(((x[0] @ coefficients - y)**2).sum()
+                    for _, x, y in _iter_regressors(runs, n,
+                                                    delays[best:best + 1],
+                                                    first, temperature_band))
+    model.quality = dict(
+        one_step_rmse=float(math.sqrt(residuals/count)),
+        simulation_rmse=float(np.sqrt((errors**2).mean())),
+        r2=float(1 - (errors**2).sum()/variance) if variance else 0.0,
+        samples=int(count))
+    return model
+
+
+def _iter_regressors(runs, order, delays, first, temperature_band,
+                     block=10000):
+    """Iterate over blocks of regressors for a set of candidate delays.
+
+    Yields the number of rows, the regressors as a (delays, rows, p) array
+    and the predicted temperatures.
+
+    """
+    for temperatures, commands in runs:
+        k_all = np.arange(first, len(temperatures) - 1)
+        if temperature_band is not None:
+            low, high = temperature_band
+            inside = temperatures[k_all]
+            k_all = k_all[(inside >= low) & (inside <= high)]
+        for pos in range(0, len(k_all), block):
+            k = k_all[pos:pos + block]
+            shape = (len(delays), len(k))
+            columns = [np.broadcast_to(temperatures[k - i], shape)
+                       for i in range(order)]
+            columns.append(commands[k[None, :] - delays[:, None]])
+            columns.append(np.ones(shape))
+            yield len(k), np.stack(columns, axis=-1), temperatures[k + 1]
+
+
+class ModelStore(object):
+    """JSON store of the thermal models per furnace and temperature band.
+
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def in_directory(cls, directory):
+        """Access the store living in a directory (usually the runs one).
+
+        """
+        return cls(os.path.join(directory, MODELS_FILE))
+
+    def models(self, furnace=None):
+        """List the stored models, optionally only those of a furnace.
+
+        """
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path) as f:
+            models = [ThermalModel.from_dict(m) for m in json.load(f)]
+        return [m for m in models if furnace is None or m.furnace == furnace]
+
+    def save(self, model):
+        """Save a model, replacing the one of the same furnace and band.
+
+        """
+        models = [m for m in self.models()
+                  if (m.furnace, m.temperature_band) !=
+                  (model.furnace, model.temperature_band)]
+        models.append(model)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump([m.to_dict() for m in models], f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+    def find(self, furnace, temperature=None):
+        """Find the model of a furnace best suited to a temperature.
+
+        See select_model. None is returned if no model exists for the furnace.
+
+        """
+        return select_model(self.models(furnace), temperature)
+
+
+def select_model(models, temperature=None):
+    """Select the model best suited to a temperature.
+
+    Models whose band contains the temperature are preferred, the narrowest
+    band winning. Otherwise the model whose band is the closest is returned.
+    If no temperature is specified, the model with the widest band is
+    returned.
+
+    """
+    if not models:
+        return None
+    if temperature is None:
+        return max(models, key=_band_width)
+    matching = [m for m in models if m.contains(temperature)]
+    if matching:
+        return min(matching, key=_band_width)
+    return min(models, key=lambda m: min(abs(temperature - t)
+                                         for t in m.temperature_band))
+
+
+def _is_physical(coefficients, n):
+    """Whether fitted coefficients (a..., b, c) describe a stable model whose
+    temperature increases with the command.
+
+    """
+    poles = np.roots(np.concatenate(([1.0], -coefficients[:n])))
+    return bool(np.all(np.abs(poles) < 1) and coefficients[n] > 0)
+
+
+def _band_width(model):
+    """Width of the temperature band of a model (infinite if not banded).
+
+    """
+    if not model.temperature_band:
+        return math.inf
+    return model.temperature_band[1] - model.temperature_band[0]
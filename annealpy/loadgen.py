@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Synthetic telemetry used to stress-test the acquisition pipeline.
+
+A SyntheticProducer takes the place of the actuator: it posts synthetic
+samples through the real telemetry transport, which the application consumes
+with the usual PollingThread, storing the samples in the ChannelStatus of the
+channels and plotting them.
+
+A LoadTest runs the producer for a soak period and reports the sustained
+throughput, the ingest lag, the dropped samples, the time spent redrawing the
+plots and the memory used by the application.
+
+"""
+import json
+import math
+import os
+import time
+from multiprocessing import Event, Process, Queue, Value
+
+import numpy as np
+from atom.api import Atom, Bool, Dict, Float, Int, List, Typed
+from enaml.application import timed_call
+
+from .channels import ChannelConfig, ChannelRegistry
+from .clock import Clock
+from .process import PollingThread
+from .telemetry import TelemetrySender
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+#: Colors cycled through by the synthetic channels.
+COLORS = ('#e6194b', '#3cb44b', '#ffe119', '#4363d8', '#f58231', '#911eb4',
+          '#46f0f0', '#f032e6', '#bcf60c', '#fabebe')
+
+
+def create_load_registry(count):
+    """Registry of the control channels and of count synthetic channels.
+
+    One synthetic channel out of four is stepped, the others are continuous.
+
+    """
+    channels = list(ChannelRegistry.from_daq_config({}))
+    for i in range(count):
+        stepped = i % 4 == 3
+        channels.append(ChannelConfig(
+            name=f'load_{i}', physical_id=f'ai{i + 3}',
+            kind='stepped' if stepped else 'continuous',
+            plot='secondary' if stepped else 'main',
+            color=COLORS[i % len(COLORS)]))
+    return ChannelRegistry(channels)
+
+
+def synthesize(index, config, times):
+    """Synthetic values of a channel at given times in s.
+
+    The temperature rises toward a plateau, the heater channels and the
+    stepped channels follow square waves and the other channels are noisy
+    sines of different periods.
+
+    """
+    rng = np.random.default_rng(index + int(times[0]*1e3))
+    if config.kind == 'stepped':
+        period = 2.0 + index
+        high = np.floor(times/period) % 2
+        if config.dtype == 'int':
+            return high.astype(np.int64)
+        return high*(1 + index % 5)
+    noise = rng.normal(0, 0.5, len(times))
+    if config.name == 'temperature':
+        return 25 + 400*(1 - np.exp(-times/120)) + noise
+    period = 5.0*(1 + index % 7)
+    return (100*np.sin(2*math.pi*times/period + index) + 10*index +
+            noise)
+
+
+class SyntheticProducer(Process):
+    """Subprocess posting synthetic samples through the telemetry transport.
+
+    The aggregate rate is evenly split between the channels. Samples are
+    produced in time order, every tick, as a DAQ reading blocks would.
+
+    """
+    #: Interval in s at which new samples are produced.
+    tick = 0.01
+
+    def __init__(self, registry, rate, duration, queue, stop_event,
+                 telemetry_policy='drop_oldest'):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.rate = rate
+        self.duration = duration
+        self.queue = queue
+        self.stop_event = stop_event
+        self.telemetry_policy = telemetry_policy
+        #: Number of samples posted so far.
+        self.produced = Value('q', 0)
+
+    def run(self):
+        """Post samples until the end of the soak or a stop request.
+
+        """
+        clock = Clock()
+        sender = TelemetrySender(self.queue, self.telemetry_policy)
+        sender.start_time = clock.wall_anchor
+        sender.start()
+        channels = list(self.registry)
+        post = sender.post
+        period_ns = len(channels)*1e9/self.rate
+        stop_ns = self.duration*1e9
+        emitted = 0
+        try:
+            while not self.stop_event.is_set():
+                now_ns = clock.now_ns()
+                if now_ns > stop_ns:
+                    break
+                due = int(now_ns/period_ns) + 1
+                if due > emitted:
+                    stamps = np.arange(emitted, due)*period_ns
+                    times = stamps*1e-9
+                    columns = [synthesize(i, c, times).tolist()
+                               for i, c in enumerate(channels)]
+                    names = [c.name for c in channels]
+                    for t, values in zip(stamps.astype(np.int64).tolist(),
+                                         zip(*columns)):
+                        for name, value in zip(names, values):
+                            post(name, t, value)
+                    with self.produced.get_lock():
+                        self.produced.value += (due - emitted)*len(names)
+                    emitted = due
+                time.sleep(self.tick)
+        finally:
+            sender.close()
+            self.queue.put(None)
+
+
+def memory_usage():
+    """Resident memory of the current process in bytes, 0 if unknown.
+
+    On platforms without /proc, the peak resident memory is returned.
+
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    # ru_maxrss is in kB on Linux but in bytes on macOS.
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if os.uname().sysname == 'Darwin' else usage*1024
+
+
+class LoadStats(object):
+    """Accumulate the measurements made during a load test.
+
+    """
+    def __init__(self):
+        self.snapshots = []
+        self.frame_times = []
+
+    def record(self, elapsed, produced, received, dropped, coalesced, lag,
+               memory, store_memory):
+        """Record the state of the pipeline at a given time of the test.
+
+        """
+        self.snapshots.append(dict(
+            elapsed=elapsed, produced=produced, received=received,
+            dropped=dropped, coalesced=coalesced, lag=lag, memory=memory,
+            store_memory=store_memory))
+
+    def record_frame(self, duration):
+        """Record the time spent redrawing the plots.
+
+        """
+        self.frame_times.append(duration)
+
+    def report(self):
+        """Summary of the test.
+
+        The sustained throughput is measured once the first second, during
+        which the application starts consuming, is elapsed.
+
+        """
+        if not self.snapshots:
+            return {}
+        first = self.snapshots[0]
+        for s in self.snapshots:
+            if s['elapsed'] >= 1.0:
+                first = s
+                break
+        last = self.snapshots[-1]
+        span = last['elapsed'] - first['elapsed']
+        lags = np.array([s['lag'] for s in self.snapshots])
+        memory = np.array([s['memory'] for s in self.snapshots])
+        frames = np.array(self.frame_times or [0.0])
+        return dict(
+            duration=last['elapsed'],
+            produced=last['produced'],
+            received=last['received'],
+            dropped=last['dropped'],
+            coalesced=last['coalesced'],
+            throughput=((last['received'] - first['received'])/span
+                        if span > 0 else 0.0),
+            lag_mean=float(lags.mean()),
+            lag_max=float(lags.max()),
+            frame_time_mean=float(frames.mean()),
+            frame_time_p95=float(np.percentile(frames, 95)),
+            frame_time_max=float(frames.max()),
+            frames=len(self.frame_times),
+            memory_start=int(memory[0]),
+            memory_peak=int(memory.max()),
+            memory_end=int(memory[-1]),
+            store_memory=last['store_memory'],
+        )
+
+
+class LoadTest(Atom):
+    """Object driving a load test of the telemetry pipeline from the UI.
+
+    """
+    #: Number of synthetic channels, in addition to the control channels.
+    channel_count = Int(16)
+
+    #: Aggregate rate in Hz of the samples of all the channels.
+    rate = Float(1000.0)
+
+    #: Duration of the soak in s.
+    duration = Float(60.0)
+
+    #: Whether a test is in progress.
+    running = Bool()
+
+    #: Time elapsed since the start of the test in s.
+    elapsed = Float()
+
+    #: Summary of the test, updated every second (see LoadStats.report).
+    report = Dict()
+
+    #: Paths of the reports saved so far.
+    saved_reports = List()
+
+    def start(self, app_state):
+        """Start producing synthetic telemetry.
+
+        """
+        self.stop()
+        registry = create_load_registry(self.channel_count)
+        app_state.configure_channels(registry)
+        app_state.reset_channels()
+        app_state.update_telemetry_stats(0, 0, 0.0, 0)
+
+        queue = Queue(app_state.telemetry_queue_size)
+        self._producer = SyntheticProducer(registry, self.rate,
+                                           self.duration, queue, Event(),
+                                           app_state.telemetry_policy)
+        self._stats = LoadStats()
+        self._app_state = app_state
+        self._start = time.monotonic()
+        self.elapsed = 0.0
+        self.report = {}
+        self.running = True
+        app_state.observe('plot_frame_time', self._record_frame)
+        self._producer.start()
+        self._polling_thread = PollingThread(app_state, queue, 'load_test')
+        self._polling_thread.start()
+        app_state.start_plot_timer('load_test')
+        timed_call(1000, self._measure)
+
+    def stop(self):
+        """Request the producer to stop.
+
+        The report is completed once the application has consumed all the
+        samples sent.
+
+        """
+        if self._producer is not None:
+            self._producer.stop_event.set()
+
+    # --- Private API ---------------------------------------------------------
+
+    #: Subprocess producing the telemetry.
+    _producer = Typed(SyntheticProducer)
+
+    #: Thread consuming the telemetry.
+    _polling_thread = Typed(PollingThread)
+
+    #: Measurements of the test.
+    _stats = Typed(LoadStats)
+
+    #: Application state fed by the producer.
+    _app_state = Typed(Atom)
+
+    #: Monotonic time at which the test started.
+    _start = Float()
+
+    def _record_frame(self, change):
+        """Record the duration of each redraw of the plots.
+
+        """
+        self._stats.record_frame(change['value'])
+
+    def _measure(self):
+        """Measure the state of the pipeline and reschedule a new call.
+
+        """
+        app_state = self._app_state
+        self.elapsed = time.monotonic() - self._start
+        store_memory = sum(c.times.nbytes + c.values.nbytes
+                           for c in app_state.channels.values())
+        self._stats.record(self.elapsed, self._producer.produced.value,
+                           app_state.telemetry_received,
+                           app_state.telemetry_dropped,
+                           app_state.telemetry_coalesced,
+                           app_state.telemetry_lag, memory_usage(),
+                           store_memory)
+        self.report = self._stats.report()
+        if self._polling_thread.is_alive():
+            timed_call(1000, self._measure)
+        else:
+            self._finish()
+
+    def _finish(self):
+        """Save the report once all the telemetry has been consumed.
+
+        """
+        self._app_state.unobserve('plot_frame_time', self._record_frame)
+        self._producer.join()
+        self._producer = None
+        self._polling_thread = None
+        self.running = False
+
+        directory = os.path.join(self._app_state.runs_directory,
+                                 'load_tests')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory,
+                            time.strftime('%Y%m%d-%H%M%S') + '.json')
+        report = dict(self.report, channel_count=self.channel_count,
+                      rate=self.rate,
+                      policy=self._app_state.telemetry_policy,
+                      queue_size=self._app_state.telemetry_queue_size,
+                      plot_refresh_interval=(
+                          self._app_state.plot_refresh_interval))
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.saved_reports = self.saved_reports + [path]
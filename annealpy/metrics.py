@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Running performance metrics of the step being executed.
+
+The metrics are updated in constant time for each temperature sample and each
+change of the heater command, so that they can be computed in the control
+loop and reported live.
+
+"""
+import math
+
+#: Default half width in C of the tolerance band around the target, used for
+#: steps that do not specify an allowed error.
+DEFAULT_TOLERANCE = 2.0
+
+
+class StepMetrics(object):
+    """Running metrics of a step.
+
+    The band is the tolerance band around the target temperature. The
+    overshoot is the largest excursion beyond the target in the direction of
+    the approach. The errors are computed once the band has been reached and
+    the settling time is the time at which the temperature entered the band
+    for the last time (None when it is currently outside). Times are relative
+    to the start of the step.
+
+    The heater duty is the time average of the command (switch state times
+    regulation) and the energy its integral times the heater power (in full
+    power seconds if the power is unknown).
+
+    Parameters
+    ----------
+    start : float
+        Time at which the step started.
+    target : float, optional
+        Target temperature, None if the step has no target in which case only
+        the heater metrics are computed.
+    tolerance : float
+        Half width of the tolerance band in C.
+    heater_power : float
+        Power of the heater in W when fully on.
+
+    """
+    __slots__ = ('start', 'target', 'tolerance', 'heater_power',
+                 '_direction', '_last_time', '_in_band', '_reached',
+                 '_entered', '_overshoot', '_squared_error', '_max_error',
+                 '_count', '_in_tolerance', '_command', '_command_time',
+                 '_command_integral')
+
+    def __init__(self, start, target=None, tolerance=DEFAULT_TOLERANCE,
+                 heater_power=1.0):
+        self.start = start
+        self.target = target
+        self.tolerance = tolerance
+        self.heater_power = heater_power
+        self._direction = 0
+        self._last_time = None
+        self._in_band = False
+        self._reached = None
+        self._entered = None
+        self._overshoot = 0.0
+        self._squared_error = 0.0
+        self._max_error = 0.0
+        self._count = 0
+        self._in_tolerance = 0.0
+        self._command = 0.0
+        self._command_time = start
+        self._command_integral = 0.0
+
+    def add_temperature(self, time, value):
+        """Update the metrics with a new temperature sample.
+
+        """
+        target = self.target
+        if target is None:
+            return
+        error = value - target
+        if self._direction == 0:
+            self._direction = 1 if error <= 0 else -1
+        in_band = abs(error) <= self.tolerance
+
+        last_time = self._last_time
+        if last_time is not None and self._in_band:
+            self._in_tolerance += time - last_time
+        self._last_time = time
+
+        if in_band and not self._in_band:
+            self._entered = time - self.start
+            if self._reached is None:
+                self._reached = self._entered
+        self._in_band = in_band
+
+        excursion = self._direction*error
+        if excursion > self._overshoot:
+            self._overshoot = excursion
+
+        if self._reached is not None:
+            self._squared_error += error*error
+            self._count += 1
+            if abs(error) > self._max_error:
+                self._max_error = abs(error)
+
+    def set_command(self, time, command):
+        """Update the metrics with a new heater command (between 0 and 1).
+
+        """
+        self._command_integral += self._command*(time - self._command_time)
+        self._command = command
+        self._command_time = time
+
+    def as_dict(self, time):
+        """Snapshot of the metrics at a given time.
+
+        """
+        duration = time - self.start
+        integral = (self._command_integral +
+                    self._command*(time - self._command_time))
+        metrics = dict(duration=duration,
+                       heater_duty=integral/duration if duration > 0 else
+                       self._command,
+                       energy=integral*self.heater_power)
+        if self.target is not None:
+            count = self._count
+            metrics.update(
+                target=self.target,
+                time_to_band=self._reached,
+                overshoot=self._overshoot,
+                settling_time=self._entered if self._in_band else None,
+                rms_error=math.sqrt(self._squared_error/count) if count else
+                None,
+                max_error=self._max_error if count else None,
+                time_in_tolerance=self._in_tolerance)
+        return metrics
+
+
+def estimate_slope(samples):
+    """Least square estimate of the slope of (time, value) samples.
+
+    """
+    count = len(samples)
+    if count < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in samples)/count
+    mean_v = sum(v for _, v in samples)/count
+    var = sum((t - mean_t)**2 for t, _ in samples)
+    if var <= 0:
+        return 0.0
+    return sum((t - mean_t)*(v - mean_v) for t, v in samples)/var
+
+
+def format_metrics(metrics):
+    """Format the metrics of a step on a single line.
+
+    """
+    def fmt(name, unit, scale=1):
+        value = metrics.get(name)
+        return '-' if value is None else f'{value*scale:.3g}{unit}'
+
+    text = (f'step {metrics.get("step", "?")} ({metrics.get("type", "")}): '
+            f'duty {fmt("heater_duty", " %", 100)}, '
+            f'energy {fmt("energy", "")}')
+    if 'target' in metrics:
+        text += (f', band at {fmt("time_to_band", " s")}, '
+                 f'overshoot {fmt("overshoot", " C")}, '
+                 f'settled at {fmt("settling_time", " s")}, '
+                 f'rms {fmt("rms_error", " C")}, '
+                 f'max {fmt("max_error", " C")}, '
+                 f'in tolerance {fmt("time_in_tolerance", " s")}')
+    return text
@@ -10,6 +10,7 @@
 
 """
 import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore
 from atom.api import Typed, Dict, Value, List, Enum, set_default
 from enaml.core.api import d_
 from enaml.layout.api import hbox, vbox, spacer
@@ -18,21 +19,29 @@ from enaml.widgets.api import RawWidget
 from ..app_state import ApplicationState
 
 
-COLORS = {'temperature': 'w',
-          'heater_switch': 'b',
-          'heater_regulation': 'r'}
+#: Colors cycled through for the runs overlaid on the temperature plot.
+OVERLAY_COLORS = ('y', 'g', 'c', 'm', (255, 128, 0), (128, 128, 255))
 
 
 class DualAxisPyqtGraphWidget(RawWidget):
-    """PyqtGraph widget plotting the three monitored quantities.
+    """PyqtGraph widget plotting the monitored channels.
+
+    The channels drawn are the ones of the channel registry assigned to the
+    plot of the widget.
 
     """
     #: Reference to the application state.
     app_state = d_(Typed(ApplicationState))
 
-    #: Colors to use for the plots.
+    #: Colors to use for the plots, overriding the colors of the channels.
     colors = d_(Dict())
 
+    #: Plot of the channel registry drawn by this widget.
+    plot = d_(Enum('main', 'secondary'))
+
+    #: Names of the channels which should not be drawn.
+    hidden = d_(List())
+
     hug_width = set_default('ignore')
     hug_height = set_default('ignore')
 
@@ -47,29 +56,36 @@ class DualAxisPyqtGraphWidget(RawWidget):
 
         return widget
 
-    def add_plot(self, id):
-        """Add a plot to the proper axis.
+    def update_channels(self, change=None):
+        """Draw the channels assigned to the plot which are not hidden.
+
+        The widget is hidden when it has no channel to draw.
 
         """
-        time = None
-        if id != 'temperature':
-            temp = self.app_state.temperature
-            time = temp.times[temp.current_index - 1]
+        if self._plot is None:
+            return
+        for id in list(self._curves):
+            self.remove_plot(id)
+        for config in self.app_state.channel_registry:
+            if config.plot == self.plot and config.name not in self.hidden:
+                self.add_plot(config.name)
+        self.visible = bool(self._curves)
 
-        left_label = ('Temperature (C)'
-                      if id == 'temperature' else
-                      'Heater state %')
-        self._plot.setLabels(bottom='Time (s)', left=left_label)
+    def add_plot(self, id):
+        """Add a plot to the proper axis.
 
-        time, data = getattr(self.app_state, id).get_data(time)
+        """
+        config = self.app_state.channel_registry[id]
+        time, data = self.app_state.channels[id].get_data(
+            self._last_time() if config.kind == 'stepped' else None)
 
-        legend_name = id.capitalize().replace('_', " ")
-        curve = pg.PlotCurveItem(name=legend_name,
-                                 pen=pg.mkPen(color=self.colors[id], width=1))
+        curve = pg.PlotCurveItem(name=config.label,
+                                 pen=pg.mkPen(color=self._color(id), width=1))
         curve.setData(x=time, y=data)
         self._curves[id] = curve
 
         self._plot.addItem(curve)
+        self._update_labels()
 
     def remove_plot(self, id):
         """Remove a plot.
@@ -78,40 +94,87 @@ class DualAxisPyqtGraphWidget(RawWidget):
         if id not in self._curves:
             return
 
-        curve = self._curves[id]
+        curve = self._curves.pop(id)
         self._plot.removeItem(curve)
+        self._update_labels()
+
+    def update_overlays(self, change=None):
+        """Redraw the past runs overlaid on the plot.
+
+        """
+        for curve in self._overlay_curves.values():
+            self._plot.removeItem(curve)
+        self._overlay_curves = {}
+
+        for i, (label, (time, data)) in \
+                enumerate(sorted(self.app_state.overlays.items())):
+            color = OVERLAY_COLORS[i % len(OVERLAY_COLORS)]
+            curve = pg.PlotCurveItem(name=label,
+                                     pen=pg.mkPen(color=color, width=1,
+                                                  style=QtCore.Qt.DashLine))
+            curve.setData(x=time, y=data)
+            self._overlay_curves[label] = curve
+            self._plot.addItem(curve)
 
     # --- Private API ---------------------------------------------------------
 
     _curves = Dict()
 
+    _overlay_curves = Dict()
+
     _plot = Value()
 
+    def _observe_hidden(self, change):
+        """Redraw the channels when some are hidden or shown.
+
+        """
+        self.update_channels()
+
     def _observe_colors(self, change):
         """Update the plots colors.
 
         """
         for c_id, c_obj in self._curves.items():
-            c_obj.setPen(color=self.colors[c_id], width=1)
+            c_obj.setPen(color=self._color(c_id), width=1)
 
     def _update_plots(self, change):
         """Update the data of the plots.
 
         """
-        if self.app_state.temperature.current_index == 0:
+        if self.app_state.channels['temperature'].current_index == 0:
             return
-        time = [None]
+        # Extend the stepped channels up to the latest temperature sample.
+        time = self._last_time()
+        channels = self.app_state.channels
+        for id, curve in self._curves.items():
+            ch_status = channels[id]
+            x, y = ch_status.get_data(time if ch_status.kind == 'stepped'
+                                      else None)
+            curve.setData(x=x, y=y)
+
+    def _last_time(self):
+        """Time of the latest temperature sample, None if there is none.
 
-        if 'temperature' in self._curves:
-            time, data = self.app_state.temperature.get_data()
-            self._curves['temperature'].setData(x=time, y=data)
+        """
+        temp = self.app_state.channels['temperature']
+        index = temp.current_index
+        return temp.times[index - 1] if index else None
+
+    def _color(self, id):
+        """Color of the curve of a channel.
 
-        if 'heater_switch' in self._curves:
-            time, data = self.app_state.heater_switch.get_data(time[-1])
-            print(time, data)
-            self._curves['heater_switch'].setData(x=time, y=data)
+        """
+        return self.colors.get(id,
+                               self.app_state.channel_registry[id].color)
 
-        if 'heater_regulation' in self._curves:
-            time, data = self.app_state.heater_regulation.get_data(time[-1])
-            print(time, data)
-            self._curves['heater_regulation'].setData(x=time, y=data)
+    def _update_labels(self):
+        """Label the vertical axis after the drawn channels.
+
+        """
+        registry = self.app_state.channel_registry
+        labels = []
+        for id in self._curves:
+            config = registry[id]
+            labels.append(f'{config.label} ({config.unit})' if config.unit
+                          else config.label)
+        self._plot.setLabels(bottom='Time (s)', left=', '.join(labels))
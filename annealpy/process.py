@@ -10,16 +10,38 @@
 
 """
 import json
+import os
+import threading
 import time
+import traceback
+from collections import deque
 from multiprocessing import Event, Process, Queue
-from threading import Thread
+from queue import Full
+from threading import Event as ThreadEvent, Lock, Thread
 
-from atom.api import Atom, Enum, List, Typed, Str
+import numpy as np
+from atom.api import Atom, Enum, List, Typed, Str, Value
 from enaml.application import deferred_call
 
+from .catalog import RunCatalog
+from .channels import ChannelRegistry
+from .checkpoint import Checkpointer, clear_checkpoint, read_checkpoint
+from .clock import Clock
 from .daq.daq_control import AnnealerDaq
+from .daq.outputs import DeduplicatedOutput
+from .daq.pwm import TimeProportioningOutput
+from .compression import CompressionConfig
+from .dryrun import dry_run
+from .filtering import FilterConfig
+from .identification import ModelStore, ThermalModel, select_model
+from .metrics import DEFAULT_TOLERANCE, StepMetrics, estimate_slope
+from .profiling import ProfileConfig, SamplingProfiler
+from .recording import (RunRecorder, RunRecording, create_run_directory,
+                        read_meta)
+from .service import ServiceClient, launch_service
 from .steps import STEPS
 from .steps.base_step import BaseStep
+from .telemetry import TelemetrySender
 
 # This can use a multiprocessing.Process subclass handling the DAQ (all steps
 # must go through it which means it can take care of piping the relevant infos
@@ -62,37 +84,103 @@ class MonitoringThread(Thread):
         else:
             deferred_call(setattr, self.process, 'status', 'Completed')
 
+        # Index the finished run so that it can be queried later on (services
+        # take care of it themselves).
+        run_directory = self.process.run_directory
+        if run_directory and not isinstance(self.process._actuator,
+                                            ServiceClient):
+            try:
+                RunCatalog(os.path.dirname(run_directory)).add_run(
+                    run_directory)
+            except Exception:
+                print(f'Failed to add {run_directory} to the run catalog:\n'
+                      + traceback.format_exc())
+
 
 class PollingThread(Thread):
     """Thread polling the queue filled by the actuator to update the app.
 
+    The plot timer is stopped on behalf of timer_owner once the run is over.
+
     """
-    def __init__(self, app_state, actuator_queue):
+    def __init__(self, app_state, actuator_queue, timer_owner='run'):
 
-        super().__init__()
+        super().__init__(name='TelemetryIngest')
         self.app_state = app_state
+        self.timer_owner = timer_owner
+        #: Profiler of the application, stopped once the run is over.
+        self.profiler = None
         self._actuator_queue = actuator_queue
+        #: Number of samples received so far.
+        self.received = 0
 
     def run(self):
 
         while True:
-            channel, time, value = self._actuator_queue.get()
-            print(channel, time, value)
-            if channel is None:
+            batch = self._actuator_queue.get()
+            if batch is None:
                 break
-            else:
-                ch_status = getattr(self.app_state, channel)
-                ch_status.append_value(time, value)
 
-        self.app_state.stop_plot_timer()
+            for _, kind, infos in batch.events:
+                if kind == 'step_end':
+                    deferred_call(self.app_state.add_step_result,
+                                  infos['step'], infos['type'],
+                                  infos['metrics'])
+            if batch.metrics is not None:
+                deferred_call(setattr, self.app_state, 'step_metrics',
+                              batch.metrics)
+            if not batch.samples:
+                continue
+
+            channels = self.app_state.channels
+            newest = 0
+            for channel, t, value in batch.samples:
+                channels[channel].append_value(t*1e-9, value)
+                if t > newest:
+                    newest = t
+            self.received += len(batch.samples)
+
+            server = self.app_state.stream_server
+            if server is not None:
+                server.publish_samples(batch.samples)
+
+            # Lag between the newest sample and the time at which it reaches
+            # the application (coalesced samples are not in time order).
+            lag = time.time() - batch.start_time - newest*1e-9
+            deferred_call(self.app_state.update_telemetry_stats,
+                          batch.dropped, batch.coalesced, lag,
+                          self.received)
+
+        self.app_state.stop_plot_timer(self.timer_owner)
+        if self.profiler is not None:
+            self.profiler.stop()
 
 
 class ActuatorSubprocess(Process):
     """Subprocess in charge of executing a process.
 
+    When recording, the progress is periodically checkpointed in the run
+    directory. If a checkpoint is provided, the execution resumes from it.
+
+    The auxiliary input channels of the DAQ config are acquired by background
+    threads, one per sample rate.
+
+    All the times are measured by a single monotonic clock (see clock.Clock)
+    started with the subprocess: the steps should use clock.now() rather than
+    the wall clock.
+
+    When recording, the subprocess can be profiled (see profiling), either
+    from its start by passing profiling settings or on demand.
+
     """
+    #: Interval in s between two checkpoints.
+    checkpoint_interval = 1.0
+
     def __init__(self, process_config_path, daq_config, queue,
-                 stop_event, crashed_event):
+                 stop_event, crashed_event, telemetry_policy='drop_oldest',
+                 run_directory='', compression=None, thermal_models=None,
+                 filters=None, checkpoint=None, resume_tolerance=25.0,
+                 profiling=None):
 
         super().__init__(daemon=True)
         self.process_config_path = process_config_path
@@ -100,70 +188,718 @@ class ActuatorSubprocess(Process):
         self.queue = queue
         self.stop_event = stop_event
         self._daq = None
+        self.channels = None
+        self.clock = None
         self.start_time = 0.0
         self.crashed_event = crashed_event
+        self.telemetry_policy = telemetry_policy
+        self.run_directory = run_directory
+        self.compression = compression or {}
+        self.thermal_models = thermal_models or []
+        self.filters = filters or {}
+        self.temperature_group_delay = 0.0
+        self._temperature_filter = None
+        self.checkpoint = checkpoint
+        self.resume_tolerance = resume_tolerance
+        self.profiling = profiling
+        self.checkpoint_pid = None
+        self._checkpointer = None
+        self._step_index = 0
+        self._step_type = ''
+        self._step_start = 0.0
+        self._last_temperature = None
+        self._metrics = None
+        self._telemetry = None
+        self._recorder = None
+        self._compressors = {}
+        self._heater_switch_output = None
+        self._heater_reg_output = None
+        self._read_zones = None
+        self._zone_input_names = []
+        self._zone_output_names = []
+        self._zone_output = None
+        self._stop_threads = None
+        self._threads = []
+        self._profiler = None
+        self._profiler_lock = None
+        self._profiles = 0
 
     def run(self):
         """Run the process described in the config.
 
         """
+        # Start the clock first so that the time spent loading the process
+        # and initializing the DAQ is accounted for.
+        self.clock = Clock()
+        self.start_time = self.clock.wall_anchor
+        self._stop_threads = ThreadEvent()
+        self._profiler_lock = Lock()
+        self.channels = ChannelRegistry.from_daq_config(self.daq_config)
+        # The sender owns a thread and must hence be created in the
+        # subprocess.
+        self._telemetry = TelemetrySender(self.queue, self.telemetry_policy)
+        self._telemetry.start_time = self.start_time
+        self._telemetry.metrics = self._metrics_snapshot
+        self._telemetry.start()
         try:
+            p = AnnealerProcess.load(self.process_config_path)
+            if self.run_directory:
+                self._create_recorder(p)
+                if self.profiling is not None:
+                    self.start_profiling(self.profiling)
+            self._compressors = {ch: CompressionConfig(**c).create_compressor()
+                                 for ch, c in self.compression.items()}
+
             self._daq = AnnealerDaq(self.daq_config)
+            self._create_filters()
             self._daq.initialize()
+            self._create_outputs()
+            if self.channels.zone_inputs:
+                self._create_zones()
 
-            p = AnnealerProcess.load(self.process_config_path)
-
-            self.start_time = time.time()
             # Initialize the values by forcing a notification in the queue
             self.read_temperature()
             self.heater_switch_state = self.heater_switch_state
             self.heater_reg_state = self.heater_reg_state
+            self._start_outputs_refresh()
+            self._start_inputs_acquisition()
 
-            for s in p.steps:
+            first_step = self._restore_checkpoint(p) if self.checkpoint else 0
+            if self.run_directory:
+                self._checkpointer = Checkpointer(self.run_directory,
+                                                  self._checkpoint_state,
+                                                  self.checkpoint_interval)
+                self._checkpointer.start()
+
+            for i, s in enumerate(p.steps[first_step:], first_step):
                 if self.stop_event.is_set():
                     break
-                s.run(self)
+                resumed = self.checkpoint if i == first_step else None
+                self.checkpoint_pid = None
+                self._step_index = i
+                self._step_type = type(s).__name__
+                self._step_start = self.clock.now()
+                if resumed:
+                    self._step_start -= resumed['elapsed']
+                self.mark_event('step_start', step=i, type=self._step_type,
+                                resumed=bool(resumed))
+                self._start_metrics(s)
+                if resumed:
+                    s.resume(self, resumed)
+                else:
+                    s.run(self)
+                metrics, self._metrics = self._metrics, None
+                self.mark_event('step_end', step=i, type=self._step_type,
+                                metrics=metrics.as_dict(self.clock.now()))
 
         except Exception:
             self.crashed_event.set()
+            if self._recorder is not None:
+                self._recorder.meta['error'] = traceback.format_exc()
+            self.mark_event('failure')
 
         finally:
-            self._daq.finalize()
-            self.queue.put((None, None, None))
+            self.stop_profiling()
+            if self._stop_threads is not None:
+                self._stop_threads.set()
+            # The background threads must be done with the DAQ tasks before
+            # they are closed.
+            for thread in self._threads:
+                thread.join()
+            if self._daq is not None:
+                self._daq.finalize()
+            for ch, compressor in self._compressors.items():
+                for t, v in compressor.flush():
+                    self._telemetry.post(ch, round(t*1e9), v)
+            self._telemetry.close()
+            status = ('Failed' if self.crashed_event.is_set() else
+                      'Stopped' if self.stop_event.is_set() else
+                      'Completed')
+            if self._checkpointer is not None:
+                # A completed run has nothing left to resume.
+                self._checkpointer.stop(write=status != 'Completed')
+                if status == 'Completed':
+                    clear_checkpoint(self.run_directory)
+            if self._recorder is not None:
+                self._recorder.close(status)
+            try:
+                # A stalled or dead consumer must not prevent the actuator
+                # from exiting.
+                self.queue.put(None, timeout=5)
+            except Full:
+                pass
 
     def read_temperature(self):
         """Read the temperature through the daq and post the value.
 
+        The sample is stamped at the middle of the read or, when oversampling,
+        at the time of the last sample of the block as given by the DAQ sample
+        clock.
+
         """
-        temp = self._daq.read_temperature()
-        self.queue.put(('temperature', time.time() - self.start_time, temp))
+        clock = self.clock
+        temperature_filter = self._temperature_filter
+        if temperature_filter is None:
+            before = clock.now_ns()
+            temp = self._daq.read_temperature()
+            t_ns = (before + clock.now_ns())//2
+        else:
+            daq = self._daq
+            start, block = daq.read_temperature_block()
+            temp = temperature_filter.process(block)
+            t_ns = clock.from_monotonic_ns(start) + round(
+                (len(block) - 1)*1e9/daq.temperature_sample_rate)
+        self._last_temperature = temp
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.add_temperature(t_ns*1e-9, temp)
+        self._post('temperature', t_ns, temp)
         return temp
 
+    def wait_until(self, threshold, rising=True, timeout=None, interval=0.01,
+                   anticipation=0.0):
+        """Wait for the temperature to cross a threshold.
+
+        The temperature is read (and hence posted) at most every interval.
+        The slope estimated on the last samples is used to predict the
+        crossing: the next read is scheduled at the predicted crossing time if
+        it comes before the end of the interval, and the wait ends as soon as
+        the crossing is predicted to happen within anticipation s (which can be
+        used to compensate for the latency of the heater).
+
+        Parameters
+        ----------
+        threshold : float | callable
+            Temperature to cross or predicate taking the temperature and
+            returning True when the wait should end (no prediction is then
+            possible).
+        rising : bool
+            Whether the temperature is expected to go above (True) or below
+            (False) the threshold.
+        timeout : float, optional
+            Maximal time to wait in s.
+        interval : float
+            Maximal time in s between two reads.
+        anticipation : float
+            Time in s before the predicted crossing at which to end the wait.
+            The group delay of the temperature filter is added to it.
+
+        Returns
+        -------
+        reached : bool
+            False if the wait ended because of the timeout or because a stop
+            was requested.
+
+        """
+        read_temperature = self.read_temperature
+        wait = self.stop_event.wait
+        predicate = threshold if callable(threshold) else None
+        # The filtered temperature lags behind the actual one.
+        anticipation += self.temperature_group_delay
+        clock_now = self.clock.now
+        deadline = None if timeout is None else clock_now() + timeout
+        history = deque(maxlen=4)
+        while True:
+            now = clock_now()
+            value = read_temperature()
+            delay = interval
+            if predicate is not None:
+                if predicate(value):
+                    return True
+            else:
+                # Distance left before crossing, counted positively.
+                distance = threshold - value if rising else value - threshold
+                if distance <= 0:
+                    return True
+                history.append((now, value))
+                slope = estimate_slope(history)
+                speed = slope if rising else -slope
+                if speed > 0:
+                    eta = distance/speed
+                    if eta <= anticipation:
+                        return True
+                    delay = min(delay, max(eta - anticipation, 1e-3))
+
+            if deadline is not None:
+                remaining = deadline - clock_now()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            if wait(delay):
+                return False
+
+    def sleep(self, duration):
+        """Sleep for duration s, returning early if a stop is requested.
+
+        Returns True if the full duration elapsed.
+
+        """
+        return not self.stop_event.wait(max(duration, 0))
+
+    def mark_event(self, kind, **infos):
+        """Record an event and keep full resolution data around it.
+
+        The event is also sent to the application with the telemetry.
+
+        """
+        t = self.clock.now()
+        self._telemetry.post_event(t, kind, **infos)
+        for ch, compressor in self._compressors.items():
+            for pt_time, pt_value in compressor.mark_event(t):
+                self._telemetry.post(ch, round(pt_time*1e9), pt_value)
+        if self._recorder is not None:
+            self._recorder.add_event(t, kind, **infos)
+
+    def start_profiling(self, settings=None):
+        """Start profiling the subprocess, if not already profiled.
+
+        Parameters
+        ----------
+        settings : dict, optional
+            Settings of the profiler (see profiling.ProfileConfig).
+
+        """
+        if self._profiler_lock is None:
+            # Not running yet, profile from the start.
+            self.profiling = settings or {}
+            return
+        with self._profiler_lock:
+            if self._profiler is not None or not self.run_directory:
+                return
+            # Each profiling session of the run gets its own artifacts.
+            self._profiles += 1
+            name = ('actuator' if self._profiles == 1 else
+                    f'actuator_{self._profiles}')
+            config = ProfileConfig(**(settings or {}))
+            self._profiler = SamplingProfiler(self.run_directory, name,
+                                              config)
+            self._profiler.start()
+
+    def stop_profiling(self):
+        """Stop profiling the subprocess and write the profile.
+
+        """
+        if self._profiler_lock is None:
+            self.profiling = None
+            return
+        with self._profiler_lock:
+            profiler, self._profiler = self._profiler, None
+            if profiler is not None:
+                profiler.stop()
+
+    def get_thermal_model(self, temperature=None):
+        """Get the identified furnace model best suited to a temperature.
+
+        Returns None if the furnace was never identified.
+
+        """
+        models = [ThermalModel.from_dict(m) for m in self.thermal_models]
+        if not models and self.daq_config.get('simulation_model'):
+            models = [ThermalModel.from_dict(
+                self.daq_config['simulation_model'])]
+        return select_model(models, temperature)
+
     @property
     def heater_switch_state(self):
         """State of the heater switch controlled by the DAQ.
 
+        Writes that would not change the state are skipped (but for the
+        periodic refresh) and not reported.
+
         """
-        return self._daq.heater_switch_state
+        output = self._heater_switch_output
+        if output.value is None:
+            return self._daq.heater_switch_state
+        return output.value
 
     @heater_switch_state.setter
     def heater_switch_state(self, value):
-        self._daq.heater_switch_state = value
-        self.queue.put(('heater_switch', time.time() - self.start_time, value))
+        now = self.clock.now_ns()
+        if self._heater_switch_output.update(value, now*1e-9):
+            self._telemetry.post('heater_switch', now,
+                                 self._heater_switch_output.value)
+            if self._metrics is not None:
+                self._update_command_metrics(now)
 
     @property
     def heater_reg_state(self):
-        """tate of the heater regulation controlled by the DAQ.
+        """State of the heater regulation controlled by the DAQ.
+
+        Values are quantized to the DAC resolution and writes that would not
+        change the output are skipped (but for the periodic refresh) and not
+        reported.
 
         """
-        return self._daq.heater_reg_state
+        output = self._heater_reg_output
+        if output.value is None:
+            return self._daq.heater_reg_state
+        return output.value
 
     @heater_reg_state.setter
     def heater_reg_state(self, value):
-        self._daq.heater_reg_state = value
-        self.queue.put(('heater_regulation',
-                        time.time() - self.start_time,
-                        value))
+        self.set_heater_reg(value)
+
+    def set_heater_reg(self, value):
+        """Set the state of the heater regulation.
+
+        This is the fast path used by the control loops, which should bind it
+        once before entering the loop.
+
+        """
+        now = self.clock.now_ns()
+        output = self._heater_reg_output
+        if output.update(value, now*1e-9):
+            self._telemetry.post('heater_regulation', now, output.value)
+            if self._metrics is not None:
+                self._update_command_metrics(now)
+
+    def play_heater_reg(self, commands, rate):
+        """Play precomputed states of the heater regulation at a fixed rate.
+
+        The states are generated by the DAQ sample clock when the device
+        supports it and by a dedicated writer thread otherwise (see
+        AnnealerDaq.create_heater_reg_waveform), and are reported as they
+        are generated. Returns the started player: the regulation must not
+        be set until it is done (see its wait and stop methods), the output
+        then keeping the last generated state.
+
+        """
+        output = self._heater_reg_output
+        clock = self.clock
+        post = self._telemetry.post
+        period_ns = 1e9/rate
+
+        def report(start, stop):
+            now_ns = clock.now_ns()
+            samples = player.samples
+            for i in range(start, stop):
+                value = float(samples[i])
+                if output.track(value, now_ns*1e-9):
+                    t_ns = clock.from_monotonic_ns(
+                        player.start_ns + round(i*period_ns))
+                    post('heater_regulation', t_ns, value)
+                    if self._metrics is not None:
+                        self._update_command_metrics(t_ns)
+
+        def done():
+            output.external = False
+
+        output.external = True
+        try:
+            player = self._daq.create_heater_reg_waveform(commands, rate,
+                                                          report, done)
+            player.start()
+        except Exception:
+            output.external = False
+            raise
+        self.mark_event('waveform_start', samples=len(player.samples),
+                        rate=rate, hardware_timed=player.hardware_timed)
+        return player
+
+    def start_switch_pwm(self, period, min_pulse=0.0):
+        """Drive the heater switch as a time-proportioned PWM.
+
+        The switch is on during the first duty*period s of each cycle, the
+        duty being set through the duty attribute of the returned output
+        (see daq.pwm.TimeProportioningOutput). The edges are scheduled by a
+        dedicated thread and reported at the time they were written. The
+        switch must not be set until the output is stopped.
+
+        """
+        output = self._heater_switch_output
+        clock = self.clock
+        post = self._telemetry.post
+
+        def report(state, timestamp):
+            t_ns = clock.from_monotonic_ns(timestamp)
+            output.track(state, t_ns*1e-9)
+            post('heater_switch', t_ns, state)
+            if self._metrics is not None:
+                self._update_command_metrics(t_ns)
+
+        pwm = TimeProportioningOutput(self._daq.create_heater_switch_writer(),
+                                      period, min_pulse, report)
+        pwm.state = output.value
+        output.external = True
+        pwm.start()
+        self.mark_event('switch_pwm_start', period=period,
+                        min_pulse=min_pulse)
+        return pwm
+
+    def stop_switch_pwm(self, pwm):
+        """Stop a PWM started by start_switch_pwm.
+
+        The switch keeps its current state and is refreshed again.
+
+        """
+        pwm.stop()
+        self._heater_switch_output.external = False
+        self.mark_event('switch_pwm_stop', cycles=pwm.cycles,
+                        max_lateness=pwm.max_lateness)
+
+    def read_zone_temperatures(self):
+        """Read the temperatures of all the heater zones and post them.
+
+        The zones are read at once. Returns an array ordered by zone.
+
+        """
+        clock = self.clock
+        before = clock.now_ns()
+        temperatures = self._read_zones()
+        t_ns = (before + clock.now_ns())//2
+        post = self._post
+        for name, value in zip(self._zone_input_names, temperatures.tolist()):
+            post(name, t_ns, value)
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.add_temperature(t_ns*1e-9, float(temperatures.mean()))
+        return temperatures
+
+    @property
+    def zone_outputs(self):
+        """Regulator states of the heater zones as an array.
+
+        """
+        return np.array(self._zone_output.value)
+
+    def set_zone_outputs(self, values):
+        """Set the regulator states of all the heater zones.
+
+        The states are quantized to the DAC resolution and written at once,
+        unless none of them changed (but for the periodic refresh). Only the
+        zones whose state changed are reported.
+
+        """
+        now = self.clock.now_ns()
+        output = self._zone_output
+        previous = output.value
+        if output.update(values, now*1e-9):
+            post = self._telemetry.post
+            for i, (name, value) in enumerate(zip(self._zone_output_names,
+                                                  output.value)):
+                if previous is None or value != previous[i]:
+                    post(name, now, value)
+
+    # --- Private API ---------------------------------------------------------
+
+    def _post(self, channel, t_ns, value):
+        """Post a sample taken at t_ns, compressing it if requested.
+
+        """
+        compressor = self._compressors.get(channel)
+        if compressor is None:
+            self._telemetry.post(channel, t_ns, value)
+        else:
+            # The compressors work in s.
+            for pt_time, pt_value in compressor.add(t_ns*1e-9, value):
+                self._telemetry.post(channel, round(pt_time*1e9), pt_value)
+
+    def _create_recorder(self, process):
+        """Create the recorder writing the telemetry to the run directory.
+
+        """
+        with open(self.process_config_path) as f:
+            process_config = json.load(f)
+        meta = dict(description=process.description,
+                    process_path=self.process_config_path,
+                    process=process_config,
+                    daq_config=self.daq_config,
+                    compression=self.compression,
+                    profiling=self.profiling,
+                    clock=self.clock.anchor())
+        if self.checkpoint:
+            meta['resumed_from'] = self.checkpoint.get('directory', '')
+        self._recorder = RunRecorder(self.run_directory, meta,
+                                     self.channels.schema)
+        self._telemetry.recorder = self._recorder
+
+    def _start_metrics(self, step):
+        """Start computing the metrics of a step.
+
+        """
+        t = self.clock.now()
+        tolerance = getattr(step, 'allowed_error', 0) or DEFAULT_TOLERANCE
+        metrics = StepMetrics(t, getattr(step, 'target_temperature', None),
+                              tolerance,
+                              self.daq_config.get('heater_power', 1.0))
+        metrics.set_command(t, self._heater_switch_output.value *
+                            self._heater_reg_output.value)
+        self._metrics = metrics
+
+    def _update_command_metrics(self, now_ns):
+        """Report the heater command to the metrics of the running step.
+
+        """
+        self._metrics.set_command(now_ns*1e-9,
+                                  self._heater_switch_output.value *
+                                  self._heater_reg_output.value)
+
+    def _metrics_snapshot(self):
+        """Metrics of the running step, None if no step is running.
+
+        """
+        metrics = self._metrics
+        if metrics is None:
+            return None
+        snapshot = metrics.as_dict(self.clock.now())
+        snapshot.update(step=self._step_index, type=self._step_type)
+        return snapshot
+
+    def _checkpoint_state(self):
+        """Collect the state saved in the checkpoints.
+
+        """
+        now = self.clock.now()
+        pid = self.checkpoint_pid
+        return dict(step=self._step_index,
+                    step_type=self._step_type,
+                    elapsed=now - self._step_start,
+                    run_time=now,
+                    time=self.clock.to_wall(now),
+                    temperature=self._last_temperature,
+                    heater_switch=bool(self._heater_switch_output.value),
+                    heater_reg=self._heater_reg_output.value,
+                    zone_outputs=(list(self._zone_output.value)
+                                  if self._zone_output is not None else None),
+                    pid=pid.get_state() if pid is not None else None)
+
+    def _restore_checkpoint(self, process):
+        """Check a checkpoint can be resumed and restore the outputs.
+
+        Returns the index of the step to resume.
+
+        """
+        checkpoint = self.checkpoint
+        index = checkpoint['step']
+        step_type = checkpoint['step_type']
+        if (index >= len(process.steps) or
+                type(process.steps[index]).__name__ != step_type):
+            raise RuntimeError('The checkpoint does not match the steps of '
+                               'the process.')
+        saved = checkpoint['temperature']
+        temperature = self._last_temperature
+        if saved is not None and abs(temperature - saved) > \
+                self.resume_tolerance:
+            raise RuntimeError(f'Cannot resume: the temperature '
+                               f'({temperature:.1f} C) differs from the '
+                               f'checkpointed one ({saved:.1f} C) by more '
+                               f'than {self.resume_tolerance} C.')
+
+        self.heater_reg_state = checkpoint['heater_reg']
+        if checkpoint.get('zone_outputs') and self._zone_output is not None:
+            self.set_zone_outputs(np.array(checkpoint['zone_outputs']))
+        self.heater_switch_state = checkpoint['heater_switch']
+        self.mark_event('resume', step=index, elapsed=checkpoint['elapsed'],
+                        temperature=temperature, saved_temperature=saved)
+        return index
+
+    def _create_filters(self):
+        """Create the filters applied to the inputs and set up oversampling.
+
+        """
+        if 'temperature' in self.filters:
+            config = FilterConfig(**self.filters['temperature'])
+            self._temperature_filter = config.create_filter()
+            self._daq.temperature_oversampling = config.oversampling
+            self._daq.temperature_sample_rate = config.sample_rate
+            self.temperature_group_delay = \
+                self._temperature_filter.group_delay(config.oversampling)
+
+    def _create_outputs(self):
+        """Create the output layer sitting in front of the DAQ outputs.
+
+        """
+        daq = self._daq
+        interval = daq.output_refresh_interval
+        self._heater_switch_output = DeduplicatedOutput(
+            daq.create_heater_switch_writer(), bool, interval)
+        self._heater_reg_output = DeduplicatedOutput(
+            daq.create_heater_reg_writer(),
+            daq.create_heater_reg_quantizer(), interval)
+
+    def _create_zones(self):
+        """Create the functions reading and writing the heater zones.
+
+        """
+        daq = self._daq
+        self._zone_input_names = [c.name for c in self.channels.zone_inputs]
+        self._zone_output_names = [c.name for c in self.channels.zone_outputs]
+        self._read_zones = daq.create_zones_reader()
+        write = daq.create_zones_writer()
+        # The zones share the range of the heater regulation. The states are
+        # stored as a tuple so that they can be compared as a whole.
+        quantize = daq.create_heater_reg_quantizer()
+        self._zone_output = DeduplicatedOutput(
+            lambda states: write(np.array(states)),
+            lambda values: tuple([quantize(v)
+                                  for v in np.asarray(values).tolist()]),
+            daq.output_refresh_interval)
+        # Report the initial state of all the zones.
+        self.set_zone_outputs(np.zeros(len(self._zone_output_names)))
+
+    def _start_outputs_refresh(self):
+        """Start a thread periodically refreshing the outputs.
+
+        This guarantees the outputs are re-asserted even when the running step
+        does not update them for a long time.
+
+        """
+        interval = self._daq.output_refresh_interval
+        if interval <= 0:
+            return
+
+        def refresh():
+            while not self._stop_threads.wait(interval/2):
+                now = self.clock.now()
+                self._heater_switch_output.refresh(now)
+                self._heater_reg_output.refresh(now)
+                if self._zone_output is not None:
+                    self._zone_output.refresh(now)
+
+        thread = Thread(target=refresh, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _start_inputs_acquisition(self):
+        """Start the threads acquiring the auxiliary inputs.
+
+        The channels sharing a sample rate are read at once by a single
+        thread, so that the cost of a read does not grow with the number of
+        channels.
+
+        """
+        groups = {}
+        for config in self.channels.auxiliary_inputs:
+            if config.sample_rate > 0:
+                groups.setdefault(config.sample_rate, []).append(config.name)
+        for rate, names in groups.items():
+            reader = self._daq.create_inputs_reader(names)
+            thread = Thread(target=self._acquire_inputs,
+                            args=(names, reader, 1/rate), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _acquire_inputs(self, names, read, period):
+        """Periodically read and post the values of input channels.
+
+        """
+        clock = self.clock
+        post = self._post
+        stop = self._stop_threads
+        next_read = clock.now()
+        try:
+            while True:
+                before = clock.now_ns()
+                values = read()
+                t_ns = (before + clock.now_ns())//2
+                for name, value in zip(names, values):
+                    post(name, t_ns, value)
+                next_read += period
+                if stop.wait(max(next_read - clock.now(), 0)):
+                    return
+        except Exception:
+            print(f'Acquisition of {names} failed:\n' +
+                  traceback.format_exc())
 
 
 class AnnealerProcess(Atom):
@@ -179,6 +915,9 @@ class AnnealerProcess(Atom):
     #: Steps describing the annealing process.
     steps = List(BaseStep, [])
 
+    #: Directory in which the last run of the process was recorded.
+    run_directory = Str()
+
     #: Current status of the process.
     status = Enum('Inactive', 'Started', 'Running', 'Completed',
                   'Stopping', 'Stopped', 'Failed')
@@ -253,28 +992,83 @@ class AnnealerProcess(Atom):
         """Start the process execution.
 
         """
-        queue = Queue()
-        stop_event = Event()
-        crashed_event = Event()
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        self.run_directory = create_run_directory(app_state.runs_directory,
+                                                  name)
+        self._launch(app_state, self.path)
 
-        #: Reset the plots data
-        app_state.temperature.current_index = 0
-        app_state.heater_switch.current_index = 0
-        app_state.heater_regulation.current_index = 0
-
-        self._actuator = ActuatorSubprocess(self.path,
-                                            app_state.get_daq_config(),
-                                            queue, stop_event,
-                                            crashed_event)
-        self._monitoring_thread = MonitoringThread(self)
-        self._polling_thread = PollingThread(app_state, queue)
+    def resume(self, app_state, directory):
+        """Resume an interrupted run from its last checkpoint.
 
-        self._actuator.start()
-        self.status = 'Started'
-        self._monitoring_thread.start()
-        self._polling_thread.start()
+        The process recorded in the run is executed (in a new run directory)
+        starting from the checkpointed step, provided that the temperature
+        did not drift too far from the checkpointed one.
 
-        app_state.start_plot_timer()
+        """
+        checkpoint = read_checkpoint(directory)
+        if checkpoint is None:
+            raise ValueError(f'The run {directory} has no checkpoint to '
+                             'resume from.')
+        checkpoint['directory'] = directory
+        meta = read_meta(directory)
+
+        name = os.path.splitext(os.path.basename(meta['process_path']))[0]
+        self.run_directory = create_run_directory(app_state.runs_directory,
+                                                  name + '_resumed')
+        process_path = os.path.join(self.run_directory, 'process.json')
+        with open(process_path, 'w') as f:
+            json.dump(meta['process'], f)
+        self._launch(app_state, process_path, checkpoint)
+
+    def attach(self, app_state, client):
+        """Follow a run executed by a service.
+
+        The data already discarded from the ring of the service are read from
+        the recording.
+
+        """
+        self.run_directory = client.run_directory
+        info = client.run_info
+        app_state.configure_channels(
+            ChannelRegistry.from_daq_config(info['daq_config']))
+        app_state.reset_channels()
+        app_state.update_telemetry_stats(0, 0, 0.0, 0)
+
+        ring_start = info['ring_start']
+        if not info['complete'] and ring_start is not None:
+            recording = RunRecording(self.run_directory)
+            stop = recording.position(ring_start)
+            for _, records in recording.iter_chunks(0, stop):
+                for channel, (times, values) in \
+                        recording.split_by_channel(records).items():
+                    older = times < ring_start
+                    app_state.channels[channel].extend(times[older],
+                                                       values[older])
+
+        self._follow(app_state, client, client)
+
+    def dry_run(self, app_state, initial_temperature=None):
+        """Predict the execution of the process (see dryrun.dry_run).
+
+        The furnace is simulated using its identified models or, if it was
+        never identified, the simulation model of the DAQ config. The
+        predicted temperature is overlaid on the live plot.
+
+        """
+        daq_config = app_state.get_daq_config()
+        store = ModelStore.in_directory(app_state.runs_directory)
+        models = store.models(daq_config.get('device_id', 'Dev1'))
+        if not models and daq_config.get('simulation_model'):
+            models = [ThermalModel.from_dict(daq_config['simulation_model'])]
+        if not models:
+            raise ValueError('The furnace was never identified and the DAQ '
+                             'config has no simulation model.')
+        prediction = dry_run(self.steps, models, daq_config,
+                             initial_temperature)
+        app_state.overlays = dict(app_state.overlays,
+                                  Predicted=(prediction['times'],
+                                             prediction['temperatures']))
+        return prediction
 
     def stop(self, force=False):
         """Stop the process.
@@ -288,8 +1082,84 @@ class AnnealerProcess(Atom):
 
     # --- Private API ---------------------------------------------------------
 
-    #: Subprocess actuator repsonible for the process execution.
-    _actuator = Typed(ActuatorSubprocess)
+    def _launch(self, app_state, process_path, checkpoint=None):
+        """Start the actuator executing the process stored in process_path.
+
+        """
+        daq_config = app_state.get_daq_config()
+        app_state.configure_channels(
+            ChannelRegistry.from_daq_config(daq_config))
+        #: Reset the plots data
+        app_state.reset_channels()
+        app_state.update_telemetry_stats(0, 0, 0.0, 0)
+
+        # Identified models of the furnace, used by model based steps and,
+        # without hardware, to simulate the furnace.
+        store = ModelStore.in_directory(app_state.runs_directory)
+        furnace = daq_config.get('device_id', 'Dev1')
+        models = store.models(furnace)
+        if models and 'simulation_model' not in daq_config:
+            daq_config['simulation_model'] = store.find(furnace).to_dict()
+        models = [m.to_dict() for m in models]
+        profiling = app_state.get_profiling()
+
+        if app_state.detached_runs:
+            client = launch_service(dict(
+                process_config_path=process_path, daq_config=daq_config,
+                telemetry_policy=app_state.telemetry_policy,
+                run_directory=self.run_directory,
+                compression=app_state.compression, thermal_models=models,
+                filters=app_state.filters, checkpoint=checkpoint,
+                resume_tolerance=app_state.resume_tolerance,
+                queue_size=app_state.telemetry_queue_size,
+                profiling=profiling))
+            self._follow(app_state, client, client, profiling)
+            return
+
+        queue = Queue(app_state.telemetry_queue_size)
+        stop_event = Event()
+        crashed_event = Event()
+        actuator = ActuatorSubprocess(process_path,
+                                      daq_config,
+                                      queue, stop_event,
+                                      crashed_event,
+                                      app_state.telemetry_policy,
+                                      self.run_directory,
+                                      app_state.compression,
+                                      models,
+                                      app_state.filters,
+                                      checkpoint,
+                                      app_state.resume_tolerance,
+                                      profiling)
+        actuator.start()
+        self._follow(app_state, actuator, queue, profiling)
+
+    def _follow(self, app_state, actuator, queue, profiling=None):
+        """Start the threads tracking the execution of the process.
+
+        If profiling settings are provided, the ingestion of the telemetry and
+        the main thread (in which the plots are updated) are profiled.
+
+        """
+        self._actuator = actuator
+        self._monitoring_thread = MonitoringThread(self)
+        self._polling_thread = PollingThread(app_state, queue)
+        if profiling is not None:
+            profiler = SamplingProfiler(
+                self.run_directory, 'gui', ProfileConfig(**profiling),
+                [threading.main_thread(), self._polling_thread])
+            self._polling_thread.profiler = profiler
+            profiler.start()
+
+        self.status = 'Started'
+        self._monitoring_thread.start()
+        self._polling_thread.start()
+
+        app_state.start_plot_timer('run')
+
+    #: Subprocess actuator repsonible for the process execution, or client of
+    #: the service executing it.
+    _actuator = Value()
 
     #: Thread responsible for updating the app about the state of progress of
     #: the process.
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Statistical sampling profiler writing its results next to a run.
+
+A background thread periodically captures the Python stack of the profiled
+threads (sys._current_frames) and counts the identical stacks. The stacks are
+sampled on the wall clock: a thread waiting (on the DAQ, a queue, a sleep)
+appears with the stack of its wait, which is what matters to understand where
+a control loop spends its time.
+
+The artifacts are written in the PROFILE_DIRECTORY of the run directory, each
+profiled process using its own name (e.g. 'actuator' or 'gui'):
+
+- <name>.folded: collapsed stacks ('thread;outer;...;inner count' lines)
+  readable by flamegraph.pl, speedscope or inferno.
+- <name>.json: summary of the profile (settings, samples, overhead).
+- <name>_allocations_<index>.tracemalloc: tracemalloc snapshots (see
+  tracemalloc.Snapshot.load), if allocations are traced.
+
+The files are rewritten every flush_interval so that a crashed or killed
+process leaves a usable profile behind.
+
+Overhead: capturing the stacks holds the GIL, which delays the other threads
+by the duration of a sample (typically 20-100 us for a dozen threads). The
+profiler measures the time it spends sampling and writing and stretches the
+interval between samples so that this time never exceeds max_overhead of the
+wall clock time (1 % by default). A thread busy running Python code is
+slowed down a bit more (5-10 % for the PID loop) by the handoffs of the GIL
+at each sample, which can be reduced by lengthening the interval.
+
+Tracing the allocations is not covered by this bound: tracemalloc slows down
+every allocation, allocation heavy code such as the PID loop running about
+ten times slower, and should only be enabled to hunt a leak (see
+benchmarks/bench_profiler.py).
+
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from threading import Event, Thread
+
+from atom.api import Atom, Bool, Float, Int
+
+#: Name of the directory of the run directory holding the profiles.
+PROFILE_DIRECTORY = 'profile'
+
+
+class ProfileConfig(Atom):
+    """Settings of the profiler.
+
+    """
+    #: Shortest interval in s between two samples.
+    interval = Float(0.01)
+
+    #: Largest fraction of the wall clock time spent profiling.
+    max_overhead = Float(0.01)
+
+    #: Interval in s at which the artifacts are written.
+    flush_interval = Float(10.0)
+
+    #: Whether to trace the allocations using tracemalloc.
+    tracemalloc = Bool()
+
+    #: Number of frames stored per traced allocation.
+    tracemalloc_frames = Int(10)
+
+    #: Interval in s between two allocation snapshots. A snapshot is always
+    #: taken when the profiler stops.
+    snapshot_interval = Float(300.0)
+
+    def to_dict(self):
+        """Settings as a JSON serializable dict.
+
+        """
+        return {name: getattr(self, name) for name in self.members()}
+
+
+class SamplingProfiler(object):
+    """Sample the stacks of the threads of the current process.
+
+    Parameters
+    ----------
+    directory : str
+        Run directory, the artifacts being written in its PROFILE_DIRECTORY.
+    name : str
+        Name of the profiled process, prefixing the artifacts.
+    config : ProfileConfig, optional
+        Settings of the profiler.
+    threads : list[Thread], optional
+        Threads to profile, by default all the threads of the process. The
+        threads may not be started yet.
+
+    """
+    def __init__(self, directory, name, config=None, threads=None):
+        self.directory = os.path.join(directory, PROFILE_DIRECTORY)
+        self.name = name
+        self.config = config or ProfileConfig()
+        self.threads = threads
+        #: Number of stacks sampled per (thread, frames...) tuple.
+        self.stacks = Counter()
+        #: Number of sampling rounds performed.
+        self.samples = 0
+        #: Time in s spent sampling and writing the artifacts.
+        self.sampling_time = 0.0
+        #: Number of allocation snapshots written.
+        self.snapshots = 0
+        #: Error which interrupted the profiler, if any.
+        self.error = None
+        self._start = 0.0
+        self._start_time = 0.0
+        self._stop_time = None
+        self._labels = {}
+        self._started_tracemalloc = False
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True,
+                              name='SamplingProfiler')
+
+    @property
+    def overhead(self):
+        """Fraction of the wall clock time spent profiling.
+
+        """
+        end = self._stop_time or time.perf_counter()
+        elapsed = end - self._start
+        return self.sampling_time/elapsed if elapsed > 0 else 0.0
+
+    def start(self):
+        """Start sampling.
+
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if self.config.tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(self.config.tracemalloc_frames)
+            self._started_tracemalloc = True
+        self._start = time.perf_counter()
+        self._start_time = time.time()
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write the final artifacts.
+
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    # --- Private API ---------------------------------------------------------
+
+    def _run(self):
+        """Sample the stacks until stopped.
+
+        """
+        config = self.config
+        perf_counter = time.perf_counter
+        next_flush = self._start + config.flush_interval
+        next_snapshot = self._start + config.snapshot_interval
+        try:
+            # The first snapshot is the reference to which the growth of the
+            # allocations is measured.
+            if config.tracemalloc:
+                self._snapshot()
+            while True:
+                tic = perf_counter()
+                self._sample()
+                self.samples += 1
+                if tic >= next_flush:
+                    self._flush()
+                    next_flush = tic + config.flush_interval
+                if config.tracemalloc and tic >= next_snapshot:
+                    self._snapshot()
+                    next_snapshot = tic + config.snapshot_interval
+                cost = perf_counter() - tic
+                self.sampling_time += cost
+                # Keep the time spent profiling below max_overhead.
+                wait = max(config.interval,
+                           cost/config.max_overhead - cost)
+                if self._stop.wait(wait):
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self._stop_time = perf_counter()
+            if config.tracemalloc:
+                self._snapshot()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            self._flush()
+
+    def _sample(self):
+        """Capture the stacks of the profiled threads.
+
+        """
+        own = threading.get_ident()
+        threads = self.threads or threading.enumerate()
+        names = {t.ident: t.name for t in threads}
+        labels = self._labels
+        stacks = self.stacks
+        frames = sys._current_frames()
+        try:
+            for ident, frame in frames.items():
+                if ident == own or (self.threads and ident not in names):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = _label(code)
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[tuple(reversed(stack))] += 1
+        finally:
+            del frames
+
+    def _flush(self):
+        """Write the collapsed stacks and the summary of the profile.
+
+        """
+        lines = [';'.join(stack) + f' {count}\n'
+                 for stack, count in self.stacks.items()]
+        self._write(f'{self.name}.folded', ''.join(lines))
+        summary = dict(settings=self.config.to_dict(),
+                       start_time=self._start_time,
+                       duration=((self._stop_time or time.perf_counter())
+                                 - self._start),
+                       samples=self.samples,
+                       sampling_time=self.sampling_time,
+                       overhead=self.overhead,
+                       allocation_snapshots=self.snapshots,
+                       error=repr(self.error) if self.error else None)
+        self._write(f'{self.name}.json', json.dumps(summary, indent=2))
+
+    def _snapshot(self):
+        """Write a snapshot of the traced allocations.
+
+        """
+        if not tracemalloc.is_tracing():
+            return
+        # The allocations of the profiler itself are left out.
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__)))
+        filename = f'{self.name}_allocations_{self.snapshots:03d}.tracemalloc'
+        path = os.path.join(self.directory, filename)
+        snapshot.dump(path)
+        self.snapshots += 1
+
+    def _write(self, filename, content):
+        """Atomically replace an artifact.
+
+        """
+        path = os.path.join(self.directory, filename)
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+
+def read_profile(directory, name):
+    """Read the collapsed stacks written by a profiler.
+
+    Returns
+    -------
+    stacks : dict
+        Number of samples per stack (tuple of frame labels, the first one
+        being the name of the thread).
+
+    """
+    stacks = {}
+    path = os.path.join(directory, PROFILE_DIRECTORY, f'{name}.folded')
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            stacks[tuple(stack.split(';'))] = int(count)
+    return stacks
+
+
+def top_functions(stacks, count=20):
+    """Functions in which the most samples were taken.
+
+    Returns
+    -------
+    functions : list
+        (label, self samples, total samples) tuples sorted by decreasing self
+        samples, the total counting the samples taken in the callees.
+
+    """
+    own = Counter()
+    total = Counter()
+    for stack, samples in stacks.items():
+        own[stack[-1]] += samples
+        # A recursive function is counted once per stack.
+        for label in set(stack[1:]):
+            total[label] += samples
+    return [(label, samples, total[label])
+            for label, samples in own.most_common(count)]
+
+
+def allocation_growth(directory, name, count=20):
+    """Largest allocation growths between the first and last snapshots.
+
+    Returns
+    -------
+    growth : list[tracemalloc.StatisticDiff]
+        Statistics per allocation line, sorted by decreasing growth.
+
+    """
+    profile_directory = os.path.join(directory, PROFILE_DIRECTORY)
+    prefix = f'{name}_allocations_'
+    paths = sorted(f for f in os.listdir(profile_directory)
+                   if f.startswith(prefix) and f.endswith('.tracemalloc'))
+    if not paths:
+        return []
+    first, last = (tracemalloc.Snapshot.load(os.path.join(profile_directory,
+                                                          p))
+                   for p in (paths[0], paths[-1]))
+    return last.compare_to(first, 'lineno')[:count]
+
+
+# --- Private API -------------------------------------------------------------
+
+def _label(code):
+    """Label of a frame in the collapsed stacks.
+
+    """
+    name = getattr(code, 'co_qualname', code.co_name)
+    filename = os.path.basename(code.co_filename)
+    # ';' separates the frames and the last space the count.
+    return f'{name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""On-disk recording of the telemetry of a run.
+
+A run is recorded in its own directory containing:
+- meta.json: description of the run (process, channels, events, status, ...)
+- telemetry.bin: the samples stored as fixed size little endian records
+  (channel index as uint32, time as int64, value as float64) in the order
+  in which they were produced.
+
+Times are stored as nanoseconds elapsed since the start of the run, measured
+by the monotonic clock of the actuator (see clock.Clock). The anchor of the
+clock is stored in the metadata. Version 1 recordings stored the time in s as
+a float64; they are still readable and are converted when read.
+
+"""
+import json
+import os
+import struct
+import time
+from threading import Lock
+
+import numpy as np
+
+#: Version of the recording format.
+FORMAT_VERSION = 2
+
+#: Struct describing one record of the telemetry file.
+RECORD = struct.Struct('<Iqd')
+
+#: Numpy dtype matching RECORD.
+RECORD_DTYPE = np.dtype([('channel', '<u4'), ('time_ns', '<i8'),
+                         ('value', '<f8')])
+
+#: Numpy dtype of the records of version 1 files, which is also the dtype of
+#: the records returned when reading a recording (time in s).
+RECORD_DTYPE_V1 = np.dtype([('channel', '<u4'), ('time', '<f8'),
+                            ('value', '<f8')])
+
+#: Name of the file storing the metadata of a run.
+META_FILE = 'meta.json'
+
+#: Name of the file storing the samples of a run.
+TELEMETRY_FILE = 'telemetry.bin'
+
+#: Channels recorded by default, as (name, kind) pairs.
+DEFAULT_CHANNELS = (('temperature', 'continuous'),
+                    ('heater_switch', 'stepped'),
+                    ('heater_regulation', 'stepped'))
+
+
+def create_run_directory(root, name):
+    """Create a new, uniquely named, directory in which to record a run.
+
+    """
+    stem = time.strftime('%Y%m%d-%H%M%S') + '_' + name
+    path = os.path.join(root, stem)
+    index = 1
+    while os.path.exists(path):
+        path = os.path.join(root, f'{stem}_{index}')
+        index += 1
+    os.makedirs(path)
+    return path
+
+
+def write_meta(directory, meta):
+    """Atomically (re-)write the metadata of a run.
+
+    """
+    path = os.path.join(directory, META_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def read_meta(directory):
+    """Read the metadata of a run.
+
+    """
+    with open(os.path.join(directory, META_FILE)) as f:
+        return json.load(f)
+
+
+class RunRecorder(object):
+    """Write the telemetry of a run to disk.
+
+    Parameters
+    ----------
+    directory : str
+        Directory in which to record the run.
+    meta : dict
+        Metadata describing the run. The channels, start time and format
+        version are added by the recorder.
+    channels : iterable
+        (name, kind) pairs describing the recorded channels.
+
+    """
+    def __init__(self, directory, meta, channels=DEFAULT_CHANNELS):
+        self.directory = directory
+        self.meta = dict(meta)
+        self.meta.update(format_version=FORMAT_VERSION,
+                         channels=[{'name': n, 'kind': k}
+                                   for n, k in channels],
+                         start_time=time.time(),
+                         end_time=None,
+                         status='Running',
+                         events=[])
+        self._indexes = {name: i for i, (name, _) in enumerate(channels)}
+        self._file = open(os.path.join(directory, TELEMETRY_FILE), 'ab')
+        self._lock = Lock()
+        write_meta(directory, self.meta)
+
+    def write(self, samples):
+        """Write (channel, time, value) samples, time being in ns.
+
+        Samples of channels that are not recorded are ignored.
+
+        """
+        pack = RECORD.pack
+        indexes = self._indexes
+        self._file.write(b''.join(pack(indexes[c], t, v)
+                                  for c, t, v in samples if c in indexes))
+
+    def add_event(self, time, kind, **infos):
+        """Record an event (step transition, ...) occuring at time.
+
+        """
+        with self._lock:
+            self.meta['events'].append(dict(time=time, kind=kind, **infos))
+
+    def flush(self):
+        """Flush the samples and the metadata to the disk.
+
+        """
+        self._file.flush()
+        with self._lock:
+            write_meta(self.directory, self.meta)
+
+    def close(self, status):
+        """Close the recording, recording the final status of the run.
+
+        """
+        self._file.close()
+        with self._lock:
+            self.meta['end_time'] = time.time()
+            self.meta['status'] = status
+            write_meta(self.directory, self.meta)
+
+
+class RunRecording(object):
+    """Read access to a recorded run.
+
+    The telemetry file is memory-mapped and accessed by chunks so that it is
+    never loaded as a whole.
+
+    Records are returned with the time in s (see RECORD_DTYPE_V1) whatever the
+    version of the file.
+
+    Samples are stored in the order in which they were produced, which for a
+    given channel is chronological. Across channels, compressed points can be
+    delayed, so seeking relies on the "clock" of the file, ie the running
+    maximum of the sample times.
+
+    Parameters
+    ----------
+    directory : str
+        Directory in which the run was recorded.
+    chunk_size : int
+        Number of records per chunk.
+
+    """
+    def __init__(self, directory, chunk_size=65536):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.meta = read_meta(directory)
+        self.channels = [c['name'] for c in self.meta['channels']]
+        self.kinds = {c['name']: c['kind'] for c in self.meta['channels']}
+        self.version = self.meta.get('format_version', 1)
+        dtype = RECORD_DTYPE if self.version >= 2 else RECORD_DTYPE_V1
+        path = os.path.join(directory, TELEMETRY_FILE)
+        # Ignore a partially written last record.
+        count = os.path.getsize(path) // dtype.itemsize
+        self.raw_records = (np.memmap(path, dtype, 'r', shape=(count,))
+                            if count else np.empty(0, dtype))
+        self._clock_index = None
+
+    def __len__(self):
+        return len(self.raw_records)
+
+    @property
+    def records(self):
+        """All the records, with the time in s.
+
+        For version 2 files, this loads the whole file, prefer iter_chunks.
+
+        """
+        return self.convert(self.raw_records)
+
+    def convert(self, raw):
+        """Convert raw records to records holding the time in s.
+
+        """
+        if self.version < 2:
+            return raw
+        records = np.empty(len(raw), RECORD_DTYPE_V1)
+        records['channel'] = raw['channel']
+        records['time'] = raw['time_ns']*1e-9
+        records['value'] = raw['value']
+        return records
+
+    @property
+    def duration(self):
+        """Time of the latest sample of the run.
+
+        """
+        index = self.clock_index
+        return float(index[-1]) if len(index) else 0.0
+
+    @property
+    def clock_index(self):
+        """Running maximum of the sample times at the end of each chunk.
+
+        """
+        if self._clock_index is None:
+            index = []
+            current = -np.inf
+            for _, chunk in self.iter_chunks():
+                if len(chunk):
+                    current = max(current, chunk['time'].max())
+                index.append(current)
+            self._clock_index = np.array(index)
+        return self._clock_index
+
+    def iter_chunks(self, start=0, stop=None):
+        """Iterate over the records by chunks.
+
+        Yields the position of the first record of the chunk and the chunk
+        (with the time in s).
+
+        """
+        stop = len(self.raw_records) if stop is None else stop
+        for pos in range(start, stop, self.chunk_size):
+            yield pos, self.convert(
+                self.raw_records[pos:min(pos + self.chunk_size, stop)])
+
+    def clock(self, start, stop):
+        """Running maximum of the sample times for records in [start, stop).
+
+        """
+        previous = (-np.inf if start < self.chunk_size else
+                    self.clock_index[start // self.chunk_size - 1])
+        chunk_start = start - start % self.chunk_size
+        times = self._times(chunk_start, stop)
+        clock = np.maximum.accumulate(np.maximum(times, previous))
+        return clock[start - chunk_start:]
+
+    def position(self, time):
+        """Index of the first record produced after a given time.
+
+        """
+        index = self.clock_index
+        chunk = int(np.searchsorted(index, time, 'right'))
+        if chunk >= len(index):
+            return len(self)
+        start = chunk*self.chunk_size
+        stop = min(start + self.chunk_size, len(self))
+        return start + int(np.searchsorted(self.clock(start, stop), time,
+                                           'right'))
+
+    def split_by_channel(self, records):
+        """Split records into per channel (times, values) arrays.
+
+        """
+        split = {}
+        for i, name in enumerate(self.channels):
+            mask = records['channel'] == i
+            if mask.any():
+                selected = records[mask]
+                split[name] = (selected['time'], selected['value'])
+        return split
+
+    # --- Private API ---------------------------------------------------------
+
+    def _times(self, start, stop):
+        """Times in s of the records in [start, stop).
+
+        """
+        if self.version < 2:
+            return self.raw_records['time'][start:stop]
+        return self.raw_records['time_ns'][start:stop]*1e-9
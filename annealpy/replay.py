@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Replay of recorded runs through the live plotting pipeline.
+
+"""
+import time
+from threading import Event, Lock, Thread
+
+from atom.api import Atom, Bool, Float, Str, Typed
+from enaml.application import deferred_call
+
+from .channels import ChannelRegistry
+from .recording import RunRecording
+
+
+class ReplayThread(Thread):
+    """Thread feeding the records of a run to the application state.
+
+    Records are fed at a pace set by the speed factor, relative to the time
+    at which they were produced. The position callback is called in the main
+    thread with the thread and the current time in the run, or None once the
+    replay is over.
+
+    """
+    #: Interval in s at which the thread wakes up to feed new records.
+    tick = 0.02
+
+    def __init__(self, app_state, recording, speed=1.0,
+                 position_callback=None):
+        super().__init__()
+        self.daemon = True
+        self.app_state = app_state
+        self.recording = recording
+        self.position_callback = position_callback
+        self._speed = speed
+        self._paused = False
+        self._position = 0
+        self._virtual_origin = 0.0
+        self._wall_origin = time.monotonic()
+        self._lock = Lock()
+        self._stop_event = Event()
+
+    @property
+    def virtual_time(self):
+        """Current time in the replayed run.
+
+        """
+        if self._paused:
+            return self._virtual_origin
+        return (self._virtual_origin +
+                (time.monotonic() - self._wall_origin)*self._speed)
+
+    def set_speed(self, speed):
+        """Change the replay speed.
+
+        """
+        with self._lock:
+            self._rebase()
+            self._speed = speed
+
+    def set_paused(self, paused):
+        """Pause or resume the replay.
+
+        """
+        with self._lock:
+            self._rebase()
+            self._paused = paused
+
+    def seek(self, target):
+        """Jump to a given time in the run.
+
+        All the records produced before that time are fed at once.
+
+        """
+        with self._lock:
+            self.app_state.reset_channels()
+            position = self.recording.position(target)
+            self._feed(0, position)
+            self._position = position
+            self._virtual_origin = target
+            self._wall_origin = time.monotonic()
+
+    def stop(self):
+        """Stop the replay.
+
+        """
+        self._stop_event.set()
+
+    def run(self):
+        recording = self.recording
+        while not self._stop_event.wait(self.tick):
+            with self._lock:
+                start = self._position
+                if start >= len(recording):
+                    break
+                stop = min(start + recording.chunk_size, len(recording))
+                clock = recording.clock(start, stop)
+                stop = start + int(clock.searchsorted(self.virtual_time,
+                                                      'right'))
+                if stop > start:
+                    self._feed(start, stop)
+                    self._position = stop
+                    if self.position_callback is not None:
+                        deferred_call(self.position_callback, self,
+                                      float(clock[stop - start - 1]))
+
+        if self.position_callback is not None:
+            deferred_call(self.position_callback, self, None)
+
+    # --- Private API ---------------------------------------------------------
+
+    def _rebase(self):
+        """Make the current virtual time the new origin.
+
+        """
+        self._virtual_origin = self.virtual_time
+        self._wall_origin = time.monotonic()
+
+    def _feed(self, start, stop):
+        """Feed the records in [start, stop) to the application state.
+
+        """
+        server = self.app_state.stream_server
+        for _, chunk in self.recording.iter_chunks(start, stop):
+            split = self.recording.split_by_channel(chunk)
+            channels = self.app_state.channels
+            for name, (times, values) in split.items():
+                ch_status = channels.get(name)
+                if ch_status is not None:
+                    ch_status.extend(times, values)
+            if server is not None:
+                server.publish(split)
+
+
+class ReplayController(Atom):
+    """Object driving the replay of a run from the UI.
+
+    """
+    #: Directory of the replayed run.
+    directory = Str()
+
+    #: Description of the replayed run.
+    description = Str()
+
+    #: Duration of the replayed run in s.
+    duration = Float()
+
+    #: Current time in the replayed run.
+    position = Float()
+
+    #: Replay speed factor.
+    speed = Float(1.0)
+
+    #: Whether the replay is paused.
+    paused = Bool()
+
+    #: Whether a replay is in progress.
+    running = Bool()
+
+    def start(self, app_state, directory):
+        """Start replaying a recorded run.
+
+        """
+        self.stop()
+        recording = RunRecording(directory)
+        self.directory = directory
+        self.description = recording.meta.get('description', '')
+        self.duration = recording.duration
+        self.position = 0.0
+        self.paused = False
+
+        app_state.configure_channels(ChannelRegistry.from_daq_config(
+            recording.meta.get('daq_config', {})))
+        app_state.reset_channels()
+        self._app_state = app_state
+        self._thread = ReplayThread(app_state, recording, self.speed,
+                                    self._update_position)
+        self.running = True
+        self._thread.start()
+        app_state.start_plot_timer('replay')
+
+    def seek(self, position):
+        """Jump to a given time of the run.
+
+        """
+        if self._thread is not None:
+            self._thread.seek(position)
+            self.position = position
+            self._app_state.plot_update = True
+
+    def stop(self):
+        """Stop the replay.
+
+        """
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+            self._app_state.stop_plot_timer('replay')
+        self.running = False
+
+    # --- Private API ---------------------------------------------------------
+
+    #: Thread performing the replay.
+    _thread = Typed(ReplayThread)
+
+    #: Application state fed by the replay.
+    _app_state = Typed(Atom)
+
+    def _update_position(self, thread, position):
+        """Update the position, None signaling the end of the replay.
+
+        """
+        if thread is not self._thread:
+            return
+        if position is None:
+            self._thread = None
+            self.running = False
+            self._app_state.stop_plot_timer('replay')
+            self._app_state.plot_update = True
+        else:
+            self.position = position
+
+    def _post_setattr_speed(self, old, new):
+        if self._thread is not None:
+            self._thread.set_speed(new)
+
+    def _post_setattr_paused(self, old, new):
+        if self._thread is not None:
+            self._thread.set_paused(new)
@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Execution of a process in a local service independent of the application.
+
+The service is a detached process executing the actuator and owning the
+recording, so that closing (or crashing) the application does not interrupt
+the run. It keeps a bounded ring of the most recent telemetry batches and
+accepts any number of clients on a local authenticated connection.
+
+Upon attachment a client receives a description of the run, the content of
+the ring and then the live batches. Older data can be read from the
+recording. Clients can request the run to be stopped (or terminated).
+
+The service advertises its address in SERVICE_FILE, in the runs directory,
+for as long as it is running.
+
+Messages sent to the clients are ('info', dict), ('batch', TelemetryBatch)
+and ('end', status) tuples. Clients send 'stop', 'terminate', ('profile',
+settings) to start profiling the actuator (see profiling) or 'stop_profile'.
+
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+from collections import deque
+from multiprocessing.connection import Client, Listener
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+
+#: Name of the file advertising the running service in the runs directory.
+SERVICE_FILE = 'actuator_service.json'
+
+#: Name of the file holding the settings of the service in the run directory.
+SERVICE_CONFIG_FILE = 'service_config.json'
+
+#: Name of the file to which the output of the service is redirected.
+SERVICE_LOG_FILE = 'service.log'
+
+
+def launch_service(config, timeout=30):
+    """Start a detached service executing a process and connect to it.
+
+    Parameters
+    ----------
+    config : dict
+        Arguments of the ActuatorSubprocess (process_config_path, daq_config,
+        telemetry_policy, run_directory, compression, thermal_models, filters,
+        checkpoint, resume_tolerance and profiling) and optionally queue_size,
+        ring_size and terminate_timeout (time in s given to the actuator to
+        stop when terminated before exiting abruptly).
+    timeout : float
+        Time in s to wait for the service to start.
+
+    Returns
+    -------
+    client : ServiceClient
+        Client attached to the service.
+
+    """
+    run_directory = config['run_directory']
+    runs_directory = os.path.dirname(run_directory)
+    running = find_service(runs_directory)
+    if running is not None:
+        running.close()
+        raise RuntimeError('A process is already running.')
+    config_path = os.path.join(run_directory, SERVICE_CONFIG_FILE)
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+
+    if sys.platform == 'win32':
+        options = dict(creationflags=(subprocess.DETACHED_PROCESS |
+                                      subprocess.CREATE_NEW_PROCESS_GROUP))
+    else:
+        options = dict(start_new_session=True)
+    # Make sure the package can be imported even when not installed.
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (package_root, env.get('PYTHONPATH')) if p)
+    with open(os.path.join(run_directory, SERVICE_LOG_FILE), 'w') as log:
+        service = subprocess.Popen([sys.executable, '-m', 'annealpy.service',
+                                    config_path],
+                                   stdin=subprocess.DEVNULL, stdout=log,
+                                   stderr=subprocess.STDOUT, env=env,
+                                   **options)
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        info = read_service_info(runs_directory)
+        if info is not None and info['run_directory'] == run_directory:
+            return ServiceClient(info)
+        if service.poll() is not None:
+            break
+        time.sleep(0.05)
+    raise RuntimeError('The actuator service failed to start, see '
+                       f'{os.path.join(run_directory, SERVICE_LOG_FILE)}')
+
+
+def read_service_info(runs_directory):
+    """Read the description of the service advertised in a runs directory.
+
+    """
+    path = os.path.join(runs_directory, SERVICE_FILE)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        # The file is being written.
+        return None
+
+
+def find_service(runs_directory):
+    """Connect to the service running for a runs directory, if any.
+
+    A stale service file, left by a service that died, is removed.
+
+    """
+    info = read_service_info(runs_directory)
+    if info is None:
+        return None
+    try:
+        return ServiceClient(info)
+    except (OSError, EOFError):
+        try:
+            os.remove(os.path.join(runs_directory, SERVICE_FILE))
+        except OSError:
+            pass
+        return None
+
+
+class ServiceClient(object):
+    """Connection to an actuator service.
+
+    The client exposes the subset of the interfaces of ActuatorSubprocess and
+    of the telemetry queue used by the application: get returns the next
+    batch (None once the run is over), is_alive, join, terminate, stop_event
+    and crashed_event.
+
+    Parameters
+    ----------
+    info : dict
+        Description of the service as found in SERVICE_FILE.
+
+    """
+    def __init__(self, info):
+        self.info = info
+        self._conn = Client(tuple(info['address']),
+                            authkey=bytes.fromhex(info['authkey']))
+        self._send_lock = Lock()
+        self._finished = Event()
+        self.status = ''
+        self.stop_event = _RemoteStopEvent(self)
+        self.crashed_event = Event()
+        kind, self.run_info = self._conn.recv()
+
+    @property
+    def run_directory(self):
+        """Directory in which the run is recorded.
+
+        """
+        return self.info['run_directory']
+
+    def get(self):
+        """Get the next telemetry batch, None once the run is over.
+
+        """
+        if self._finished.is_set():
+            return None
+        while True:
+            try:
+                kind, payload = self._conn.recv()
+            except (EOFError, OSError):
+                kind, payload = 'end', ''
+            if kind == 'batch':
+                return payload
+            elif kind == 'end':
+                self._finish(payload)
+                return None
+
+    def send(self, command):
+        """Send a command to the service.
+
+        """
+        with self._send_lock:
+            try:
+                self._conn.send(command)
+            except OSError:
+                pass
+
+    def is_alive(self):
+        """Whether the run is still in progress.
+
+        """
+        return not self._finished.is_set()
+
+    def join(self, timeout=None):
+        """Wait for the end of the run.
+
+        """
+        self._finished.wait(timeout)
+
+    def terminate(self):
+        """Stop the run without waiting for the current step to end.
+
+        The service exits abruptly if the actuator does not stop in time.
+
+        """
+        self.stop_event.set()
+        self.send('terminate')
+
+    def close(self):
+        """Detach from the service, which keeps running.
+
+        """
+        self._conn.close()
+
+    # --- Private API ---------------------------------------------------------
+
+    def _finish(self, status):
+        """Record the final status of the run.
+
+        If the connection was lost, the run is considered failed unless a stop
+        was requested.
+
+        """
+        if not status:
+            status = 'Stopped' if self.stop_event.is_set() else 'Failed'
+        self.status = status
+        if status == 'Failed':
+            self.crashed_event.set()
+        self._finished.set()
+        self._conn.close()
+
+
+class _RemoteStopEvent(object):
+    """Stop event of a run executed by a service.
+
+    """
+    def __init__(self, client):
+        self._client = client
+        self._set = False
+
+    def set(self):
+        self._set = True
+        self._client.send('stop')
+
+    def is_set(self):
+        return self._set or self._client.status == 'Stopped'
+
+
+class ActuatorService(object):
+    """Service executing a process and relaying its telemetry to clients.
+
+    Parameters
+    ----------
+    config : dict
+        Settings of the service (see launch_service).
+
+    """
+    def __init__(self, config):
+        # Imported here so that clients do not need the actuator machinery.
+        from .process import ActuatorSubprocess
+
+        self.config = config
+        self.run_directory = config['run_directory']
+        self.runs_directory = os.path.dirname(self.run_directory)
+        self.queue = Queue(config.get('queue_size', 100))
+        self.stop_event = Event()
+        self.crashed_event = Event()
+        self.actuator = ActuatorSubprocess(
+            config['process_config_path'], config['daq_config'], self.queue,
+            self.stop_event, self.crashed_event,
+            config.get('telemetry_policy', 'drop_oldest'),
+            self.run_directory, config.get('compression'),
+            config.get('thermal_models'), config.get('filters'),
+            config.get('checkpoint'), config.get('resume_tolerance', 25.0),
+            config.get('profiling'))
+        self.ring = deque(maxlen=config.get('ring_size', 1200))
+        self.dropped_from_ring = False
+        self.status = ''
+        self._clients = []
+        self._lock = Lock()
+        self._done = Event()
+        self._authkey = os.urandom(16)
+        self._listener = Listener(('127.0.0.1', 0), authkey=self._authkey)
+
+    def run(self):
+        """Execute the process until it ends.
+
+        """
+        relay = Thread(target=self._relay, daemon=True)
+        relay.start()
+        Thread(target=self._accept, daemon=True).start()
+        self._advertise()
+        try:
+            # The actuator is executed in this process.
+            self.actuator.run()
+            relay.join()
+            self._index_run()
+        finally:
+            self._withdraw()
+            self._done.set()
+
+    # --- Private API ---------------------------------------------------------
+
+    def _advertise(self):
+        """Write the service file allowing clients to find the service.
+
+        """
+        info = dict(address=list(self._listener.address),
+                    authkey=self._authkey.hex(),
+                    pid=os.getpid(),
+                    run_directory=self.run_directory,
+                    process_config_path=self.config['process_config_path'])
+        path = os.path.join(self.runs_directory, SERVICE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(info, f)
+        os.replace(path + '.tmp', path)
+
+    def _withdraw(self):
+        """Remove the service file and stop accepting clients.
+
+        """
+        try:
+            os.remove(os.path.join(self.runs_directory, SERVICE_FILE))
+        except OSError:
+            pass
+        self._listener.close()
+
+    def _index_run(self):
+        """Add the finished run to the catalog.
+
+        """
+        from .catalog import RunCatalog
+        try:
+            RunCatalog(self.runs_directory).add_run(self.run_directory)
+        except Exception:
+            print(f'Failed to add {self.run_directory} to the run catalog:\n'
+                  + traceback.format_exc())
+
+    def _relay(self):
+        """Store the batches in the ring and send them to the clients.
+
+        """
+        while True:
+            batch = self.queue.get()
+            with self._lock:
+                if batch is None:
+                    self.status = ('Failed' if self.crashed_event.is_set()
+                                   else 'Stopped' if self.stop_event.is_set()
+                                   else 'Completed')
+                    message = ('end', self.status)
+                else:
+                    if len(self.ring) == self.ring.maxlen:
+                        self.dropped_from_ring = True
+                    self.ring.append(batch)
+                    message = ('batch', batch)
+                for client in self._clients:
+                    client.push(message)
+            if batch is None:
+                break
+        # Give the clients a chance to receive the end of the run.
+        for client in list(self._clients):
+            client.join(5)
+
+    def _accept(self):
+        """Accept the connection of new clients.
+
+        """
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return
+            except Exception:
+                # Failed authentication for example.
+                print(traceback.format_exc())
+                continue
+            with self._lock:
+                ring = list(self.ring)
+                first = next((b.samples[0][1]*1e-9 for b in ring
+                              if b.samples), None)
+                info = dict(run_directory=self.run_directory,
+                            daq_config=self.config['daq_config'],
+                            start_time=self.actuator.start_time,
+                            complete=not self.dropped_from_ring,
+                            ring_start=first)
+                client = _ServiceConnection(self, conn)
+                client.push(('info', info))
+                for batch in ring:
+                    client.push(('batch', batch))
+                if self.status:
+                    client.push(('end', self.status))
+                else:
+                    self._clients.append(client)
+            client.start()
+
+    def _remove_client(self, client):
+        """Forget a disconnected client.
+
+        """
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def _execute(self, command):
+        """Execute a command sent by a client.
+
+        """
+        if command == 'stop':
+            self.stop_event.set()
+        elif command == 'terminate':
+            # The receiving thread must not block on the end of the run.
+            Thread(target=self._terminate, daemon=True).start()
+        elif command == 'stop_profile':
+            self.actuator.stop_profiling()
+        elif isinstance(command, tuple) and command[0] == 'profile':
+            self.actuator.start_profiling(command[1])
+
+    def _terminate(self):
+        """Stop the run, exiting abruptly if the actuator does not stop.
+
+        A stopped run leaves a checkpoint behind, as does a killed one, so the
+        run can be resumed in both cases.
+
+        """
+        self.stop_event.set()
+        if self._done.wait(self.config.get('terminate_timeout', 10.0)):
+            return
+        recorder = self.actuator._recorder
+        if recorder is not None:
+            recorder.meta['error'] = ('Terminated, the actuator did not stop '
+                                      'in time.')
+            recorder.close('Failed')
+        self._withdraw()
+        os._exit(1)
+
+
+class _ServiceConnection(object):
+    """Connection of the service with one client.
+
+    Messages are queued and sent from a dedicated thread, the oldest messages
+    being discarded if the client does not keep up. The samples discarded are
+    added to the dropped count of the following batches so that the client
+    reports them along with the samples dropped by the actuator.
+
+    """
+    def __init__(self, service, conn, queue_size=2000):
+        self.service = service
+        self.conn = conn
+        self.queue = Queue(queue_size)
+        #: Number of samples discarded because the client did not keep up.
+        self.dropped = 0
+        self._sender = Thread(target=self._send, daemon=True)
+        self._receiver = Thread(target=self._receive, daemon=True)
+
+    def start(self):
+        self._sender.start()
+        self._receiver.start()
+
+    def push(self, message):
+        """Queue a message for the client.
+
+        """
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except Full:
+                try:
+                    kind, payload = self.queue.get_nowait()
+                except Empty:
+                    continue
+                if kind == 'batch':
+                    self.dropped += len(payload.samples)
+
+    def join(self, timeout):
+        self._sender.join(timeout)
+
+    def _send(self):
+        """Send the queued messages until the end of the run.
+
+        """
+        try:
+            while True:
+                message = self.queue.get()
+                if message[0] == 'batch' and self.dropped:
+                    batch = message[1]
+                    message = ('batch', batch._replace(
+                        dropped=batch.dropped + self.dropped))
+                self.conn.send(message)
+                if message[0] == 'end':
+                    break
+        except OSError:
+            pass
+        finally:
+            self.service._remove_client(self)
+
+    def _receive(self):
+        """Execute the commands sent by the client.
+
+        """
+        try:
+            while True:
+                self.service._execute(self.conn.recv())
+        except (EOFError, OSError):
+            self.service._remove_client(self)
+
+
+def main(argv=None):
+    """Run the service described by a configuration file.
+
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    with open(argv[0]) as f:
+        config = json.load(f)
+    ActuatorService(config).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -10,22 +10,35 @@ import enaml
 
 from .base_step import BaseStep
 from .fast_ramp import FastRamp
+from .feed_forward_ramp import FeedForwardRamp
+from .multi_zone_step import MultiZoneStep
 from .pid_regulated_step import PIDRegulatedStep
 from .stop_heating_step import StopHeatingStep
+from .time_proportioning_step import TimeProportioningStep
 
 with enaml.imports():
     from .views.pid_regulated_step_view import PIDRegulatedStepView
     from .views.stop_heating_step_view import StopHeatingStepView
     from .views.fast_ramp_view import FastRampView
+    from .views.feed_forward_ramp_view import FeedForwardRampView
+    from .views.multi_zone_step_view import MultiZoneStepView
+    from .views.time_proportioning_step_view import \
+        TimeProportioningStepView
 
 STEPS = {'StopHeatingStep': StopHeatingStep,
          'PIDRegulatedStep': PIDRegulatedStep,
-         'FastRamp': FastRamp}
+         'FastRamp': FastRamp,
+         'FeedForwardRamp': FeedForwardRamp,
+         'MultiZoneStep': MultiZoneStep,
+         'TimeProportioningStep': TimeProportioningStep}
 
 
 _STEP_VIEWS = {PIDRegulatedStep: PIDRegulatedStepView,
                StopHeatingStep: StopHeatingStepView,
-               FastRamp: FastRampView}
+               FastRamp: FastRampView,
+               FeedForwardRamp: FeedForwardRampView,
+               MultiZoneStep: MultiZoneStepView,
+               TimeProportioningStep: TimeProportioningStepView}
 
 
 def create_widget(step):
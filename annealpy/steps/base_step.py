@@ -25,11 +25,35 @@ class BaseStep(Atom):
         - heater_switch_state: boolean attribute
         - heater_reg_state: float attribute
         - read_temperature: method taking no argument
+        - wait_until: method waiting for the temperature to cross a threshold
+        - sleep: method sleeping unless a stop is requested, which should be
+          used rather than time.sleep so that the step can be executed in
+          virtual time (see dryrun)
         - stop_event: event object signaling to end prematurely
+        - checkpoint_pid: PID kernel whose state should be checkpointed
+        - read_zone_temperatures: method reading all the heater zones at once
+          (multi-zone furnaces only)
+        - set_zone_outputs: method setting the regulators of all the zones
+          at once, zone_outputs giving their current states
+        - play_heater_reg: method playing precomputed regulator states at a
+          fixed rate
+        - start_switch_pwm/stop_switch_pwm: methods driving the heater switch
+          with a duty cycle
+        - clock: clock of the run, whose now method gives the time in s
+          that should be used for all timing purposes
 
         """
         raise NotImplementedError()
 
+    def resume(self, actuator, state):
+        """Resume the step from a checkpoint.
+
+        state contains the elapsed time in the step ('elapsed') and the state
+        of the checkpointed PID ('pid'). By default, the step is restarted.
+
+        """
+        self.run(actuator)
+
     def get_preferences_from_members(self):
         """Return a dict with all the value that must be saved.
 
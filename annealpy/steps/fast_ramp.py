@@ -9,8 +9,6 @@
 """Fast ramps relying on the maximum outoput power of the heater.
 
 """
-import time
-
 from atom.api import Float, Int
 
 from .base_step import BaseStep
@@ -46,6 +44,9 @@ class FastRamp(BaseStep):
     #: D parameter of the PID s.Celsius
     parameter_d = Float().tag(pref=True)
 
+    #: Time constant in s of the low-pass filter applied to the D term.
+    derivative_filter = Float().tag(pref=True)
+
     #: Time interval at which to update the PID answer in s.
     pid_interval = Float(.1).tag(pref=True)
 
@@ -62,7 +63,9 @@ class FastRamp(BaseStep):
         pid = PID(target=self.target_temperature,
                   parameter_p=self.parameter_p,
                   parameter_i=self.parameter_i,
-                  parameter_d=self.parameter_d)
+                  parameter_d=self.parameter_d,
+                  derivative_filter=self.derivative_filter).create_kernel()
+        actuator.checkpoint_pid = pid
 
         # Ramp quickly to the maximum allowed value
         actuator.heater_switch_state = True
@@ -70,53 +73,60 @@ class FastRamp(BaseStep):
 
         max_temp = self.target_temperature + self.allowed_error
         min_temp = self.target_temperature - self.allowed_error
+        wait_until = actuator.wait_until
+        interval = self.switch_interval
+        now = actuator.clock.now
 
-        tic = None
-
-        while True:
-            current_temp = actuator.temperature
-            if tic is None and current_temp > min_temp:
-                tic = time.time()
-            elif current_temp > max_temp:
-                break
-            time.sleep(self.switch_interval)
+        if not wait_until(min_temp, interval=interval):
+            return
+        tic = now()
+        if not wait_until(max_temp, interval=interval):
+            return
 
         # Ramp down to minimum allowed value
-        toc = time.time()
+        toc = now()
         on_time = toc - tic
         actuator.heater_switch_state = False
-        while actuator.temperature > min_temp:
-            time.sleep(self.switch_interval)
-        tic = time.time()
+        if not wait_until(min_temp, rising=False, interval=interval):
+            return
+        tic = now()
         off_time = tic - toc
 
         # Repeat the above as many times as requested
         for i in range(self.on_off_cycles - 1):
             actuator.heater_switch_state = True
-            while actuator.temperature < max_temp:
-                time.sleep(self.switch_interval)
-            toc = time.time()
+            if not wait_until(max_temp, interval=interval):
+                return
+            toc = now()
             on_time += toc - tic
 
             actuator.heater_switch_state = False
-            while actuator.temperature > min_temp:
-                time.sleep(self.switch_interval)
-            tic = time.time()
+            if not wait_until(min_temp, rising=False, interval=interval):
+                return
+            tic = now()
             off_time += tic - toc
 
         # Use the on/off ratio to set the ouput power and start the PID
-        self.heater_reg_state = on_time/(on_time + off_time)
-        self.heater_switch_state = True
+        actuator.heater_reg_state = on_time/(on_time + off_time)
+        actuator.heater_switch_state = True
+
+        read_temperature = actuator.read_temperature
+        set_heater_reg = actuator.set_heater_reg
+        compute = pid.compute
+        stop_event = actuator.stop_event
+        interval = self.pid_interval
+
+        # Hand over to the PID starting from the estimated output power.
+        pid.bumpless_start(actuator.heater_reg_state, tic,
+                           read_temperature())
 
         stop = tic + self.duration
         while True:
 
-            current_time = time.time()
-            if stop - current_time < 0 or actuator.stop_event.is_set():
+            current_time = now()
+            if stop - current_time < 0 or stop_event.is_set():
                 break
 
-            temp = actuator.read_temperature()
-            feedback = pid.compute_new_output(current_time, temp)
-            actuator.heater_reg_state = max(0.0, min(feedback, 1.0))
+            set_heater_reg(compute(current_time, read_temperature()))
 
-            time.sleep(min(self.pid_interval, stop - current_time))
+            actuator.sleep(min(interval, stop - current_time))
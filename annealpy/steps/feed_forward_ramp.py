@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Model based ramps driving the heater along a precomputed trajectory.
+
+"""
+import math
+
+import numpy as np
+from atom.api import Float
+
+from .base_step import BaseStep
+from .pid import PID
+
+
+def plan_ramp(model, initial_temperature, target, max_overshoot,
+              current_command=0.0):
+    """Compute the fastest command trajectory reaching a target.
+
+    The heater is driven at full power (or switched off when cooling) and
+    then set to the command holding the target. The switching time is the
+    latest one for which the predicted overshoot stays below max_overshoot,
+    found by bisection since the overshoot increases with it.
+
+    Parameters
+    ----------
+    model : ThermalModel
+        Identified model of the furnace.
+    initial_temperature : float
+        Current temperature.
+    target : float
+        Target temperature.
+    max_overshoot : float
+        Maximal allowed excursion beyond the target.
+    current_command : float
+        Command currently applied, which still affects the temperature during
+        the dead time.
+
+    Returns
+    -------
+    commands : np.ndarray
+        Command to apply at each period of the model.
+    temperatures : np.ndarray
+        Predicted temperature at each period.
+    hold : float
+        Command holding the target, to apply after the trajectory.
+
+    """
+    if model.gain <= 0:
+        raise ValueError('The thermal model has a non-positive gain.')
+    hold = min(max((target - model.ambient)/model.gain, 0.0), 1.0)
+    heating = target >= initial_temperature
+    boost = 1.0 if heating else 0.0
+
+    tau = model.time_constant
+    if not math.isfinite(tau):
+        raise ValueError('The thermal model is not stable.')
+    length = int(math.ceil((model.dead_time + 10*tau)/model.dt)) + 1
+    past = [current_command]*model.delay
+
+    def simulate(switch):
+        commands = np.full(length, hold)
+        commands[:switch] = boost
+        return commands, model.simulate(commands, initial_temperature, past)
+
+    def excursion(temperatures):
+        if heating:
+            return temperatures.max() - target
+        return target - temperatures.min()
+
+    low, high = 0, length
+    commands, temperatures = simulate(high)
+    if excursion(temperatures) <= max_overshoot:
+        return commands, temperatures, hold
+    while high - low > 1:
+        middle = (low + high)//2
+        if excursion(simulate(middle)[1]) <= max_overshoot:
+            low = middle
+        else:
+            high = middle
+    commands, temperatures = simulate(low)
+    return commands, temperatures, hold
+
+
+class FeedForwardRamp(BaseStep):
+    """Ramp to a target following a trajectory planned using a thermal model.
+
+    The command computed from the identified model of the furnace is applied
+    as is and a PID, tracking the predicted temperature, only corrects the
+    residual error. When all the gains of the PID are zero, the command is
+    played as a waveform on the regulator (see
+    ActuatorSubprocess.play_heater_reg), the step only monitoring the
+    temperature. At the end of the step, the deviation between the
+    measured and predicted temperatures is recorded as an event of the run.
+
+    """
+    #: Target temperature in C.
+    target_temperature = Float(200).tag(pref=True)
+
+    #: Maximal allowed overshoot in C.
+    max_overshoot = Float(2).tag(pref=True)
+
+    #: Deviation from the target in C below which the target is considered
+    #: reached.
+    allowed_error = Float(1).tag(pref=True)
+
+    #: Total duration of the step in s, including the ramp.
+    duration = Float().tag(pref=True)
+
+    #: P parameter of the correcting PID in Celsiusˆ-1
+    parameter_p = Float().tag(pref=True)
+
+    #: I parameter of the correcting PID in Celsiusˆ-1sˆ-1
+    parameter_i = Float().tag(pref=True)
+
+    #: D parameter of the correcting PID s.Celsius
+    parameter_d = Float().tag(pref=True)
+
+    #: Time constant in s of the low-pass filter applied to the D term.
+    derivative_filter = Float().tag(pref=True)
+
+    #: Time interval at which to update the command in s.
+    interval = Float(.1).tag(pref=True)
+
+    def run(self, actuator):
+        """Follow the planned trajectory, correcting it with the PID.
+
+        """
+        self._ramp(actuator)
+
+    def resume(self, actuator, state):
+        """Plan a new trajectory from the current temperature.
+
+        The ramp ends at the originally planned time.
+
+        """
+        self._ramp(actuator, state['elapsed'])
+
+    # --- Private API ---------------------------------------------------------
+
+    def _ramp(self, actuator, elapsed=0.0):
+        """Follow a trajectory planned from the current temperature.
+
+        """
+        now = actuator.clock.now
+        start = now()
+        stop = start + self.duration - elapsed
+
+        read_temperature = actuator.read_temperature
+        initial = read_temperature()
+        model = actuator.get_thermal_model(self.target_temperature)
+        if model is None:
+            raise RuntimeError('No thermal model was identified for the '
+                               'furnace, a FeedForwardRamp cannot be used.')
+
+        current_command = (actuator.heater_reg_state
+                           if actuator.heater_switch_state else 0.0)
+        commands, predicted, hold = plan_ramp(model, initial,
+                                              self.target_temperature,
+                                              self.max_overshoot,
+                                              current_command)
+        commands = commands.tolist()
+        predicted = predicted.tolist()
+        last = len(commands) - 1
+        dt = model.dt
+
+        # The PID tracks the predicted temperature and outputs a correction.
+        pid = PID(target=initial,
+                  parameter_p=self.parameter_p,
+                  parameter_i=self.parameter_i,
+                  parameter_d=self.parameter_d,
+                  derivative_filter=self.derivative_filter
+                  ).create_kernel(-1.0, 1.0)
+        actuator.checkpoint_pid = pid
+
+        actuator.heater_switch_state = True
+
+        set_heater_reg = actuator.set_heater_reg
+        compute = pid.compute
+        stop_event = actuator.stop_event
+        interval = self.interval
+        target = self.target_temperature
+        allowed_error = self.allowed_error
+
+        max_deviation = 0.0
+        squared_deviation = 0.0
+        count = 0
+        reached = None
+
+        # Without correction, the commands are generated as a waveform
+        # (clocked by the DAQ when possible) and the loop only monitors the
+        # temperature.
+        player = None
+        if not (self.parameter_p or self.parameter_i or self.parameter_d):
+            player = actuator.play_heater_reg(commands[:last] + [hold], 1/dt)
+
+        try:
+            while True:
+
+                current_time = now()
+                if stop - current_time < 0 or stop_event.is_set():
+                    break
+
+                elapsed = current_time - start
+                index = int(elapsed/dt)
+                if index < last:
+                    # Interpolate the prediction between the model periods.
+                    frac = elapsed/dt - index
+                    expected = ((1 - frac)*predicted[index] +
+                                frac*predicted[index + 1])
+                    feed_forward = commands[index]
+                else:
+                    expected = target
+                    feed_forward = hold
+
+                temperature = read_temperature()
+                if player is None:
+                    # Limit the correction to what the heater can actually
+                    # deliver so that the integral does not wind up when
+                    # saturated.
+                    pid.target = expected
+                    pid.output_min = -feed_forward
+                    pid.output_max = 1.0 - feed_forward
+                    set_heater_reg(feed_forward +
+                                   compute(current_time, temperature))
+                elif player.error is not None:
+                    raise player.error
+
+                deviation = temperature - expected
+                squared_deviation += deviation*deviation
+                count += 1
+                if abs(deviation) > max_deviation:
+                    max_deviation = abs(deviation)
+                if (reached is None and
+                        abs(temperature - target) <= allowed_error):
+                    reached = elapsed
+
+                actuator.sleep(min(interval, stop - current_time))
+        finally:
+            if player is not None:
+                player.stop()
+
+        predicted_reach = next((i*dt for i, t in enumerate(predicted)
+                                if abs(t - target) <= allowed_error), None)
+        actuator.mark_event(
+            'feed_forward_deviation',
+            max_deviation=max_deviation,
+            rms_deviation=math.sqrt(squared_deviation/count) if count else 0.0,
+            time_to_target=reached,
+            predicted_time_to_target=predicted_reach)
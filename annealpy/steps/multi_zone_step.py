@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Coordinated regulation of the heater zones of a multi-zone furnace.
+
+"""
+import math
+
+from atom.api import Float
+
+from .base_step import BaseStep
+from .pid import PID
+
+
+class MultiZoneStep(BaseStep):
+    """Ramp all the heater zones to a target and hold it.
+
+    All the zones follow a common setpoint, ramping from their mean
+    temperature to the target, and are regulated together by a vectorized PID
+    (see pid.ZonePIDKernel). The spread of the zone temperatures is reported
+    at the end of the step.
+
+    """
+    #: Target temperature in Celsius
+    target_temperature = Float().tag(pref=True)
+
+    #: Rate of the ramp of the setpoint in C/s, 0 to set the target at once.
+    ramp_rate = Float().tag(pref=True)
+
+    #: Total duration of the step in s, including the ramp.
+    duration = Float().tag(pref=True)
+
+    #: P parameter of the PID in Celsiusˆ-1
+    parameter_p = Float().tag(pref=True)
+
+    #: I parameter of the PID in Celsiusˆ-1sˆ-1
+    parameter_i = Float().tag(pref=True)
+
+    #: D parameter of the PID s.Celsius
+    parameter_d = Float().tag(pref=True)
+
+    #: Time constant in s of the low-pass filter applied to the D term.
+    derivative_filter = Float().tag(pref=True)
+
+    #: Fraction of the power of the neighbouring zones received by a zone,
+    #: compensated by decoupling the outputs.
+    coupling = Float().tag(pref=True)
+
+    #: Gain pulling the zones toward their mean temperature.
+    gradient_gain = Float().tag(pref=True)
+
+    #: Time interval at which to update the PID answer in s.
+    interval = Float(.1).tag(pref=True)
+
+    def run(self, actuator):
+        """Regulate all the zones together.
+
+        """
+        self._regulate(actuator)
+
+    def resume(self, actuator, state):
+        """Regulate for the remaining duration, restoring the PID state.
+
+        The ramp restarts from the current mean temperature.
+
+        """
+        self._regulate(actuator, state['elapsed'], state.get('pid'))
+
+    # --- Private API ---------------------------------------------------------
+
+    def _regulate(self, actuator, elapsed=0.0, pid_state=None):
+        """Regulate the zones until the end of the step.
+
+        """
+        now = actuator.clock.now
+        start = now()
+        stop = start + self.duration - elapsed
+
+        read_zones = actuator.read_zone_temperatures
+        temperatures = read_zones()
+        pid = PID(parameter_p=self.parameter_p,
+                  parameter_i=self.parameter_i,
+                  parameter_d=self.parameter_d,
+                  derivative_filter=self.derivative_filter
+                  ).create_zone_kernel(len(temperatures), self.coupling,
+                                       self.gradient_gain)
+        actuator.checkpoint_pid = pid
+        if pid_state:
+            pid.set_state(pid_state)
+
+        actuator.heater_switch_state = True
+
+        set_zone_outputs = actuator.set_zone_outputs
+        compute = pid.compute
+        stop_event = actuator.stop_event
+        interval = self.interval
+        target = self.target_temperature
+        origin = float(temperatures.mean())
+        # Signed ramp rate, None if the setpoint is the target from the start.
+        rate = (math.copysign(self.ramp_rate, target - origin)
+                if self.ramp_rate > 0 else None)
+
+        if not pid_state:
+            pid.bumpless_start(actuator.zone_outputs, start, temperatures,
+                               origin if rate is not None else target)
+
+        max_spread = 0.0
+        squared_spread = 0.0
+        count = 0
+
+        while True:
+
+            current_time = now()
+            if stop - current_time < 0 or stop_event.is_set():
+                break
+
+            setpoint = target
+            if rate is not None:
+                setpoint = origin + rate*(current_time - start)
+                if (setpoint - target)*rate > 0:
+                    setpoint = target
+                    rate = None
+
+            temperatures = read_zones()
+            set_zone_outputs(compute(current_time, temperatures, setpoint))
+
+            spread = float(temperatures.max() - temperatures.min())
+            squared_spread += spread*spread
+            count += 1
+            if spread > max_spread:
+                max_spread = spread
+
+            actuator.sleep(min(interval, stop - current_time))
+
+        actuator.mark_event(
+            'zone_spread',
+            max_spread=max_spread,
+            rms_spread=math.sqrt(squared_spread/count) if count else 0.0)
@@ -12,76 +12,257 @@ This is heavily inspired from:
 
     https://github.com/ivmech/ivPID/blob/master/PID.py
 
+The PID Atom class is used to configure the regulation. The control loops use
+the lighter PIDKernel it creates, or the ZonePIDKernel when regulating
+several heater zones together.
+
 """
+import numpy as np
 from atom.api import Atom, Float
 
 
-class PID(Atom):
-    """PID implementation.
+class PIDKernel(object):
+    """Low overhead PID used in the control loops.
+
+    The derivative is computed on the measurement (to avoid kicks when the
+    target changes) and low-pass filtered with a first order filter of time
+    constant derivative_filter. The integral term is stored as a contribution
+    to the output and is not updated when this would push the output further
+    into saturation, to avoid windup.
 
     """
-    #: Target value
-    target = Float()
+    __slots__ = ('target', 'parameter_p', 'parameter_i', 'parameter_d',
+                 'derivative_filter', 'output_min', 'output_max',
+                 '_integral', '_last_time', '_last_value', '_derivative')
 
-    #: P parameter of the PID
-    parameter_p = Float()
+    def __init__(self, target, parameter_p, parameter_i, parameter_d,
+                 derivative_filter=0.0, output_min=0.0, output_max=1.0):
+        self.target = target
+        self.parameter_p = parameter_p
+        self.parameter_i = parameter_i
+        self.parameter_d = parameter_d
+        self.derivative_filter = derivative_filter
+        self.output_min = output_min
+        self.output_max = output_max
+        self._integral = 0.0
+        self._last_time = None
+        self._last_value = 0.0
+        self._derivative = 0.0
 
-    #: I parameter of the PID
-    parameter_i = Float()
+    def compute(self, time, value):
+        """Compute the output (clamped to the output range).
+
+        """
+        error = self.target - value
+        last_time = self._last_time
+        if last_time is None:
+            self._last_time = time
+            self._last_value = value
+            output = self.parameter_p*error + self._integral
 
-    #: Windup guard avoiding that the integral term causes issues after an
-    #: update of the target value
-    windup_guard = Float(20)
+        else:
+            dt = time - last_time
+            if dt > 0:
+                slope = (value - self._last_value)/dt
+                self._derivative += ((slope - self._derivative) *
+                                     dt/(self.derivative_filter + dt))
+                self._last_time = time
+                self._last_value = value
 
-    #: D parameter of the PID
-    parameter_d = Float()
+            output = (self.parameter_p*error + self._integral -
+                      self.parameter_d*self._derivative)
 
-    def compute_new_output(self, time, value):
-        """Compute the new value of the output based on the measurement.
+            # Integrate only if this does not push further into saturation.
+            if dt > 0:
+                increment = self.parameter_i*error*dt
+                if not ((output > self.output_max and increment > 0) or
+                        (output < self.output_min and increment < 0)):
+                    self._integral += increment
+                    output += increment
+
+        if output > self.output_max:
+            return self.output_max
+        elif output < self.output_min:
+            return self.output_min
+        return output
+
+    def bumpless_start(self, output, time, value):
+        """Initialize the state so that the first output matches output.
+
+        This is used to avoid an abrupt change of the output when switching
+        from an open loop control or a different step. Without integral term,
+        the offset could never be absorbed and the output is left unchanged.
 
         """
-        error = self.target - value
+        if self.parameter_i:
+            self._integral = output - self.parameter_p*(self.target - value)
+        self._last_time = time
+        self._last_value = value
+        self._derivative = 0.0
+
+    def get_state(self):
+        """Get the internal state of the kernel as a JSON serializable dict.
+
+        """
+        return dict(integral=self._integral, derivative=self._derivative)
+
+    def set_state(self, state):
+        """Restore an internal state obtained through get_state.
+
+        The next call to compute only initializes the timing, as after a
+        creation.
+
+        """
+        self._integral = state['integral']
+        self._derivative = state['derivative']
+        self._last_time = None
+
+
+class ZonePIDKernel(object):
+    """Vectorized PID regulating several heater zones at once.
+
+    The algorithm of PIDKernel is applied to all the zones at once using
+    numpy, so that the cost of an update barely depends on the number of
+    zones. Two compensations are available:
+    - coupling: each zone is assumed to receive this fraction of the power of
+      its neighbouring zones (zone k neighbours k - 1 and k + 1). The outputs
+      are multiplied by the inverse of the static coupling matrix so that each
+      zone receives the power requested by its own controller.
+    - gradient_gain: the error of each zone is corrected by gradient_gain
+      times the difference between the mean temperature and the temperature
+      of the zone, which pulls the zones together (during ramps in
+      particular).
 
-        # This the first ever call I and D terms are meaningless.
-        if not self._last_time:
+    """
+    __slots__ = ('count', 'parameter_p', 'parameter_i', 'parameter_d',
+                 'derivative_filter', 'output_min', 'output_max',
+                 'gradient_gain', '_coupling', '_decoupling', '_integral',
+                 '_last_time', '_last_values', '_derivative')
+
+    def __init__(self, count, parameter_p, parameter_i, parameter_d,
+                 derivative_filter=0.0, output_min=0.0, output_max=1.0,
+                 coupling=0.0, gradient_gain=0.0):
+        self.count = count
+        self.parameter_p = parameter_p
+        self.parameter_i = parameter_i
+        self.parameter_d = parameter_d
+        self.derivative_filter = derivative_filter
+        self.output_min = output_min
+        self.output_max = output_max
+        self.gradient_gain = gradient_gain
+        if coupling:
+            neighbours = np.eye(count, k=1) + np.eye(count, k=-1)
+            self._coupling = np.eye(count) + coupling*neighbours
+            self._decoupling = np.linalg.inv(self._coupling)
+        else:
+            self._coupling = self._decoupling = None
+        self._integral = np.zeros(count)
+        self._last_time = None
+        self._last_values = np.zeros(count)
+        self._derivative = np.zeros(count)
+
+    def compute(self, time, values, target):
+        """Compute the outputs (clamped to the output range) of all the zones.
+
+        """
+        error = target - values
+        if self.gradient_gain:
+            error += self.gradient_gain*(values.mean() - values)
+        last_time = self._last_time
+        if last_time is None:
             self._last_time = time
-            self._last_error = error
-            return self.parameter_p*error
+            self._last_values = values
+            output = self.parameter_p*error + self._integral
+
+        else:
+            dt = time - last_time
+            if dt > 0:
+                slope = (values - self._last_values)/dt
+                self._derivative += ((slope - self._derivative) *
+                                     dt/(self.derivative_filter + dt))
+                self._last_time = time
+                self._last_values = values
 
-        delta_time = time - self._last_time
-        delta_error = error - self._last_error
+            output = (self.parameter_p*error + self._integral -
+                      self.parameter_d*self._derivative)
 
-        self._error_int += error * delta_time
+            # Integrate only the zones not pushed further into saturation.
+            if dt > 0:
+                increment = self.parameter_i*error*dt
+                increment[((output > self.output_max) & (increment > 0)) |
+                          ((output < self.output_min) & (increment < 0))] = 0
+                self._integral += increment
+                output += increment
 
-        if (self._error_int < -self.windup_guard):
-            self._error_int = -self.windup_guard
-        elif (self._error_int > self.windup_guard):
-            self._error_int = self.windup_guard
+        if self._decoupling is not None:
+            output = self._decoupling @ output
+        return np.clip(output, self.output_min, self.output_max)
 
-        d_term = 0.0
-        if delta_time > 0:
-            d_term = delta_error / delta_time
+    def bumpless_start(self, outputs, time, values, target):
+        """Initialize the state so that the first outputs match outputs.
 
-        # Remember last time and last error for next calculation
+        """
+        if self.parameter_i:
+            raw = (outputs if self._coupling is None else
+                   self._coupling @ outputs)
+            error = target - values
+            if self.gradient_gain:
+                error = error + self.gradient_gain*(values.mean() - values)
+            self._integral = raw - self.parameter_p*error
         self._last_time = time
-        self._last_error = error
+        self._last_values = values
+        self._derivative = np.zeros(self.count)
 
-        return (self.parameter_p*error + self.parameter_i*self._error_int +
-                self.parameter_d * d_term)
+    def get_state(self):
+        """Get the internal state of the kernel as a JSON serializable dict.
 
-    def reset(self):
-        """Reset the PID history.
+        """
+        return dict(integral=self._integral.tolist(),
+                    derivative=self._derivative.tolist())
+
+    def set_state(self, state):
+        """Restore an internal state obtained through get_state.
 
         """
-        del self._error_int
+        self._integral = np.array(state['integral'], float)
+        self._derivative = np.array(state['derivative'], float)
+        self._last_time = None
+
+
+class PID(Atom):
+    """PID implementation.
+
+    """
+    #: Target value
+    target = Float()
 
-    # --- Private API ---------------------------------------------------------
+    #: P parameter of the PID
+    parameter_p = Float()
 
-    #: Last time at which we update the value in s
-    _last_time = Float()
+    #: I parameter of the PID
+    parameter_i = Float()
 
-    #: Last measured difference to the target.
-    _last_error = Float()
+    #: D parameter of the PID
+    parameter_d = Float()
 
-    #: Integral of the error.
-    _error_int = Float()
+    #: Time constant in s of the low-pass filter applied to the derivative.
+    derivative_filter = Float()
+
+    def create_kernel(self, output_min=0.0, output_max=1.0):
+        """Create the low overhead PID implementation used in control loops.
+
+        """
+        return PIDKernel(self.target, self.parameter_p, self.parameter_i,
+                         self.parameter_d, self.derivative_filter,
+                         output_min, output_max)
+
+    def create_zone_kernel(self, count, coupling=0.0, gradient_gain=0.0,
+                           output_min=0.0, output_max=1.0):
+        """Create the vectorized PID regulating count heater zones.
+
+        The target is not used, being passed at each update.
+
+        """
+        return ZonePIDKernel(count, self.parameter_p, self.parameter_i,
+                             self.parameter_d, self.derivative_filter,
+                             output_min, output_max, coupling, gradient_gain)
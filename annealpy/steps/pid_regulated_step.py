@@ -9,8 +9,6 @@
 """Constant temperature step relying on a pid.
 
 """
-import time
-
 from atom.api import Float
 
 from .base_step import BaseStep
@@ -33,6 +31,9 @@ class PIDRegulatedStep(BaseStep):
     #: D parameter of the PID s.Celsius
     parameter_d = Float().tag(pref=True)
 
+    #: Time constant in s of the low-pass filter applied to the D term.
+    derivative_filter = Float().tag(pref=True)
+
     #: Total duration of the step in s, including any initial settling time.
     duration = Float().tag(pref=True)
 
@@ -43,24 +44,54 @@ class PIDRegulatedStep(BaseStep):
         """Use a PID to regulated the temperature.
 
         """
-        start = time.time()
-        stop = start + self.duration
+        self._regulate(actuator)
+
+    def resume(self, actuator, state):
+        """Regulate for the remaining duration, restoring the PID state.
+
+        """
+        self._regulate(actuator, state['elapsed'], state.get('pid'))
+
+    # --- Private API ---------------------------------------------------------
+
+    def _regulate(self, actuator, elapsed=0.0, pid_state=None):
+        """Regulate the temperature until the end of the step.
+
+        """
+        now = actuator.clock.now
+        start = now()
+        stop = start + self.duration - elapsed
 
         pid = PID(target=self.target_temperature,
                   parameter_p=self.parameter_p,
                   parameter_i=self.parameter_i,
-                  parameter_d=self.parameter_d)
+                  parameter_d=self.parameter_d,
+                  derivative_filter=self.derivative_filter).create_kernel()
+        actuator.checkpoint_pid = pid
+        if pid_state:
+            pid.set_state(pid_state)
 
         actuator.heater_switch_state = True
 
+        # Bind the methods used in the loop once to limit the overhead.
+        read_temperature = actuator.read_temperature
+        set_heater_reg = actuator.set_heater_reg
+        compute = pid.compute
+        stop_event = actuator.stop_event
+        interval = self.interval
+
+        # Start from the current output to avoid a jump between steps, the
+        # integral restored when resuming being kept.
+        if not pid_state:
+            pid.bumpless_start(actuator.heater_reg_state, start,
+                               read_temperature())
+
         while True:
 
-            current_time = time.time()
-            if stop - current_time < 0 or actuator.stop_event.is_set():
+            current_time = now()
+            if stop - current_time < 0 or stop_event.is_set():
                 break
 
-            temp = actuator.read_temperature()
-            feedback = pid.compute_new_output(current_time, temp)
-            actuator.heater_reg_state = max(0.0, min(feedback, 1.0))
+            set_heater_reg(compute(current_time, read_temperature()))
 
-            time.sleep(min(self.interval, stop - current_time))
+            actuator.sleep(min(interval, stop - current_time))
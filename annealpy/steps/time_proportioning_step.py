@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Constant temperature step cycling the heater switch.
+
+"""
+from atom.api import Float
+
+from .base_step import BaseStep
+from .pid import PID
+
+
+class TimeProportioningStep(BaseStep):
+    """Constant temperature step driving the heater switch with a duty cycle.
+
+    The switch is cycled with a fixed period while the regulator is kept at
+    a fixed state, the PID setting the fraction of each cycle during which
+    the switch is on. This allows proportional control at full power. At the
+    end of the step the switch is left on and the regulator set to deliver
+    the same mean power, for a smooth transition to the next step.
+
+    """
+    #: Target temperature in Celsius
+    target_temperature = Float().tag(pref=True)
+
+    #: Total duration of the step in s, including any initial settling time.
+    duration = Float().tag(pref=True)
+
+    #: Duration of a switching cycle in s.
+    cycle_period = Float(2.0).tag(pref=True)
+
+    #: Minimal duration in s of the on and off pulses of the switch.
+    min_pulse = Float(0.05).tag(pref=True)
+
+    #: State of the regulator while the switch is cycled.
+    regulation = Float(1.0).tag(pref=True)
+
+    #: P parameter of the PID in Celsiusˆ-1
+    parameter_p = Float().tag(pref=True)
+
+    #: I parameter of the PID in Celsiusˆ-1sˆ-1
+    parameter_i = Float().tag(pref=True)
+
+    #: D parameter of the PID s.Celsius
+    parameter_d = Float().tag(pref=True)
+
+    #: Time constant in s of the low-pass filter applied to the D term.
+    derivative_filter = Float().tag(pref=True)
+
+    #: Time interval at which to update the duty in s. The duty is only
+    #: applied at the start of the next cycle.
+    interval = Float(.1).tag(pref=True)
+
+    def run(self, actuator):
+        """Use a PID to set the duty of the heater switch.
+
+        """
+        self._regulate(actuator)
+
+    def resume(self, actuator, state):
+        """Regulate for the remaining duration, restoring the PID state.
+
+        """
+        self._regulate(actuator, state['elapsed'], state.get('pid'))
+
+    # --- Private API ---------------------------------------------------------
+
+    def _regulate(self, actuator, elapsed=0.0, pid_state=None):
+        """Regulate the temperature until the end of the step.
+
+        """
+        now = actuator.clock.now
+        start = now()
+        stop = start + self.duration - elapsed
+
+        pid = PID(target=self.target_temperature,
+                  parameter_p=self.parameter_p,
+                  parameter_i=self.parameter_i,
+                  parameter_d=self.parameter_d,
+                  derivative_filter=self.derivative_filter).create_kernel()
+        actuator.checkpoint_pid = pid
+        if pid_state:
+            pid.set_state(pid_state)
+
+        read_temperature = actuator.read_temperature
+        regulation = min(max(self.regulation, 0.0), 1.0)
+        if regulation <= 0:
+            raise ValueError('The regulator state used while cycling the '
+                             'switch must be positive.')
+
+        # Start from the duty delivering the current mean power to avoid a
+        # jump between steps, the integral restored when resuming being kept.
+        power = (actuator.heater_reg_state if actuator.heater_switch_state
+                 else 0.0)
+        duty = min(power/regulation, 1.0)
+        if not pid_state:
+            pid.bumpless_start(duty, start, read_temperature())
+
+        actuator.set_heater_reg(regulation)
+        pwm = actuator.start_switch_pwm(self.cycle_period, self.min_pulse)
+        pwm.duty = duty
+
+        compute = pid.compute
+        stop_event = actuator.stop_event
+        interval = self.interval
+        try:
+            while True:
+
+                current_time = now()
+                if stop - current_time < 0 or stop_event.is_set():
+                    break
+
+                if pwm.error is not None:
+                    raise pwm.error
+                pwm.duty = compute(current_time, read_temperature())
+
+                actuator.sleep(min(interval, stop - current_time))
+        finally:
+            actuator.stop_switch_pwm(pwm)
+
+        # Hand the mean power over to the next step, unless the run is being
+        # stopped.
+        if stop_event.is_set():
+            return
+        actuator.heater_switch_state = True
+        actuator.set_heater_reg(pwm.duty*regulation)
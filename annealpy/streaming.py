@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Local HTTP server streaming the telemetry to read-only viewers.
+
+The server lives in the application process and relays the batches received
+from the actuator, so that viewers never add load to the control loop. It
+exposes:
+- GET /: JSON description of the channels.
+- GET /history?points=N: a single frame containing the data received so far,
+  continuous channels being decimated to about N points.
+- GET /stream?history=N: the history frame (if N > 0) followed by the live
+  frames until the client disconnects.
+
+Frames are sent back to back, each prefixed by its length as a little endian
+uint32. A frame is made of a header (magic b'APTF', version and kind as
+uint8, number of channels as uint16) followed for each channel by its name
+(uint8 length and utf-8 bytes), the number of samples (uint32), the times and
+the values as little endian float64 arrays. A frame of kind FRAME_RESET,
+without channels, signals that a new run started.
+
+Slow viewers do not slow down the relay: each one has a bounded queue of
+frames from which the oldest frames are discarded.
+
+"""
+import json
+import struct
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+import numpy as np
+
+#: Version of the frame format.
+FRAME_VERSION = 1
+
+#: Kind of the frames carrying samples.
+FRAME_DATA = 0
+
+#: Kind of the frames signaling the start of a new run.
+FRAME_RESET = 1
+
+_HEADER = struct.Struct('<4sBBH')
+_LENGTH = struct.Struct('<I')
+
+
+def encode_frame(channels, kind=FRAME_DATA):
+    """Encode {name: (times, values)} arrays as a length prefixed frame.
+
+    """
+    parts = [_HEADER.pack(b'APTF', FRAME_VERSION, kind, len(channels))]
+    for name, (times, values) in channels.items():
+        encoded = name.encode('utf8')
+        parts.append(struct.pack('<B', len(encoded)) + encoded +
+                     _LENGTH.pack(len(times)))
+        parts.append(np.asarray(times, '<f8').tobytes())
+        parts.append(np.asarray(values, '<f8').tobytes())
+    body = b''.join(parts)
+    return _LENGTH.pack(len(body)) + body
+
+
+def decode_frame(body):
+    """Decode a frame (without its length prefix).
+
+    Returns the kind of the frame and the {name: (times, values)} arrays.
+
+    """
+    magic, version, kind, count = _HEADER.unpack_from(body)
+    if magic != b'APTF' or version != FRAME_VERSION:
+        raise ValueError('Invalid telemetry frame.')
+    offset = _HEADER.size
+    channels = {}
+    for _ in range(count):
+        size = body[offset]
+        name = body[offset + 1:offset + 1 + size].decode('utf8')
+        offset += 1 + size
+        samples, = _LENGTH.unpack_from(body, offset)
+        offset += _LENGTH.size
+        times = np.frombuffer(body, '<f8', samples, offset)
+        values = np.frombuffer(body, '<f8', samples, offset + 8*samples)
+        offset += 16*samples
+        channels[name] = (times, values)
+    return kind, channels
+
+
+def read_frames(stream):
+    """Iterate over the (kind, channels) frames read from a binary stream.
+
+    """
+    while True:
+        prefix = stream.read(_LENGTH.size)
+        if len(prefix) < _LENGTH.size:
+            return
+        length, = _LENGTH.unpack(prefix)
+        body = stream.read(length)
+        if len(body) < length:
+            return
+        yield decode_frame(body)
+
+
+def follow(url, history=2000):
+    """Connect to a server and iterate over the (kind, channels) frames.
+
+    """
+    with urlopen(f'{url}/stream?history={history}') as response:
+        yield from read_frames(response)
+
+
+def decimate(times, values, max_points):
+    """Decimate samples keeping the min and max values over time bins.
+
+    """
+    if len(times) <= max_points or len(times) < 2:
+        return times, values
+    bins = max(max_points // 2, 1)
+    edges = np.linspace(times[0], times[-1], bins + 1)
+    positions = np.minimum(np.searchsorted(edges, times, 'right') - 1,
+                           bins - 1)
+    mins = np.full(bins, np.inf)
+    maxs = np.full(bins, -np.inf)
+    np.minimum.at(mins, positions, values)
+    np.maximum.at(maxs, positions, values)
+    filled = np.isfinite(mins)
+    centers = ((edges[:-1] + edges[1:])/2)[filled]
+    decimated = np.empty(2*len(centers))
+    decimated[0::2] = mins[filled]
+    decimated[1::2] = maxs[filled]
+    return np.repeat(centers, 2), decimated
+
+
+class TelemetryStreamServer(object):
+    """HTTP server relaying the telemetry to any number of viewers.
+
+    Parameters
+    ----------
+    app_state : ApplicationState
+        Application state from which the history is read.
+    host : str
+        Interface to listen on (local only by default).
+    port : int
+        Port to listen on, 0 to pick a free one.
+    client_queue_size : int
+        Number of frames buffered per viewer.
+
+    """
+    def __init__(self, app_state, host='127.0.0.1', port=0,
+                 client_queue_size=256):
+        self.app_state = app_state
+        self.client_queue_size = client_queue_size
+        self._clients = []
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer((host, port), _StreamHandler)
+        self._server.daemon_threads = True
+        self._server.stream = self
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        """Port on which the server listens.
+
+        """
+        return self._server.server_address[1]
+
+    @property
+    def url(self):
+        """URL at which the server can be reached.
+
+        """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Start serving in a background thread.
+
+        """
+        self._thread.start()
+
+    def close(self):
+        """Stop the server and disconnect the viewers.
+
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            for queue in self._clients:
+                self._push(queue, None)
+
+    def publish(self, channels):
+        """Relay {name: (times, values)} samples to the connected viewers.
+
+        """
+        if self._clients:
+            self._broadcast(encode_frame(channels))
+
+    def publish_samples(self, samples):
+        """Relay (channel, time, value) samples to the connected viewers.
+
+        The times are in ns, as posted by the actuator, and are sent in s.
+
+        """
+        if not self._clients:
+            return
+        grouped = {}
+        for channel, t, value in samples:
+            grouped.setdefault(channel, ([], []))
+            grouped[channel][0].append(t*1e-9)
+            grouped[channel][1].append(value)
+        self._broadcast(encode_frame(grouped))
+
+    def publish_reset(self):
+        """Signal the viewers that a new run started.
+
+        """
+        if self._clients:
+            self._broadcast(encode_frame({}, FRAME_RESET))
+
+    def history_frame(self, points):
+        """Build a frame holding the data received so far.
+
+        """
+        channels = {}
+        for name, ch_status in self.app_state.channels.items():
+            times, values = ch_status.get_samples()
+            times, values = times.copy(), values.astype(float)
+            if ch_status.kind != 'stepped':
+                times, values = decimate(times, values, points)
+            channels[name] = (times, values)
+        return encode_frame(channels)
+
+    def info(self):
+        """Description of the streamed channels.
+
+        """
+        return {'frame_version': FRAME_VERSION,
+                'channels': {name: ch_status.kind for name, ch_status
+                             in self.app_state.channels.items()}}
+
+    # --- Private API ---------------------------------------------------------
+
+    def _subscribe(self):
+        """Register a new viewer and return its queue of frames.
+
+        """
+        queue = Queue(self.client_queue_size)
+        with self._lock:
+            self._clients = self._clients + [queue]
+        return queue
+
+    def _unsubscribe(self, queue):
+        """Unregister a viewer.
+
+        """
+        with self._lock:
+            self._clients = [q for q in self._clients if q is not queue]
+
+    def _broadcast(self, frame):
+        """Queue a frame for all the viewers.
+
+        """
+        for queue in self._clients:
+            self._push(queue, frame)
+
+    @staticmethod
+    def _push(queue, frame):
+        """Queue a frame, discarding the oldest ones if the queue is full.
+
+        """
+        while True:
+            try:
+                queue.put_nowait(frame)
+                return
+            except Full:
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    pass
+
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    """Request handler of the telemetry server.
+
+    """
+    def do_GET(self):
+        stream = self.server.stream
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+
+        if url.path == '/':
+            body = json.dumps(stream.info()).encode('utf8')
+            self._send_headers('application/json', len(body))
+            self.wfile.write(body)
+
+        elif url.path == '/history':
+            body = stream.history_frame(int(params.get('points', [2000])[0]))
+            self._send_headers('application/octet-stream', len(body))
+            self.wfile.write(body)
+
+        elif url.path == '/stream':
+            # Subscribe first so that no sample is missed between the history
+            # and the live tail.
+            queue = stream._subscribe()
+            try:
+                self._send_headers('application/octet-stream')
+                history = int(params.get('history', [0])[0])
+                if history > 0:
+                    self.wfile.write(stream.history_frame(history))
+                while True:
+                    try:
+                        frame = queue.get(timeout=1)
+                    except Empty:
+                        continue
+                    if frame is None:
+                        break
+                    self.wfile.write(frame)
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                stream._unsubscribe(queue)
+
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        """Do not log every request.
+
+        """
+        pass
+
+    def _send_headers(self, content_type, length=None):
+        """Send the response status and headers.
+
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if length is not None:
+            self.send_header('Content-Length', str(length))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Transport of the telemetry produced by the actuator to the application.
+
+The actuator posts (channel, time, value) samples, time being an integer
+number of ns elapsed since the start of the run (see clock.Clock), into a
+bounded buffer living in its own process. A forwarding thread periodically
+sends the accumulated samples as a single batch through a bounded
+multiprocessing queue. As a consequence posting a sample never blocks the
+control loop, whatever the state of the consumer.
+
+When the consumer cannot keep up, the behavior depends on the selected policy:
+- block: the forwarding thread waits for the consumer. No sample is lost
+  unless the local buffer overflows.
+- drop_oldest: the oldest batch waiting in the queue is discarded to make room
+  for the newest one, so that the application stays close to real time.
+- coalesce: the samples waiting to be sent are reduced to the min, max and
+  last values per channel and per interval.
+
+In all cases, if the local buffer overflows, the oldest samples are dropped.
+All losses are counted and reported to the consumer alongside the data.
+
+Events (such as the start and end of the steps) are sent alongside the
+samples and are not discarded with them (unless the consumer died). Each
+batch also carries a snapshot of the metrics of the running step, taken when
+the batch is sent.
+
+If a recorder is provided, the forwarding thread writes every sample to it
+before sending it, so that the recording is not affected by the overflow
+policy.
+
+"""
+from collections import deque, namedtuple
+from queue import Empty, Full
+from threading import Event, Thread
+from time import monotonic
+
+#: Supported overflow policies, the first one being the default.
+POLICIES = ('drop_oldest', 'block', 'coalesce')
+
+#: Batch of samples sent through the queue. start_time is the wall clock time
+#: at which the actuator started (used to estimate the lag), dropped and
+#: coalesced the total number of samples lost or merged since the start.
+#: samples is a list of (channel, time in ns, value) tuples, events a list of
+#: (time in s, kind, infos) tuples and metrics the metrics of the running step
+#: (or None).
+TelemetryBatch = namedtuple('TelemetryBatch',
+                            'start_time dropped coalesced samples events '
+                            'metrics')
+
+
+def coalesce_samples(samples, interval):
+    """Reduce samples to the min, max and last values per channel/interval.
+
+    The sample times are in ns and the interval in s. The order of the samples
+    of a given channel is preserved.
+
+    """
+    buckets = {}
+    interval = int(interval*1e9)
+    for channel, time, value in samples:
+        key = (channel, time // interval)
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [(time, value)]*3
+        else:
+            if value < bucket[0][1]:
+                bucket[0] = (time, value)
+            if value > bucket[1][1]:
+                bucket[1] = (time, value)
+            bucket[2] = (time, value)
+
+    reduced = []
+    for (channel, _), bucket in buckets.items():
+        reduced.extend((channel, t, v) for t, v in sorted(set(bucket)))
+    return reduced
+
+
+class TelemetrySender(object):
+    """Actuator side of the telemetry transport.
+
+    Parameters
+    ----------
+    queue : multiprocessing.Queue
+        Bounded queue used to send the batches to the application.
+    policy : str
+        Overflow policy, one of POLICIES.
+    max_pending : int
+        Maximal number of samples buffered in the actuator process.
+    flush_interval : float
+        Interval in s at which batches are sent.
+    coalesce_interval : float
+        Time interval in s over which samples are merged when coalescing.
+    recorder : RunRecorder, optional
+        Recorder to which all the samples are written.
+
+    Attributes
+    ----------
+    metrics : callable
+        Function returning the metrics of the running step or None. It is
+        called from the forwarding thread when sending a batch.
+
+    """
+    def __init__(self, queue, policy='drop_oldest', max_pending=100000,
+                 flush_interval=0.05, coalesce_interval=1.0, recorder=None):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown telemetry policy {policy}, valid '
+                             f'policies are {POLICIES}')
+        self.policy = policy
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.coalesce_interval = coalesce_interval
+        self.start_time = 0.0
+        self.dropped = 0
+        self.coalesced = 0
+        self.recorder = recorder
+        self.metrics = None
+        self._queue = queue
+        self._pending = deque(maxlen=max_pending)
+        self._events = deque()
+        self._backlog = []
+        self._event_backlog = []
+        self._closed = Event()
+        self._recorded = Event()
+        self._thread = Thread(target=self._forward, daemon=True)
+
+    def start(self):
+        """Start the forwarding thread.
+
+        """
+        self._thread.start()
+
+    def post(self, channel, time, value):
+        """Post a new sample, time being in ns. This never blocks.
+
+        """
+        # Appending to a deque is thread safe and with a maxlen the oldest
+        # sample is discarded on overflow, so no lock is needed.
+        pending = self._pending
+        if len(pending) == self.max_pending:
+            self.dropped += 1
+        pending.append((channel, time, value))
+
+    def post_event(self, time, kind, **infos):
+        """Post an event, time being in s. This never blocks.
+
+        """
+        self._events.append((time, kind, infos))
+
+    def close(self, timeout=5):
+        """Flush the pending samples and stop the forwarding thread.
+
+        The pending samples are always written to the recorder before
+        returning, so that the recorder can then be closed. Only sending them
+        to the consumer is bounded by the timeout.
+
+        """
+        self._closed.set()
+        # Writing to the recorder does not depend on the consumer.
+        while self._thread.is_alive() and not self._recorded.wait(0.1):
+            pass
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    # --- Private API ---------------------------------------------------------
+
+    def _forward(self):
+        """Periodically send the pending samples as a batch.
+
+        """
+        last_flush = monotonic()
+        pending = self._pending
+        pending_events = self._events
+        while True:
+            closed = self._closed.wait(self.flush_interval)
+            samples = [pending.popleft() for _ in range(len(pending))]
+            events = [pending_events.popleft()
+                      for _ in range(len(pending_events))]
+
+            if self.recorder is not None and not self._recorded.is_set():
+                if samples:
+                    self.recorder.write(samples)
+                if closed or monotonic() - last_flush > 1:
+                    self.recorder.flush()
+                    last_flush = monotonic()
+            # Nothing is posted once closed, so the recorder is up to date.
+            if closed:
+                self._recorded.set()
+
+            # Samples that could not be sent previously go first.
+            if self._backlog or self._event_backlog:
+                samples = self._backlog + samples
+                events = self._event_backlog + events
+                self._backlog = []
+                self._event_backlog = []
+
+            if samples or events:
+                self._send(samples, events, closed)
+            if (closed and not self._pending and not self._events and
+                    not self._backlog and not self._event_backlog):
+                break
+
+    def _send(self, samples, events, closed):
+        """Send a batch according to the overflow policy.
+
+        """
+        metrics = self.metrics() if self.metrics is not None else None
+        batch = TelemetryBatch(self.start_time, self.dropped, self.coalesced,
+                               samples, events, metrics)
+        # Once closed, give the consumer a last chance to catch up but do not
+        # wait forever on a consumer that may have died.
+        timeout = 5 if closed else self.flush_interval
+
+        if self.policy == 'block':
+            while True:
+                try:
+                    self._queue.put(batch, timeout=timeout)
+                    return
+                except Full:
+                    if closed:
+                        self.dropped += len(samples)
+                        return
+                    # Once closed, wait for the consumer one last time.
+                    if self._closed.is_set():
+                        closed = True
+                        timeout = 5
+
+        elif self.policy == 'drop_oldest':
+            for _ in range(10):
+                try:
+                    self._queue.put_nowait(batch)
+                    return
+                except Full:
+                    try:
+                        old = self._queue.get_nowait()
+                    except Empty:
+                        continue
+                    if old is not None:
+                        self.dropped += len(old.samples)
+                        # Events are carried over instead of being dropped.
+                        if old.events:
+                            batch = batch._replace(events=old.events +
+                                                   batch.events)
+            self.dropped += len(samples)
+            if not closed:
+                self._event_backlog = batch.events
+
+        else:
+            try:
+                self._queue.put(batch, timeout=timeout)
+            except Full:
+                if closed:
+                    self.dropped += len(samples)
+                    return
+                # Keep the merged samples to send them with the next batch.
+                reduced = coalesce_samples(samples, self.coalesce_interval)
+                self.coalesced += len(samples) - len(reduced)
+                self._backlog = reduced
+                self._event_backlog = events
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Stand-in for the subset of the nidaqmx package used by annealpy.
+
+The devices of the fake driver are simulated (see simulation.FakeDevice):
+they are wired as described by a DAQ config and read a furnace simulated
+using a thermal model, with a configurable latency, jitter and failure rate.
+This allows to exercise the code driving the hardware (task creation, reads
+and writes, sample timing, waveform generation) without it, for example:
+
+    from annealpy.testing import fake_nidaqmx
+    fake_nidaqmx.install(daq_config, latency=1e-3, jitter=5e-4)
+
+install makes the fake driver the one used by daq.daq_control and records
+the settings in the ANNEALPY_FAKE_NIDAQMX environment variable, so that the
+subprocesses started afterwards (actuators, services) use it too. Setting
+this variable (to a JSON dict of the settings of install) before starting
+the application has the same effect.
+
+"""
+import json
+import os
+import sys
+
+from . import constants, errors, stream_readers, stream_writers, system
+from .simulation import FakeDevice
+from .system import System
+from .task import Task
+
+#: Environment variable holding the settings of the fake driver.
+ENVIRONMENT_VARIABLE = 'ANNEALPY_FAKE_NIDAQMX'
+
+#: Version of the nidaqmx API mimicked.
+__version__ = '0.5.7'
+
+
+def configure(daq_config=None, **settings):
+    """Replace the devices of the fake system by a simulated device.
+
+    The name of the device is the device_id of the DAQ config. The settings
+    are passed to FakeDevice.
+
+    Returns the created device.
+
+    """
+    daq_config = daq_config or {}
+    device = FakeDevice(daq_config.get('device_id', 'Dev1'), daq_config,
+                        **settings)
+    local = System.local()
+    local.clear()
+    local.add_device(device)
+    return device
+
+
+def install(daq_config=None, **settings):
+    """Configure the fake driver and use it in place of nidaqmx.
+
+    Returns the created device.
+
+    """
+    device = configure(daq_config, **settings)
+    os.environ[ENVIRONMENT_VARIABLE] = json.dumps(
+        dict(settings, daq_config=daq_config or {}))
+    module = sys.modules[__name__]
+    sys.modules['nidaqmx'] = module
+    for name in ('constants', 'errors', 'stream_readers', 'stream_writers',
+                 'system'):
+        sys.modules['nidaqmx.' + name] = getattr(module, name)
+    daq_control = sys.modules.get('annealpy.daq.daq_control')
+    if daq_control is not None:
+        daq_control.nidaqmx = module
+    return device
+
+
+def _configure_from_environment():
+    """Configure the fake driver from the environment variable if it is set.
+
+    """
+    value = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not value:
+        return
+    try:
+        settings = json.loads(value)
+    except ValueError:
+        settings = {}
+    if not isinstance(settings, dict):
+        settings = {}
+    configure(**settings)
+
+
+_configure_from_environment()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Constants of the fake driver, named as in nidaqmx.constants.
+
+"""
+from enum import Enum
+
+#: Value of number_of_samples_per_channel when it is not specified.
+READ_ALL_AVAILABLE = -1
+
+
+class AcquisitionType(Enum):
+    """Sample modes of the sample clock.
+
+    """
+    FINITE = 10178
+    CONTINUOUS = 10123
+    HW_TIMED_SINGLE_POINT = 12522
+
+
+class TerminalConfiguration(Enum):
+    """Terminal configurations of the analog inputs.
+
+    """
+    DEFAULT = -1
+    RSE = 10083
+    NRSE = 10078
+    DIFFERENTIAL = 10106
+    PSEUDODIFFERENTIAL = 12529
+
+
+class RegenerationMode(Enum):
+    """Whether output buffers can be generated again once written.
+
+    """
+    ALLOW_REGENERATION = 10097
+    DONT_ALLOW_REGENERATION = 10158
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Errors raised by the fake driver, named as in nidaqmx.errors.
+
+"""
+
+
+class DaqError(Exception):
+    """Error reported by the driver.
+
+    """
+    def __init__(self, message, error_code=-200000, task_name=''):
+        super().__init__(message)
+        self.error_code = error_code
+        self.task_name = task_name
+
+
+class DaqWarning(Warning):
+    """Warning reported by the driver.
+
+    """
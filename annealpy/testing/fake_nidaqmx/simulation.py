@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Simulated device backing the fake driver.
+
+The device is wired as described by a DAQ config (see
+channels.ChannelRegistry): the readback input of each output reads the
+voltage written to it, the temperature input (and the inputs of the heater
+zones) read a furnace simulated using a thermal model driven by the heater
+outputs, and the other inputs read 0 V. All inputs can be made noisy. The
+samples of the outputs timed by the sample clock are scheduled and applied at
+their time.
+
+Every call to the driver goes through the device, which can delay it
+(latency plus a random jitter) and make it fail, and counts the calls and
+the time spent in them so that the code driving the DAQ can be benchmarked.
+
+"""
+import time
+from collections import Counter, deque
+from threading import Lock
+
+import numpy as np
+
+from ...channels import ChannelRegistry
+from ...identification import ThermalModel
+from .errors import DaqError
+
+#: Thermal model used when neither the settings nor the DAQ config provide
+#: one: first order furnace heating up to 820 C with a time constant of 10 s.
+DEFAULT_MODEL = dict(order='fopdt', dt=0.01, a=[0.999], b=0.8, c=0.02,
+                     delay=5)
+
+
+class FakeDevice(object):
+    """Simulated DAQ device.
+
+    Parameters
+    ----------
+    name : str
+        Name of the device (Dev1, ...).
+    daq_config : dict, optional
+        Config of the DAQ describing the wiring of the device.
+    model : dict, optional
+        Thermal model (see ThermalModel.to_dict) of the furnace, by default
+        the simulation model of the DAQ config or DEFAULT_MODEL.
+    latency : float
+        Delay in s added to each call.
+    jitter : float
+        Maximal random delay in s added to the latency.
+    failure_rate : float
+        Probability for a call to fail.
+    fail_after : int, optional
+        Number of calls after which all the calls fail, as when the device
+        is unplugged.
+    noise : float
+        Standard deviation in V of the noise added to the inputs.
+    seed : int, optional
+        Seed of the random generator used for the jitter, failures and noise.
+    ao_samp_clk_supported : bool
+        Whether the analog outputs can be timed by the sample clock.
+
+    """
+    def __init__(self, name, daq_config=None, model=None, latency=0.0,
+                 jitter=0.0, failure_rate=0.0, fail_after=None, noise=0.0,
+                 seed=None, ao_samp_clk_supported=True):
+        daq_config = daq_config or {}
+        self.name = name
+        self.ao_samp_clk_supported = ao_samp_clk_supported
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.fail_after = fail_after
+        self.noise = noise
+        #: Number of calls per operation.
+        self.calls = Counter()
+        #: Time in s spent in the calls per operation, delays included.
+        self.call_time = Counter()
+
+        model = ThermalModel.from_dict(model or
+                                       daq_config.get('simulation_model') or
+                                       DEFAULT_MODEL)
+        registry = ChannelRegistry.from_daq_config(daq_config)
+        self._switch_id = registry['heater_switch'].physical_id
+        self._reg_id = registry['heater_regulation'].physical_id
+        self._on_value = daq_config.get('heater_switch_on_value', 5.0)
+        self._off_value = daq_config.get('heater_switch_off_value', 0.0)
+        self._reg_min = daq_config.get('heater_reg_min_value', 0.0)
+        self._reg_max = daq_config.get('heater_reg_max_value', 5.0)
+        self._coupling = daq_config.get('simulation_coupling', 0.0)
+        self._loopback = {c.readback_id: c.physical_id for c in registry
+                          if c.direction == 'output' and c.readback_id}
+
+        # Simulated furnace read by each thermocouple input, along with the
+        # conversion from temperature to voltage.
+        self._simulator = model.create_simulator(model.ambient)
+        self._thermocouples = {
+            registry['temperature'].physical_id:
+            (self._simulator, _inverse_conversion(registry['temperature']))}
+        self._zone_simulators = []
+        self._zone_output_ids = [c.physical_id
+                                 for c in registry.zone_outputs]
+        for config in registry.zone_inputs:
+            simulator = model.create_simulator(model.ambient)
+            self._zone_simulators.append(simulator)
+            self._thermocouples[config.physical_id] = (
+                simulator, _inverse_conversion(config))
+
+        self._outputs = {}
+        # Samples of the timed outputs: (time, physical_ids, volts).
+        self._scheduled = deque()
+        self._rng = np.random.default_rng(seed)
+        self._lock = Lock()
+
+    def call(self, operation, task_name=''):
+        """Account for a call to the driver, delaying it or making it fail.
+
+        Returns the time.perf_counter time at which the call started.
+
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self.calls[operation] += 1
+            count = sum(self.calls.values())
+            failed = ((self.fail_after is not None and
+                       count > self.fail_after) or
+                      (self.failure_rate and
+                       self._rng.random() < self.failure_rate))
+            delay = self.latency
+            if self.jitter:
+                delay += self._rng.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            raise DaqError(f'Simulated failure of {operation} on '
+                           f'{self.name}.', -200279, task_name)
+        return start
+
+    def done(self, operation, start):
+        """Record the time spent in a call started with call.
+
+        """
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.call_time[operation] += elapsed
+
+    def read(self, physical_ids, times):
+        """Voltages of inputs at given time.monotonic times.
+
+        Returns an array of shape (len(physical_ids), len(times)).
+
+        """
+        values = np.zeros((len(physical_ids), len(times)))
+        with self._lock:
+            self._apply_scheduled(time.monotonic())
+            for i, physical_id in enumerate(physical_ids):
+                if physical_id in self._loopback:
+                    values[i] = self._outputs.get(
+                        self._loopback[physical_id], 0.0)
+                elif physical_id in self._thermocouples:
+                    simulator, to_volts = self._thermocouples[physical_id]
+                    values[i] = [to_volts(simulator.read(t)) for t in times]
+            if self.noise:
+                values += self._rng.normal(0, self.noise, values.shape)
+        return values
+
+    def write(self, physical_ids, volts, now):
+        """Set the voltages of outputs at a given time.monotonic time.
+
+        """
+        with self._lock:
+            self._apply_scheduled(now)
+            self._set_outputs(physical_ids, volts, now)
+
+    def schedule(self, physical_ids, times, volts):
+        """Schedule samples of outputs at increasing time.monotonic times.
+
+        volts is an array of shape (len(physical_ids), len(times)).
+
+        """
+        with self._lock:
+            self._scheduled.extend(zip(times, [physical_ids]*len(times),
+                                       np.transpose(volts).tolist()))
+
+    def cancel(self, physical_ids, now):
+        """Drop the samples of outputs scheduled after a given time.
+
+        The outputs keep the value of the last sample generated.
+
+        """
+        with self._lock:
+            self._apply_scheduled(now)
+            physical_ids = set(physical_ids)
+            self._scheduled = deque(s for s in self._scheduled
+                                    if not physical_ids & set(s[1]))
+
+    def output(self, physical_id):
+        """Last voltage written to an output.
+
+        """
+        with self._lock:
+            self._apply_scheduled(time.monotonic())
+            return self._outputs.get(physical_id, 0.0)
+
+    # --- Private API ---------------------------------------------------------
+
+    def _set_outputs(self, physical_ids, volts, now):
+        """Set the voltages of outputs, advancing the furnace up to now.
+
+        """
+        # Advance the furnace up to now with the previous command.
+        self._simulator.read(now)
+        for simulator in self._zone_simulators:
+            simulator.read(now)
+        for physical_id, value in zip(physical_ids, volts):
+            self._outputs[physical_id] = float(value)
+        self._update_commands()
+
+    def _apply_scheduled(self, now):
+        """Apply the scheduled samples whose time is before now.
+
+        """
+        scheduled = self._scheduled
+        while scheduled and scheduled[0][0] <= now:
+            at, physical_ids, volts = scheduled.popleft()
+            self._set_outputs(physical_ids, volts, at)
+
+    def _update_commands(self):
+        """Compute the heater commands from the output voltages.
+
+        """
+        outputs = self._outputs
+        switch = outputs.get(self._switch_id, self._off_value)
+        switched = (abs(switch - self._on_value) <
+                    abs(switch - self._off_value))
+        span = self._reg_max - self._reg_min
+
+        def state(physical_id):
+            if span <= 0:
+                return 0.0
+            value = (outputs.get(physical_id, self._reg_min) -
+                     self._reg_min)/span
+            return min(max(value, 0.0), 1.0)
+
+        self._simulator.command = float(switched)*state(self._reg_id)
+        if self._zone_simulators:
+            zones = np.array([state(i) for i in self._zone_output_ids])
+            neighbours = np.zeros(len(zones))
+            neighbours[1:] += zones[:-1]
+            neighbours[:-1] += zones[1:]
+            commands = float(switched)*(zones + self._coupling*neighbours)
+            for simulator, command in zip(self._zone_simulators,
+                                          commands.tolist()):
+                simulator.command = command
+
+
+def _inverse_conversion(config):
+    """Function converting a temperature to the voltage read by an input.
+
+    Only linear conversions can be inverted, polynomial conversions are
+    ignored.
+
+    """
+    conversion = config.conversion
+    scale = conversion.get('scale', 1.0)
+    offset = conversion.get('offset', 0.0)
+    if 'polynomial' in conversion or not scale:
+        return lambda temperature: temperature
+    return lambda temperature: (temperature - offset)/scale
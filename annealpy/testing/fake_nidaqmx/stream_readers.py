@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Stream readers of the fake driver, mimicking nidaqmx.stream_readers.
+
+The readers fill preallocated numpy arrays instead of returning lists.
+
+"""
+from .errors import DaqError
+
+
+class AnalogSingleChannelReader(object):
+    """Read samples of a task with a single analog input.
+
+    """
+    def __init__(self, task_in_stream):
+        self._task = task_in_stream._task
+
+    def read_one_sample(self, timeout=10.0):
+        """Read a single sample.
+
+        """
+        return float(self._task._read_array(1, timeout)[0, 0])
+
+    def read_many_sample(self, data, number_of_samples_per_channel=-1,
+                         timeout=10.0):
+        """Fill data (1D array) with samples, returning their number.
+
+        """
+        count = (len(data) if number_of_samples_per_channel < 0 else
+                 number_of_samples_per_channel)
+        if count > len(data):
+            raise DaqError('The array is too small.', -200229,
+                           self._task.name)
+        data[:count] = self._task._read_array(count, timeout)[0]
+        return count
+
+
+class AnalogMultiChannelReader(object):
+    """Read samples of a task with several analog inputs.
+
+    """
+    def __init__(self, task_in_stream):
+        self._task = task_in_stream._task
+
+    def read_one_sample(self, data, timeout=10.0):
+        """Fill data (1D array, one element per channel) with a sample.
+
+        """
+        data[:] = self._task._read_array(1, timeout)[:, 0]
+
+    def read_many_sample(self, data, number_of_samples_per_channel=-1,
+                         timeout=10.0):
+        """Fill data (channels x samples), returning the number of samples.
+
+        """
+        count = (data.shape[1] if number_of_samples_per_channel < 0 else
+                 number_of_samples_per_channel)
+        if count > data.shape[1]:
+            raise DaqError('The array is too small.', -200229,
+                           self._task.name)
+        data[:, :count] = self._task._read_array(count, timeout)
+        return count
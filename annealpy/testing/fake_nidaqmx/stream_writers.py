@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Stream writers of the fake driver, mimicking nidaqmx.stream_writers.
+
+The writers take numpy arrays of float64.
+
+"""
+import numpy as np
+
+
+class _AnalogWriter(object):
+    """Base class of the analog writers.
+
+    """
+    def __init__(self, task_out_stream, auto_start=False):
+        self._task = task_out_stream._task
+        self.auto_start = auto_start
+
+    def _write(self, data, timeout):
+        """Write a (channels, samples) array, starting the task if needed.
+
+        """
+        count = self._task._write_array(data, timeout)
+        if self.auto_start and not self._task._running:
+            self._task.start()
+        return count
+
+
+class AnalogSingleChannelWriter(_AnalogWriter):
+    """Write samples to a task with a single analog output.
+
+    """
+    def write_one_sample(self, data, timeout=10.0):
+        """Write a single sample.
+
+        """
+        self._write(np.array([[data]], dtype=float), timeout)
+
+    def write_many_sample(self, data, timeout=10.0):
+        """Write samples (1D array), returning their number.
+
+        """
+        return self._write(np.asarray(data, dtype=float).reshape(1, -1),
+                           timeout)
+
+
+class AnalogMultiChannelWriter(_AnalogWriter):
+    """Write samples to a task with several analog outputs.
+
+    """
+    def write_one_sample(self, data, timeout=10.0):
+        """Write a sample (1D array, one element per channel).
+
+        """
+        self._write(np.asarray(data, dtype=float).reshape(-1, 1), timeout)
+
+    def write_many_sample(self, data, timeout=10.0):
+        """Write samples (channels x samples), returning their number.
+
+        """
+        return self._write(np.asarray(data, dtype=float), timeout)
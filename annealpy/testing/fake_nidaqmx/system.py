@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Local system of the fake driver, mimicking nidaqmx.system.
+
+"""
+
+
+class DeviceCollection(object):
+    """Devices of the system.
+
+    """
+    def __init__(self, devices):
+        self._devices = devices
+
+    def __getitem__(self, name):
+        return self._devices[name]
+
+    def __iter__(self):
+        return iter(self._devices.values())
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __repr__(self):
+        return f'DeviceCollection({self.device_names})'
+
+    @property
+    def device_names(self):
+        """Names of the devices.
+
+        """
+        return list(self._devices)
+
+
+class System(object):
+    """Local system holding the simulated devices (see configure).
+
+    """
+    _local = None
+
+    def __init__(self):
+        self._devices = {}
+
+    @classmethod
+    def local(cls):
+        """System of the local machine.
+
+        """
+        if cls._local is None:
+            cls._local = cls()
+        return cls._local
+
+    @property
+    def devices(self):
+        """Simulated devices (see simulation.FakeDevice).
+
+        """
+        return DeviceCollection(self._devices)
+
+    def add_device(self, device):
+        """Add a simulated device, replacing any device of the same name.
+
+        """
+        self._devices[device.name] = device
+
+    def clear(self):
+        """Remove all the devices.
+
+        """
+        self._devices = {}
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tasks of the fake driver, mimicking nidaqmx.Task.
+
+"""
+import time
+
+import numpy as np
+
+from .constants import (READ_ALL_AVAILABLE, AcquisitionType,
+                        RegenerationMode)
+from .errors import DaqError
+from .system import System
+
+
+def _split_physical_channels(physical_channel):
+    """Split physical channels (Dev1/ai0:2, Dev1/ai4) in (device, id) pairs.
+
+    """
+    channels = []
+    device = ''
+    for name in physical_channel.split(','):
+        name = name.strip()
+        if '/' in name:
+            device, name = name.split('/', 1)
+        prefix = name.rstrip('0123456789:')
+        numbers = name[len(prefix):]
+        if ':' in numbers:
+            first, last = (int(n) for n in numbers.split(':'))
+            step = 1 if last >= first else -1
+            channels.extend((device, f'{prefix}{i}')
+                            for i in range(first, last + step, step))
+        else:
+            channels.append((device, name))
+    return channels
+
+
+class Channel(object):
+    """Virtual channel of a task.
+
+    """
+    def __init__(self, device, physical_id, name, **settings):
+        self.device = device
+        self.physical_id = physical_id
+        self.name = name
+        self.settings = settings
+
+
+class ChannelCollection(object):
+    """Channels of a given type (analog inputs or outputs) of a task.
+
+    """
+    def __init__(self, task):
+        self._task = task
+        self._channels = []
+
+    def __len__(self):
+        return len(self._channels)
+
+    def __iter__(self):
+        return iter(self._channels)
+
+    @property
+    def channel_names(self):
+        """Names of the channels.
+
+        """
+        return [c.name for c in self._channels]
+
+    def _add(self, physical_channel, name_to_assign_to_channel, settings):
+        """Add the channels designated by physical_channel.
+
+        """
+        self._task._check_open()
+        added = []
+        for device_name, physical_id in \
+                _split_physical_channels(physical_channel):
+            devices = System.local().devices
+            if device_name not in devices.device_names:
+                raise DaqError(f'Device {device_name} does not exist.',
+                               -200220, self._task.name)
+            name = (name_to_assign_to_channel or
+                    f'{device_name}/{physical_id}')
+            channel = Channel(devices[device_name], physical_id, name,
+                              **settings)
+            self._channels.append(channel)
+            added.append(channel)
+        return added[0] if len(added) == 1 else added
+
+
+class AIChannelCollection(ChannelCollection):
+    """Analog input channels of a task.
+
+    """
+    def add_ai_voltage_chan(self, physical_channel,
+                            name_to_assign_to_channel='',
+                            terminal_config=None, min_val=-5.0, max_val=5.0,
+                            units=None, custom_scale_name=''):
+        """Add analog voltage inputs to the task.
+
+        """
+        return self._add(physical_channel, name_to_assign_to_channel,
+                         dict(terminal_config=terminal_config,
+                              min_val=min_val, max_val=max_val))
+
+
+class AOChannelCollection(ChannelCollection):
+    """Analog output channels of a task.
+
+    """
+    def add_ao_voltage_chan(self, physical_channel,
+                            name_to_assign_to_channel='', min_val=-10.0,
+                            max_val=10.0, units=None, custom_scale_name=''):
+        """Add analog voltage outputs to the task.
+
+        """
+        return self._add(physical_channel, name_to_assign_to_channel,
+                         dict(min_val=min_val, max_val=max_val))
+
+
+class Timing(object):
+    """Sample clock settings of a task.
+
+    """
+    def __init__(self, task):
+        self._task = task
+        self.samp_clk_rate = 0.0
+        self.samp_quant_samp_mode = None
+        self.samp_quant_samp_per_chan = 1000
+
+    def cfg_samp_clk_timing(self, rate, source='', active_edge=None,
+                            sample_mode=AcquisitionType.FINITE,
+                            samps_per_chan=1000):
+        """Use the sample clock to time the acquisition or generation.
+
+        """
+        task = self._task
+        task._check_open()
+        if any(not c.device.ao_samp_clk_supported
+               for c in task.ao_channels):
+            raise DaqError('Sample clock timing is not supported by the '
+                           'analog outputs of the device.', -200077,
+                           task.name)
+        self.samp_clk_rate = rate
+        self.samp_quant_samp_mode = sample_mode
+        self.samp_quant_samp_per_chan = samps_per_chan
+
+
+class InStream(object):
+    """Input stream of a task, used by the stream readers.
+
+    """
+    def __init__(self, task):
+        self._task = task
+
+
+class OutStream(object):
+    """Output stream of a task, used by the stream writers.
+
+    """
+    def __init__(self, task):
+        self._task = task
+        self.regen_mode = RegenerationMode.ALLOW_REGENERATION
+        self._output_buf_size = None
+
+    @property
+    def output_buf_size(self):
+        """Size of the output buffer in samples per channel.
+
+        """
+        if self._output_buf_size is None:
+            return self._task.timing.samp_quant_samp_per_chan
+        return self._output_buf_size
+
+    @output_buf_size.setter
+    def output_buf_size(self, value):
+        self._output_buf_size = value
+
+    @property
+    def total_samp_per_chan_generated(self):
+        """Number of samples per channel generated since the start.
+
+        """
+        return self._task._generated()
+
+    @property
+    def space_avail(self):
+        """Number of samples per channel which can be written.
+
+        """
+        task = self._task
+        return self.output_buf_size - (task._written - task._generated())
+
+
+class Task(object):
+    """Fake DAQmx task.
+
+    On demand tasks read or write one sample per channel. Tasks timed by the
+    sample clock acquire samples at the sample clock rate, a read of n
+    samples lasting n/rate s, or generate the written samples at that rate
+    once started, a write blocking until there is space in the buffer.
+
+    """
+    def __init__(self, new_task_name=''):
+        self.name = new_task_name or f'_unnamedTask<{id(self):x}>'
+        self.ai_channels = AIChannelCollection(self)
+        self.ao_channels = AOChannelCollection(self)
+        self.timing = Timing(self)
+        self.in_stream = InStream(self)
+        self.out_stream = OutStream(self)
+        self._closed = False
+        self._running = False
+        # Generation of the timed outputs: samples written per channel,
+        # samples written before the start and time.monotonic start time.
+        self._written = 0
+        self._pending = []
+        self._generation_start = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    @property
+    def channel_names(self):
+        """Names of all the channels of the task.
+
+        """
+        return (self.ai_channels.channel_names +
+                self.ao_channels.channel_names)
+
+    def start(self):
+        """Start the task.
+
+        """
+        self._check_open()
+        start = self._call('start')
+        self._running = True
+        if self._timed() and len(self.ao_channels):
+            self._generation_start = time.monotonic()
+            if self._pending:
+                self._schedule(np.concatenate(self._pending, axis=1), 0)
+            self._pending = []
+        self._done('start', start)
+
+    def stop(self):
+        """Stop the task.
+
+        """
+        self._check_open()
+        start = self._call('stop')
+        self._stop_generation()
+        self._done('stop', start)
+
+    def close(self):
+        """Release the task. Further calls raise a DaqError.
+
+        """
+        if not self._closed:
+            self._stop_generation()
+        self._closed = True
+
+    def is_task_done(self):
+        """Whether the task is not running or generated all its samples.
+
+        """
+        self._check_open()
+        return not self._running or self._finite_generation_done()
+
+    def wait_until_done(self, timeout=10.0):
+        """Wait for the end of a finite generation.
+
+        """
+        self._check_open()
+        deadline = time.monotonic() + timeout
+        while self._running and not self._finite_generation_done():
+            if time.monotonic() > deadline:
+                raise DaqError('Wait Until Done did not indicate that the '
+                               'task was done within the specified timeout.',
+                               -200560, self.name)
+            time.sleep(1e-3)
+
+    def read(self, number_of_samples_per_channel=READ_ALL_AVAILABLE,
+             timeout=10.0):
+        """Read samples from the analog inputs.
+
+        As with nidaqmx, a single sample of a single channel is returned as a
+        float, samples of a single channel or single samples of several
+        channels as a list and several samples of several channels as a list
+        of lists (one per channel).
+
+        """
+        count = number_of_samples_per_channel
+        single = count == READ_ALL_AVAILABLE and not self._timed()
+        if count == READ_ALL_AVAILABLE:
+            count = (self.timing.samp_quant_samp_per_chan if self._timed()
+                     else 1)
+        data = self._read_array(count, timeout)
+        if len(self.ai_channels) == 1:
+            return float(data[0, 0]) if single else data[0].tolist()
+        return data[:, 0].tolist() if single else data.tolist()
+
+    def write(self, data, auto_start=True, timeout=10.0):
+        """Write samples to the analog outputs.
+
+        data is a float for a single channel and a single sample, a list of
+        samples for a single channel or a list with one element per channel
+        (a float or a list of samples). On demand tasks only keep the last
+        sample, timed tasks buffer all of them.
+
+        """
+        channels = len(self.ao_channels)
+        data = np.asarray(data, dtype=float)
+        if channels == 1:
+            data = data.reshape(1, -1)
+        elif data.ndim == 1:
+            data = data.reshape(-1, 1)
+        if data.shape[0] != channels:
+            raise DaqError(f'Write of {data.shape[0]} channels to a task '
+                           f'with {channels} channels.', -200524, self.name)
+        return self._write_array(data, timeout)
+
+    # --- Private API ---------------------------------------------------------
+
+    def _check_open(self):
+        """Raise a DaqError if the task was closed.
+
+        """
+        if self._closed:
+            raise DaqError('Task specified is invalid or does not exist.',
+                           -200088, self.name)
+
+    def _timed(self):
+        """Whether the task is timed by the sample clock.
+
+        """
+        return self.timing.samp_quant_samp_mode is not None
+
+    def _generated(self):
+        """Number of samples per channel generated by a timed output.
+
+        """
+        if self._generation_start is None:
+            return 0
+        elapsed = time.monotonic() - self._generation_start
+        count = min(int(elapsed*self.timing.samp_clk_rate) + 1,
+                    self._written)
+        if self.timing.samp_quant_samp_mode == AcquisitionType.FINITE:
+            count = min(count, self.timing.samp_quant_samp_per_chan)
+        return count
+
+    def _finite_generation_done(self):
+        """Whether a finite generation generated all its samples.
+
+        """
+        return (self._generation_start is not None and
+                self.timing.samp_quant_samp_mode == AcquisitionType.FINITE
+                and self._generated() >=
+                min(self._written, self.timing.samp_quant_samp_per_chan))
+
+    def _stop_generation(self):
+        """Stop the task, dropping the samples not generated yet.
+
+        """
+        self._running = False
+        if self._generation_start is not None:
+            channels = list(self.ao_channels)
+            self._devices(channels).cancel([c.physical_id for c in channels],
+                                           time.monotonic())
+        self._generation_start = None
+        self._written = 0
+        self._pending = []
+
+    def _schedule(self, data, first):
+        """Schedule samples of the timed outputs from a sample index.
+
+        """
+        channels = list(self.ao_channels)
+        times = (self._generation_start +
+                 (first + np.arange(data.shape[1]))/self.timing.samp_clk_rate)
+        self._devices(channels).schedule([c.physical_id for c in channels],
+                                         times.tolist(), data)
+
+    def _devices(self, channels):
+        """Devices of the channels, checking that there is only one.
+
+        """
+        devices = {c.device.name: c.device for c in channels}
+        if not devices:
+            raise DaqError('Task contains no channels.', -200478, self.name)
+        if len(devices) > 1:
+            raise DaqError('Channels of several devices in a task.',
+                           -200559, self.name)
+        return next(iter(devices.values()))
+
+    def _call(self, operation):
+        """Account for a call on the device of the task.
+
+        """
+        channels = list(self.ai_channels) + list(self.ao_channels)
+        if not channels:
+            return time.perf_counter()
+        return self._devices(channels).call(operation, self.name)
+
+    def _done(self, operation, start):
+        """Record the duration of a call.
+
+        """
+        channels = list(self.ai_channels) + list(self.ao_channels)
+        if channels:
+            self._devices(channels).done(operation, start)
+
+    def _read_array(self, count, timeout):
+        """Read count samples per channel as a (channels, count) array.
+
+        """
+        self._check_open()
+        channels = list(self.ai_channels)
+        device = self._devices(channels)
+        start = device.call('read', self.name)
+        now = time.monotonic()
+        if self._timed() and self.timing.samp_clk_rate > 0:
+            period = 1/self.timing.samp_clk_rate
+            if count*period > timeout:
+                device.done('read', start)
+                raise DaqError('The read timed out.', -200284, self.name)
+            # The samples are acquired as the sample clock ticks.
+            times = now + period*np.arange(count)
+            time.sleep(count*period)
+        else:
+            times = np.full(count, now)
+        values = device.read([c.physical_id for c in channels], times)
+        device.done('read', start)
+        return values
+
+    def _write_array(self, data, timeout):
+        """Write a (channels, samples) array.
+
+        """
+        self._check_open()
+        channels = list(self.ao_channels)
+        device = self._devices(channels)
+        start = device.call('write', self.name)
+        try:
+            for channel, row in zip(channels, data):
+                low = channel.settings['min_val']
+                high = channel.settings['max_val']
+                if ((row < low) | (row > high)).any():
+                    raise DaqError(f'Value out of the [{low}, {high}] range '
+                                   f'of {channel.name}.', -200561, self.name)
+            if self._timed():
+                self._buffer(data, timeout)
+            else:
+                device.write([c.physical_id for c in channels], data[:, -1],
+                             time.monotonic())
+        finally:
+            device.done('write', start)
+        return data.shape[1]
+
+    def _buffer(self, data, timeout):
+        """Write samples to the buffer of the timed outputs.
+
+        """
+        count = data.shape[1]
+        size = self.out_stream.output_buf_size
+        if count > size:
+            raise DaqError('Write larger than the output buffer.', -200547,
+                           self.name)
+        if self._generation_start is None:
+            if self._written + count > size:
+                raise DaqError('Write larger than the output buffer.',
+                               -200547, self.name)
+            self._pending.append(data)
+            self._written += count
+            return
+        deadline = time.monotonic() + timeout
+        while self.out_stream.space_avail < count:
+            if time.monotonic() > deadline:
+                raise DaqError('The write timed out.', -200292, self.name)
+            time.sleep(min(count/self.timing.samp_clk_rate/4, 1e-2))
+        regenerate = (self.out_stream.regen_mode ==
+                      RegenerationMode.ALLOW_REGENERATION)
+        if (not regenerate and
+                self._generated() >= self._written and
+                self._written < int((time.monotonic() -
+                                     self._generation_start) *
+                                    self.timing.samp_clk_rate)):
+            raise DaqError('The generation stopped to prevent the '
+                           'regeneration of old samples.', -200290,
+                           self.name)
+        self._schedule(data, self._written)
+        self._written += count
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Measure the overhead of one tick of the PID control loop.
+
+The DAQ runs in simulation mode so that only the Python overhead is measured
+(driver calls skipped by the output layer are hence not accounted for).
+Compare the legacy path (PID Atom, Atom validated DAQ writes and one
+multiprocessing queue post per sample) with the fast path used by the steps
+(PIDKernel, bound actuator methods and batched telemetry).
+
+Usage: python benchmarks/bench_control_tick.py [n_ticks]
+
+"""
+import sys
+import time
+from multiprocessing import Queue as ProcessQueue
+from queue import Queue
+
+from atom.api import Atom, Float
+
+from annealpy.clock import Clock
+from annealpy.daq.daq_control import AnnealerDaq
+from annealpy.process import ActuatorSubprocess
+from annealpy.steps.pid import PID
+from annealpy.telemetry import TelemetrySender
+
+
+class LegacyPID(Atom):
+    """PID as implemented before the introduction of the PID kernel.
+
+    """
+    target = Float()
+
+    parameter_p = Float()
+
+    parameter_i = Float()
+
+    windup_guard = Float(20)
+
+    parameter_d = Float()
+
+    def compute_new_output(self, time, value):
+        """Compute the new value of the output based on the measurement.
+
+        """
+        error = self.target - value
+
+        # This the first ever call I and D terms are meaningless.
+        if not self._last_time:
+            self._last_time = time
+            self._last_error = error
+            return self.parameter_p*error
+
+        delta_time = time - self._last_time
+        delta_error = error - self._last_error
+
+        self._error_int += error * delta_time
+
+        if (self._error_int < -self.windup_guard):
+            self._error_int = -self.windup_guard
+        elif (self._error_int > self.windup_guard):
+            self._error_int = self.windup_guard
+
+        d_term = 0.0
+        if delta_time > 0:
+            d_term = delta_error / delta_time
+
+        # Remember last time and last error for next calculation
+        self._last_time = time
+        self._last_error = error
+
+        return (self.parameter_p*error + self.parameter_i*self._error_int +
+                self.parameter_d * d_term)
+
+    # --- Private API ---------------------------------------------------------
+
+    #: Last time at which we update the value in s
+    _last_time = Float()
+
+    #: Last measured difference to the target.
+    _last_error = Float()
+
+    #: Integral of the error.
+    _error_int = Float()
+
+
+def make_actuator():
+    """Create an actuator usable without starting a subprocess.
+
+    """
+    actuator = ActuatorSubprocess('', {}, None, None, None)
+    actuator.clock = Clock()
+    actuator._telemetry = TelemetrySender(Queue(), max_pending=1000)
+    actuator._daq = AnnealerDaq({})
+    actuator._daq.initialize()
+    actuator._create_outputs()
+    actuator.start_time = time.time()
+    return actuator
+
+
+def legacy_tick_loop(actuator, n):
+    """Loop as performed before the introduction of the PID kernel.
+
+    """
+    pid = LegacyPID(target=200, parameter_p=0.01, parameter_i=0.001,
+                    parameter_d=0.01)
+    daq = actuator._daq
+    queue = ProcessQueue()
+    start = actuator.start_time
+    tic = time.perf_counter()
+    for i in range(n):
+        temp = daq.read_temperature() + (i % 7)*0.1
+        queue.put(('temperature', time.time() - start, temp))
+        feedback = pid.compute_new_output(time.time(), temp)
+        value = max(0.0, min(feedback, 1.0))
+        daq.heater_reg_state = value
+        queue.put(('heater_regulation', time.time() - start, value))
+    elapsed = time.perf_counter() - tic
+    # Do not leave the queue feeder thread with pending items.
+    queue.cancel_join_thread()
+    return elapsed/n
+
+
+def fast_tick_loop(actuator, n):
+    """Loop as performed by the steps.
+
+    """
+    pid = PID(target=200, parameter_p=0.01, parameter_i=0.001,
+              parameter_d=0.01).create_kernel()
+    read = actuator._daq.read_temperature
+    post = actuator._post
+    set_heater_reg = actuator.set_heater_reg
+    compute = pid.compute
+    now_ns = actuator.clock.now_ns
+    tic = time.perf_counter()
+    for i in range(n):
+        temp = read() + (i % 7)*0.1
+        t_ns = now_ns()
+        post('temperature', t_ns, temp)
+        set_heater_reg(compute(t_ns*1e-9, temp))
+    return (time.perf_counter() - tic)/n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    actuator = make_actuator()
+    legacy = legacy_tick_loop(actuator, n)
+    fast = fast_tick_loop(actuator, n)
+    print(f'legacy tick: {legacy*1e6:.2f} us')
+    print(f'fast tick:   {fast*1e6:.2f} us')
+    print(f'speed up:    {legacy/fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
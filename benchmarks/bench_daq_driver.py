@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Measure the cost of the DAQ operations performed by the control loops.
+
+The DAQ is driven through the fake nidaqmx driver, so that the code handling
+the tasks is exercised as with the hardware. The per-call latency of the
+driver can be set to estimate the rate achievable with a given device, the
+time spent in the driver being reported separately from the Python overhead.
+
+Usage: python benchmarks/bench_daq_driver.py [n_calls] [latency_in_s]
+
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from annealpy.testing import fake_nidaqmx
+
+
+def make_daq(latency):
+    """Create a DAQ with two heater zones using the fake driver.
+
+    """
+    path = os.path.join(os.path.dirname(__file__), '..', 'annealpy', 'daq',
+                        'daq_config.json')
+    with open(path) as f:
+        config = json.load(f)
+    for zone in range(2):
+        config['channels'] += [
+            dict(name=f'zone{zone}_temperature', physical_id=f'ai{4 + zone}',
+                 zone=zone),
+            dict(name=f'zone{zone}_heater', physical_id=f'ao{2 + zone}',
+                 direction='output', kind='stepped', zone=zone)]
+    device = fake_nidaqmx.install(config, latency=latency)
+    # Imported once the fake driver is installed so that it is picked up.
+    from annealpy.daq.daq_control import AnnealerDaq
+    daq = AnnealerDaq(config)
+    daq.initialize()
+    return daq, device
+
+
+def measure(device, operation, function, n):
+    """Mean duration of a call and mean time spent in the driver.
+
+    """
+    before = sum(device.call_time.values())
+    tic = time.perf_counter()
+    for i in range(n):
+        function(i)
+    elapsed = (time.perf_counter() - tic)/n
+    driver = (sum(device.call_time.values()) - before)/n
+    print(f'{operation:<22} {elapsed*1e6:9.2f} us '
+          f'(driver {driver*1e6:9.2f} us)')
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    daq, device = make_daq(latency)
+    write_reg = daq.create_heater_reg_writer()
+    write_switch = daq.create_heater_switch_writer()
+    read_zones = daq.create_zones_reader()
+    write_zones = daq.create_zones_writer()
+    zones = np.array([0.2, 0.4])
+
+    measure(device, 'read temperature',
+            lambda i: daq.read_temperature(), n)
+    measure(device, 'write regulation',
+            lambda i: write_reg((i % 100)/100), n)
+    measure(device, 'write switch',
+            lambda i: write_switch(bool(i % 2)), n)
+    measure(device, 'read zones', lambda i: read_zones(), n)
+    measure(device, 'write zones', lambda i: write_zones(zones), n)
+    daq.finalize()
+    print('driver calls:', dict(device.calls))
+
+
+if __name__ == '__main__':
+    main()
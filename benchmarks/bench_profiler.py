@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Measure the impact of the sampling profiler on the control loop.
+
+The tick of the PID loop (see bench_control_tick) is timed without profiler,
+with the default profiler settings and with the allocations traced. The
+lateness of the wake ups of a loop sleeping until periodic deadlines, as the
+steps do, is measured in the same configurations.
+
+Usage: python benchmarks/bench_profiler.py [n_ticks] [duration_in_s]
+
+"""
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from annealpy.profiling import ProfileConfig, SamplingProfiler
+from bench_control_tick import fast_tick_loop, make_actuator
+
+
+def wake_up_lateness(duration, period=0.01):
+    """Delays in s between the deadlines of a periodic loop and its wake ups.
+
+    """
+    delays = []
+    start = time.perf_counter()
+    for i in range(int(duration/period)):
+        deadline = start + (i + 1)*period
+        time.sleep(max(deadline - time.perf_counter(), 0))
+        delays.append(time.perf_counter() - deadline)
+    return np.array(delays)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    actuator = make_actuator()
+    directory = tempfile.mkdtemp()
+    baseline = None
+    for name, config in (('no profiler', None),
+                         ('profiler', ProfileConfig()),
+                         ('allocations', ProfileConfig(tracemalloc=True))):
+        profiler = None
+        if config is not None:
+            profiler = SamplingProfiler(directory, name, config)
+            profiler.start()
+        # The best of a few runs is less sensitive to the machine load.
+        tick = min(fast_tick_loop(actuator, n) for _ in range(3))
+        delays = wake_up_lateness(duration)
+        if profiler is not None:
+            profiler.stop()
+        baseline = baseline or tick
+        overhead = (f', profiler time {100*profiler.overhead:.2f} %'
+                    if profiler else '')
+        print(f'{name:<12} tick {tick*1e6:7.2f} us '
+              f'({100*(tick/baseline - 1):+6.1f} %), wake up lateness p99 '
+              f'{np.percentile(delays, 99)*1e6:8.1f} us, max '
+              f'{delays.max()*1e6:8.1f} us{overhead}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Measure the timing error of the writes of a regulator waveform.
+
+The samples written by the writer thread used when the DAQ cannot clock its
+analog outputs are compared with a loop sleeping between the writes, as the
+steps used to do. The error is the delay between the scheduled time of a
+sample and its write.
+
+Usage: python benchmarks/bench_waveform.py [rate_in_Hz] [duration_in_s]
+
+"""
+import sys
+import time
+
+import numpy as np
+
+from annealpy.daq.waveform import ThreadWaveformPlayer
+
+
+def report(name, indices, times, start, period):
+    """Print the statistics of the delay of the writes.
+
+    """
+    scheduled = start + period*np.array(indices)
+    delays = (np.array(times) - scheduled)*1e-3
+    print(f'{name:<14} mean {delays.mean():9.1f} us, '
+          f'p99 {np.percentile(delays, 99):9.1f} us, '
+          f'max {delays.max():9.1f} us ({len(times)} samples written)')
+
+
+def sleep_loop(count, period):
+    """Write the samples from a loop sleeping between them.
+
+    """
+    times = []
+    start = time.monotonic_ns()
+    for i in range(count):
+        time.sleep(max(start + i*period - time.monotonic_ns(), 0)*1e-9)
+        times.append(time.monotonic_ns())
+    return times, start
+
+
+def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 100.0
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    count = int(rate*duration)
+    period = 1e9/rate
+
+    times, start = sleep_loop(count, period)
+    report('sleep loop', range(count), times, start, period)
+
+    times = []
+    indices = []
+    player = ThreadWaveformPlayer(
+        np.zeros(count), rate, lambda value: times.append(time.monotonic_ns()),
+        lambda first, stop: indices.append(first))
+    player.start()
+    player.wait()
+    # The samples skipped by the thread are not written.
+    report('writer thread', indices, times, player.start_ns, period)
+
+
+if __name__ == '__main__':
+    main()
@@ -34,4 +34,6 @@ setup(name='annealpy',
       platforms="Windows",
       use_2to3=False,
       zip_safe=False,
-      entry_points={'gui_scripts': 'annealpy = annealpy.__main__:main'},)
+      entry_points={'gui_scripts': 'annealpy = annealpy.__main__:main',
+                    'console_scripts':
+                        'annealpy-cli = annealpy.cli:main'},)
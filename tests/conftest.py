@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Fixtures shared by the tests.
+
+"""
+import time
+from queue import Queue
+from threading import Event
+
+import pytest
+
+from annealpy.clock import Clock
+from annealpy.daq.daq_control import AnnealerDaq
+from annealpy.process import ActuatorSubprocess
+from annealpy.telemetry import TelemetrySender
+
+
+@pytest.fixture
+def actuator():
+    """Actuator driving a simulated DAQ without starting a subprocess.
+
+    """
+    actuator = ActuatorSubprocess('', {}, None, Event(), None)
+    actuator.clock = Clock()
+    actuator._telemetry = TelemetrySender(Queue(), max_pending=100000)
+    actuator._daq = AnnealerDaq({})
+    actuator._daq.initialize()
+    actuator._create_outputs()
+    actuator.start_time = time.time()
+    yield actuator
+    actuator._daq.finalize()
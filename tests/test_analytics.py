@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the thermal budget of the recorded runs.
+
+"""
+import numpy as np
+import pytest
+
+from annealpy import analytics
+from annealpy.analytics import (AnalyticsCache, BudgetConfig, ThermalBudget,
+                                analyze_run, analyze_runs, compare)
+from annealpy.recording import RunRecorder, create_run_directory
+
+#: Settings used with the trapezoid profile.
+CONFIG = BudgetConfig(thresholds=[300.0], rate_bin_width=0.25, max_rate=2.0)
+
+
+def trapezoid(rate=10.0):
+    """Ramp at 1 C/s to 500 C, hold for 1000 s and cool at 0.5 C/s.
+
+    """
+    times = np.arange(0, 2525, 1/rate)
+    temperatures = np.piecewise(
+        times, [times < 475, (times >= 475) & (times < 1475),
+                (times >= 1475) & (times < 2425), times >= 2425],
+        [lambda t: 25 + t, 500, lambda t: 500 - 0.5*(t - 1475), 25])
+    return times, temperatures
+
+
+def record(root, name, offset=0.0):
+    """Record the trapezoid profile shifted by an offset.
+
+    """
+    directory = create_run_directory(str(root), name)
+    recorder = RunRecorder(directory, dict(description=name,
+                                           process={'steps': []}))
+    times, temperatures = trapezoid()
+    recorder.write(zip(['temperature']*len(times),
+                       (times*1e9).astype(np.int64).tolist(),
+                       (temperatures + offset).tolist()))
+    recorder.close('Completed')
+    return directory
+
+
+def test_budget_of_a_trapezoid(tmp_path):
+    """The budget of a recorded trapezoid matches its analytic value.
+
+    """
+    result = analyze_run(record(tmp_path, 'run'), CONFIG)
+    assert result['duration'] == pytest.approx(2524.9)
+    assert result['peak_temperature'] == 500.0
+    assert result['time_above']['300'] == pytest.approx(1600, abs=0.1)
+    assert result['degree_seconds'] == pytest.approx(813437.5, rel=1e-4)
+    ramp = result['ramp_rate']
+    histogram = dict(zip(ramp['edges'], ramp['histogram']))
+    # The rates lie on the edges of the bins, which rounding can move.
+    assert histogram[0.75] + histogram[1.0] == pytest.approx(470, abs=10)
+    assert histogram[-0.75] + histogram[-0.5] == pytest.approx(950, abs=10)
+    assert ramp['max_heating'] == pytest.approx(1.0)
+    assert ramp['max_cooling'] == pytest.approx(0.5)
+
+
+def test_dose_at_the_reference_temperature():
+    """The dose is the time spent at the reference temperature.
+
+    """
+    budget = ThermalBudget(BudgetConfig(reference_temperature=400.0))
+    budget.add(np.arange(0.0, 101.0), np.full(101, 400.0))
+    assert budget.result()['thermal_dose'] == pytest.approx(100.0)
+    hotter = ThermalBudget(BudgetConfig(reference_temperature=400.0))
+    hotter.add(np.arange(0.0, 101.0), np.full(101, 450.0))
+    assert hotter.result()['thermal_dose'] > 100.0
+
+
+def test_blocks_give_the_same_budget():
+    """Feeding the samples by blocks does not change the budget.
+
+    """
+    times, temperatures = trapezoid()
+    whole = ThermalBudget(CONFIG)
+    whole.add(times, temperatures)
+    blocks = ThermalBudget(CONFIG)
+    for block in np.array_split(np.arange(len(times)), 37):
+        blocks.add(times[block], temperatures[block])
+    expected, result = whole.result(), blocks.result()
+    for name in ('duration', 'thermal_dose', 'degree_seconds'):
+        assert result[name] == pytest.approx(expected[name])
+    assert result['time_above'] == pytest.approx(expected['time_above'])
+    np.testing.assert_allclose(result['ramp_rate']['histogram'],
+                               expected['ramp_rate']['histogram'])
+
+
+def test_results_are_cached(tmp_path, monkeypatch):
+    """Cached results are reused until the settings change.
+
+    """
+    directories = [record(tmp_path, f'run{i}', i) for i in range(2)]
+    cache = AnalyticsCache(str(tmp_path))
+    results = analyze_runs(directories, CONFIG, cache, workers=1)
+    assert results[0]['content_hash'] != results[1]['content_hash']
+
+    def fail(directory, settings):
+        raise AssertionError('The run was analyzed again.')
+
+    monkeypatch.setattr(analytics, '_analyze', fail)
+    assert analyze_runs(directories, CONFIG, cache, workers=1) == results
+    with pytest.raises(AssertionError):
+        analyze_runs(directories, BudgetConfig(), cache, workers=1)
+
+    stats = compare(results)
+    assert stats['peak_temperature']['mean'] == pytest.approx(500.5)
+    assert stats['peak_temperature']['max'] == pytest.approx(501.0)
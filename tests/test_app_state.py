@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the channel history held by the application.
+
+"""
+import numpy as np
+import pytest
+
+from annealpy.app_state import ChannelStatus
+
+
+@pytest.mark.parametrize('kind', ['stepped', 'continuous'])
+def test_extend_matches_append_value(kind):
+    """Extending an empty history is equivalent to appending each sample.
+
+    """
+    times = np.arange(1.0, 6.0)
+    values = np.array([3.0, 1.0, 4.0, 1.0, 5.0])
+    extended = ChannelStatus(float, kind, 4)
+    # Garbage in the unused slots must not leak into the history.
+    extended.values[:] = np.nan
+    extended.extend(times, values)
+    appended = ChannelStatus(float, kind, 4)
+    appended.values[:] = np.nan
+    for t, v in zip(times, values):
+        appended.append_value(t, v)
+    for left, right in zip(extended.get_data(), appended.get_data()):
+        np.testing.assert_array_equal(left, right)
+    assert not np.isnan(extended.get_data()[1]).any()
+    np.testing.assert_array_equal(extended.get_samples()[1], values)
+
+
+def test_stepped_history_draws_steps():
+    """A stepped channel holds its value until the next sample.
+
+    """
+    status = ChannelStatus(float, 'stepped', 10)
+    status.add_first_value(0.0)
+    status.extend(np.array([1.0, 2.0]), np.array([1.0, 0.5]))
+    times, values = status.get_data(3.0)
+    np.testing.assert_array_equal(times, [0, 1, 1, 2, 2, 3])
+    np.testing.assert_array_equal(values, [0, 0, 1, 1, 0.5, 0.5])
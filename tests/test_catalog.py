@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the run catalog.
+
+"""
+import time
+
+import numpy as np
+import pytest
+
+from annealpy.catalog import ABORTED_STATUS, RunCatalog
+from annealpy.cli import parse_date, parse_end_date
+from annealpy.recording import RunRecorder, create_run_directory
+
+
+def record_run(root, steps, starts, temperatures, status='Completed'):
+    """Record a run sampling a temperature profile at 10 Hz.
+
+    """
+    directory = create_run_directory(str(root), 'run')
+    recorder = RunRecorder(directory, dict(description='test',
+                                           process=dict(steps=steps)))
+    times = np.arange(len(temperatures))*0.1
+    recorder.write([('temperature', round(t*1e9), float(v))
+                    for t, v in zip(times, temperatures)])
+    for i, start in enumerate(starts):
+        recorder.add_event(start, 'step_start', step=i)
+    if status is None:
+        # The actuator died without closing the recording.
+        recorder.flush()
+    else:
+        recorder.close(status)
+    return directory
+
+
+def test_overshoot_follows_the_approach_direction(tmp_path):
+    """A cooling step overshoots below its target, not above it.
+
+    """
+    heating = np.concatenate((np.linspace(25, 205, 100), np.full(50, 200)))
+    cooling = np.concatenate((np.linspace(450, 197, 100), np.full(50, 200)))
+    steps = [dict(type='PIDRegulatedStep', target_temperature=200)]*2
+    directory = record_run(tmp_path, steps, [0.0, 15.0],
+                           np.concatenate((heating, cooling)))
+    catalog = RunCatalog(str(tmp_path))
+    catalog.add_run(directory)
+    run, = catalog.query()
+    # 5 C above when heating up and 3 C below when cooling down.
+    assert run['overshoot'] == pytest.approx(5.0)
+    assert run['peak_temperature'] == pytest.approx(450.0)
+
+
+def test_unclosed_run_is_indexed_as_aborted(tmp_path):
+    """A run whose recording was never closed is not left running.
+
+    """
+    directory = record_run(tmp_path, [], [], np.full(100, 25.0),
+                           status=None)
+    catalog = RunCatalog(str(tmp_path))
+    catalog.add_run(directory)
+    run, = catalog.query()
+    assert run['status'] == ABORTED_STATUS
+    assert run['end_time'] == pytest.approx(run['start_time'] + 9.9)
+
+
+def test_until_includes_the_whole_day(tmp_path):
+    """Runs started on the until date are found.
+
+    """
+    directory = record_run(tmp_path, [], [], np.full(10, 25.0))
+    catalog = RunCatalog(str(tmp_path))
+    catalog.add_run(directory)
+    today = time.strftime('%Y-%m-%d')
+    yesterday = time.strftime('%Y-%m-%d', time.localtime(time.time() - 86400))
+    assert len(catalog.query(since=parse_date(today),
+                             until=parse_end_date(today))) == 1
+    assert not catalog.query(until=parse_end_date(yesterday))
+    assert parse_end_date('2019-02-28') == parse_date('2019-03-01')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the description of the DAQ channels.
+
+"""
+import numpy as np
+import pytest
+
+from annealpy.channels import (ChannelConfig, ChannelRegistry,
+                               create_array_converter)
+
+
+def zone(index, direction):
+    """Config of a channel of a heater zone.
+
+    """
+    return ChannelConfig(name=f'zone_{index}_{direction}', zone=index,
+                         direction=direction, physical_id=f'a{index}')
+
+
+def test_legacy_config_builds_the_control_channels():
+    """The control channels are built from the legacy keys.
+
+    """
+    registry = ChannelRegistry.from_daq_config(
+        {'temperature_id': 'ai5', 'heater_switch_id': ['ai3', 'ao2'],
+         'temperature_conversion': {'scale': 100}})
+    assert registry.names == ['temperature', 'heater_switch',
+                              'heater_regulation']
+    assert registry['temperature'].physical_id == 'ai5'
+    assert registry['heater_switch'].readback_id == 'ai3'
+    assert registry['heater_switch'].physical_id == 'ao2'
+    assert registry['heater_regulation'].physical_id == 'ao1'
+    assert registry.kinds['heater_switch'] == 'stepped'
+    assert registry.auxiliary_inputs == []
+
+
+def test_declared_channels_replace_the_legacy_ones():
+    """Listed channels override the legacy ones and extend the registry.
+
+    """
+    registry = ChannelRegistry.from_daq_config({'channels': [
+        {'name': 'temperature', 'physical_id': 'ai7'},
+        {'name': 'pressure', 'physical_id': 'ai3', 'unit': 'mbar'}]})
+    assert registry.names == ['heater_switch', 'heater_regulation',
+                              'temperature', 'pressure']
+    assert registry['temperature'].physical_id == 'ai7'
+    assert [c.name for c in registry.auxiliary_inputs] == ['pressure']
+    assert registry['pressure'].label == 'Pressure'
+    restored = ChannelRegistry(ChannelConfig(**c)
+                               for c in registry.to_list())
+    assert restored.schema == registry.schema
+
+
+def test_invalid_registries():
+    """Duplicated names, missing control channels and unpaired zones fail.
+
+    """
+    control = list(ChannelRegistry.from_daq_config({}))
+    with pytest.raises(ValueError):
+        ChannelRegistry(control + [ChannelConfig(name='temperature')])
+    with pytest.raises(ValueError):
+        ChannelRegistry(control[1:])
+    with pytest.raises(ValueError):
+        ChannelRegistry(control + [zone(0, 'input')])
+    with pytest.raises(ValueError):
+        ChannelRegistry(control + [zone(1, 'input'), zone(1, 'output')])
+
+
+def test_zones_are_ordered():
+    """The zone channels are ordered by zone, whatever their position.
+
+    """
+    control = list(ChannelRegistry.from_daq_config({}))
+    registry = ChannelRegistry(control + [zone(1, 'input'), zone(0, 'output'),
+                                          zone(0, 'input'), zone(1, 'output')])
+    assert [c.zone for c in registry.zone_inputs] == [0, 1]
+    assert [c.zone for c in registry.zone_outputs] == [0, 1]
+    assert registry.auxiliary_inputs == []
+
+
+def test_converters():
+    """The array converter applies the conversion of each channel.
+
+    """
+    linear = ChannelConfig(name='a', conversion={'scale': 2, 'offset': 1})
+    polynomial = ChannelConfig(name='b',
+                               conversion={'polynomial': [1, 0, 3]})
+    identity = ChannelConfig(name='c')
+    volts = np.array([1.0, 2.0, 3.0])
+    assert linear.create_converter()(2.0) == 5.0
+    assert polynomial.create_converter()(2.0) == 13.0
+    assert identity.create_converter()(2.0) == 2.0
+    np.testing.assert_array_equal(
+        create_array_converter([linear, identity, linear])(volts),
+        [3.0, 2.0, 7.0])
+    np.testing.assert_array_equal(
+        create_array_converter([linear, polynomial, identity])(volts),
+        [3.0, 13.0, 3.0])
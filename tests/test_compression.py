@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the online compression of the channel history.
+
+"""
+import numpy as np
+import pytest
+
+from annealpy.compression import CompressionConfig
+
+
+def compress(compressor, times, values, events=()):
+    """Feed samples to a compressor and return the kept points as arrays.
+
+    """
+    events = list(events)
+    kept = []
+    for t, v in zip(times.tolist(), values.tolist()):
+        while events and events[0] <= t:
+            kept += compressor.mark_event(events.pop(0))
+        kept += compressor.add(t, v)
+    kept += compressor.flush()
+    kept_times, kept_values = np.array(kept).T
+    return kept_times, kept_values
+
+
+@pytest.fixture
+def signal():
+    """Noisy ramp and plateau sampled at 10 Hz.
+
+    """
+    rng = np.random.RandomState(0)
+    times = np.arange(0, 600, 0.1)
+    values = np.minimum(times, 300) + rng.normal(0, 0.2, len(times))
+    return times, values
+
+
+@pytest.mark.parametrize('method', ['swinging_door', 'deadband'])
+def test_reconstruction_error_is_bounded(method, signal):
+    """Interpolating the kept points stays within max_error of the samples.
+
+    """
+    times, values = signal
+    config = CompressionConfig(method=method, max_error=0.5,
+                               max_interval=20, event_window=0)
+    kept_times, kept_values = compress(config.create_compressor(), times,
+                                       values)
+    assert len(kept_times) < len(times)/4
+    assert np.all(np.diff(kept_times) > 0)
+    assert np.diff(kept_times).max() <= 20 + 1e-9
+    error = np.abs(np.interp(times, kept_times, kept_values) - values)
+    assert error.max() <= 0.5 + 1e-9
+
+
+def test_events_keep_full_resolution(signal):
+    """All the samples following an event are kept for event_window.
+
+    """
+    times, values = signal
+    config = CompressionConfig(max_error=0.5, event_window=5)
+    kept_times, _ = compress(config.create_compressor(), times, values,
+                             events=[400.0])
+    window = times[(times >= 399.95) & (times < 404.95)]
+    assert np.isin(window, kept_times).all()
+    assert not np.isin(times[(times > 410) & (times < 420)],
+                       kept_times).all()
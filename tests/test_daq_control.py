@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the DAQ control layer.
+
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from annealpy.daq import daq_control
+from annealpy.daq.daq_control import AnnealerDaq
+from annealpy.testing import fake_nidaqmx
+
+
+@pytest.fixture
+def fake_driver():
+    """Install the fake driver, restoring the previous one afterwards.
+
+    """
+    names = [n for n in sys.modules if n == 'nidaqmx' or
+             n.startswith('nidaqmx.')]
+    modules = {n: sys.modules[n] for n in names}
+    variable = os.environ.get(fake_nidaqmx.ENVIRONMENT_VARIABLE)
+    driver = daq_control.nidaqmx
+    config = {'heater_switch_id': ['ai4', 'ao1'],
+              'heater_reg_id': ['ai5', 'ao0'], 'temperature_id': 'ai3',
+              'heater_reg_min_value': 1.0, 'heater_reg_max_value': 4.0}
+    try:
+        yield fake_nidaqmx.install(config), config
+    finally:
+        daq_control.nidaqmx = driver
+        for name in [n for n in sys.modules if n == 'nidaqmx' or
+                     n.startswith('nidaqmx.')]:
+            del sys.modules[name]
+        sys.modules.update(modules)
+        if variable is None:
+            os.environ.pop(fake_nidaqmx.ENVIRONMENT_VARIABLE, None)
+        else:
+            os.environ[fake_nidaqmx.ENVIRONMENT_VARIABLE] = variable
+        fake_nidaqmx.System.local().clear()
+
+
+@pytest.mark.parametrize('min_value, max_value',
+                         [(0.0, 4.1), (0.3, 3.3), (0.0, 5.0), (1.0, 2.5)])
+def test_heater_reg_quantizer_stays_in_range(min_value, max_value):
+    """The quantized states never leave [0, 1].
+
+    The codes closest to the bounds of the range can lie slightly beyond
+    them when the bounds are not multiples of the DAC resolution.
+
+    """
+    daq = AnnealerDaq({})
+    daq.heater_reg_min_value = min_value
+    daq.heater_reg_max_value = max_value
+    quantize = daq.create_heater_reg_quantizer()
+    states = [quantize(value) for value in np.linspace(0, 1, 20001)]
+    assert min(states) == 0.0
+    assert max(states) == 1.0
+    assert np.all(np.diff(states) >= 0)
+
+
+def test_heater_reg_quantizer_rounds_to_dac_codes():
+    """The quantized states map to integer codes of the DAC.
+
+    """
+    daq = AnnealerDaq({})
+    daq.heater_reg_min_value = 0.0
+    daq.heater_reg_max_value = 5.0
+    quantize = daq.create_heater_reg_quantizer()
+    lsb = 5.0/(2**daq.ao_resolution_bits - 1)
+    for value in (0.1, 0.25, 0.5, 0.77):
+        code = quantize(value)*5.0/lsb
+        assert code == pytest.approx(round(code))
+        assert abs(quantize(value) - value) <= lsb/5.0/2 + 1e-12
+
+
+def test_tasks_use_the_configured_channels(fake_driver):
+    """One task is created per channel and closed on finalize.
+
+    """
+    device, config = fake_driver
+    daq = AnnealerDaq(config)
+    daq.initialize()
+    tasks = dict(daq._tasks)
+    assert tasks['temperature'].channel_names == ['Dev1/ai3']
+    assert [t.channel_names for t in tasks['heater_switch']] == [
+        ['Dev1/ai4'], ['Dev1/ao1']]
+    assert [t.channel_names for t in tasks['heater_reg']] == [
+        ['Dev1/ai5'], ['Dev1/ao0']]
+    daq.finalize()
+    assert all(t._closed for t in (tasks['temperature'],
+                                   *tasks['heater_switch'],
+                                   *tasks['heater_reg']))
+
+
+def test_heater_states_round_trip(fake_driver):
+    """The heater states are written to and read back from the device.
+
+    """
+    device, config = fake_driver
+    daq = AnnealerDaq(config)
+    with pytest.raises(RuntimeError):
+        daq.heater_switch_state
+    daq.initialize()
+    try:
+        # The first read comes from the readback inputs.
+        assert daq.heater_switch_state is False
+        assert daq.heater_reg_state == 0.0
+        daq.heater_switch_state = True
+        daq.heater_reg_state = 0.5
+        assert device.output('ao1') == 5.0
+        assert device.output('ao0') == pytest.approx(2.5)
+
+        other = AnnealerDaq(config)
+        other.initialize()
+        try:
+            assert other.heater_switch_state is True
+            assert other.heater_reg_state == 0.5
+        finally:
+            other.finalize()
+
+        daq.heater_switch_state = False
+        assert device.output('ao1') == 0.0
+    finally:
+        daq.finalize()
+
+
+def test_missing_device_is_reported(fake_driver):
+    """Initializing a device absent from the system fails.
+
+    """
+    device, config = fake_driver
+    daq = AnnealerDaq(dict(config, device_id='Dev2'))
+    with pytest.raises(ValueError):
+        daq.initialize()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the prediction of the processes using a thermal model.
+
+"""
+import math
+
+import pytest
+
+from annealpy.dryrun import dry_run, format_prediction, time_to_reach
+from annealpy.identification import ThermalModel
+from annealpy.steps import STEPS
+
+
+@pytest.fixture
+def model():
+    """Furnace reaching 820 C at full power with a 200 s time constant.
+
+    """
+    return ThermalModel(order='fopdt', dt=1.0, a=[0.995], b=0.005*800,
+                        c=0.005*20, delay=5)
+
+
+def pid_step(target, duration):
+    """PID step regulating at a target.
+
+    """
+    return STEPS['PIDRegulatedStep'](target_temperature=target,
+                                     duration=duration, parameter_p=0.05,
+                                     parameter_i=0.0005, interval=0.1)
+
+
+def test_time_to_reach(model):
+    """The time to reach a target at full power follows the model.
+
+    """
+    expected = 5 - model.time_constant*math.log(1 - 380/800)
+    assert time_to_reach(model, 20.0, 400.0, 100.0) == pytest.approx(
+        expected, abs=2)
+    assert time_to_reach(model, 20.0, 900.0, 100.0) == math.inf
+
+
+def test_prediction_of_the_steps(model):
+    """The steps are executed in virtual time and the short ones flagged.
+
+    """
+    prediction = dry_run([pid_step(400, 1800), pid_step(600, 100)], [model])
+    first, second = prediction['steps']
+    assert first['duration'] == pytest.approx(1800, abs=2)
+    assert not first['too_short']
+    assert first['peak_temperature'] == pytest.approx(400, abs=1)
+    assert second['too_short']
+    assert second['required_time'] > second['planned_duration']
+    assert second['required_time'] < math.inf
+    assert prediction['duration'] == pytest.approx(1900, abs=4)
+    assert prediction['energy'] == pytest.approx(
+        first['energy'] + second['energy'])
+    assert not prediction['truncated']
+    assert len(prediction['times']) == len(prediction['temperatures'])
+    assert 'TOO SHORT' in format_prediction(prediction)
+
+
+def test_unreachable_wait_is_interrupted(model):
+    """Waiting for a temperature the furnace cannot reach is interrupted.
+
+    """
+    step = STEPS['FastRamp'](target_temperature=900, duration=10)
+    prediction = dry_run([step], [model], max_duration=600)
+    assert prediction['truncated']
+    assert prediction['duration'] == pytest.approx(600, abs=2)
+    assert prediction['steps'][0]['required_time'] == math.inf
+
+
+def test_a_model_is_required():
+    """A prediction cannot be made without a thermal model.
+
+    """
+    with pytest.raises(ValueError):
+        dry_run([pid_step(400, 10)], [])
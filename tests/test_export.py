@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the export of the run data.
+
+"""
+import numpy as np
+
+from annealpy.export import Resampler
+
+
+def samples(start, stop):
+    """Samples of a ramp at 10 Hz.
+
+    """
+    times = np.arange(start, stop, 0.1)
+    return times, times.copy()
+
+
+def test_resampler_waits_for_running_channels():
+    """Grid points are emitted up to the slowest running channel.
+
+    """
+    resampler = Resampler(dict(a='continuous', b='continuous'), 1.0)
+    grid, _ = resampler.add(dict(a=samples(0, 10), b=samples(0, 5)))
+    assert grid[-1] == 4.0
+    grid, columns = resampler.add(dict(a=samples(10, 20),
+                                       b=samples(5, 20)))
+    assert list(grid) == list(np.arange(5.0, 20.0))
+    np.testing.assert_allclose(columns['b'], grid)
+
+
+def test_resampler_skips_empty_and_finished_channels():
+    """Channels without samples or finished do not hold the grid back.
+
+    """
+    kinds = dict(a='continuous', b='continuous', c='continuous')
+    resampler = Resampler(kinds, 1.0, max_gap=30.0)
+    grid, _ = resampler.add(dict(a=samples(0, 100), b=samples(0, 10)))
+    assert grid[-1] == 99.0
+    grid, columns = resampler.add(dict(a=samples(100, 200)))
+    assert grid[-1] == 199.0
+    assert np.isnan(columns['c']).all()
+    # The last value of the finished channel is held.
+    np.testing.assert_allclose(columns['b'], 9.9)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the filters applied to the oversampled inputs.
+
+"""
+import numpy as np
+import pytest
+
+from annealpy.filtering import FilterConfig
+
+
+def filter_ramp(config, blocks=50, slope=2.0):
+    """Filter blocks of a ramp and return the last value and the ramp
+    value at the end of the last block.
+
+    """
+    filt = config.create_filter()
+    size = config.oversampling
+    times = np.arange(blocks*size)/config.sample_rate
+    ramp = 20 + slope*times
+    for i in range(blocks):
+        value = filt.process(ramp[i*size:(i + 1)*size])
+    return filt, value, ramp[-1]
+
+
+def test_median_rejects_spikes():
+    """An isolated spike does not affect the median of a block.
+
+    """
+    block = np.full(9, 100.0)
+    block[4] = 1e6
+    filt = FilterConfig(method='median').create_filter()
+    assert filt.process(block) == 100.0
+    boxcar = FilterConfig(method='boxcar').create_filter()
+    assert boxcar.process(block) > 100.0
+
+
+def test_ema_blocks_match_sample_by_sample():
+    """Processing blocks is equivalent to filtering each sample in turn.
+
+    """
+    rng = np.random.RandomState(0)
+    samples = rng.normal(100, 1, 60)
+    filt = FilterConfig(method='ema', cutoff=20.0).create_filter()
+    for block in np.split(samples, [7, 20, 45]):
+        value = filt.process(block)
+    expected = samples[0]
+    for sample in samples:
+        expected += filt.alpha*(sample - expected)
+    assert value == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('method', ['boxcar', 'median', 'ema',
+                                    'butterworth'])
+def test_group_delay_matches_the_lag_on_a_ramp(method):
+    """The filtered ramp lags behind by the group delay.
+
+    """
+    if method == 'butterworth':
+        pytest.importorskip('scipy')
+    config = FilterConfig(method=method, oversampling=10,
+                          sample_rate=1000.0, cutoff=10.0)
+    filt, value, last = filter_ramp(config)
+    lag = (last - value)/2.0
+    assert lag == pytest.approx(filt.group_delay(config.oversampling),
+                                rel=0.02, abs=1e-9)
+
+
+def test_butterworth_starts_without_transient():
+    """A constant input is left untouched from the first block.
+
+    """
+    pytest.importorskip('scipy')
+    filt = FilterConfig(method='butterworth').create_filter()
+    for _ in range(5):
+        assert filt.process(np.full(10, 300.0)) == pytest.approx(300.0)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the thermal model identification.
+
+"""
+import numpy as np
+import pytest
+
+from annealpy.identification import ThermalModel, identify
+
+
+def simulate(a, b, c, commands, temperature):
+    """Simulate a first order model with a one sample delay.
+
+    """
+    temperatures = [temperature]
+    for command in commands[:-1]:
+        temperatures.append(a*temperatures[-1] + b*command + c)
+    return np.array(temperatures)
+
+
+def test_identify_first_order_model():
+    """The parameters of a noiseless first order model are recovered.
+
+    """
+    commands = np.repeat([0.2, 0.8, 0.0, 0.5], 200)
+    temperatures = simulate(0.95, 20.0, 1.25, commands, 25.0)
+    model = identify([(temperatures, commands)], max_delay=5.0)
+    assert model.gain == pytest.approx(400.0, rel=1e-3)
+    assert model.ambient == pytest.approx(25.0, rel=1e-3)
+
+
+def test_identify_rejects_unstable_fits():
+    """A diverging process cannot be described by a model.
+
+    """
+    commands = np.repeat([0.2, 0.8, 0.0, 0.5], 200)
+    temperatures = simulate(1.002, 2.0, 0.0, commands, 25.0)
+    with pytest.raises(ValueError):
+        identify([(temperatures, commands)], max_delay=5.0)
+
+
+@pytest.mark.parametrize('delay', [0, 3])
+def test_simulate_with_past_commands(delay):
+    """The past commands only feed the dead time of the model.
+
+    """
+    model = ThermalModel(order='fopdt', dt=1.0, a=[0.9], b=10.0, c=2.0,
+                         delay=delay)
+    commands = np.full(20, 0.5)
+    past = [0.0]*5
+    temperatures = model.simulate(commands, 20.0, past_commands=past)
+    expected = simulate(0.9, 10.0, 2.0,
+                        np.concatenate(([0.0]*delay, commands)), 20.0)
+    np.testing.assert_allclose(temperatures, expected[:20])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the running metrics of the steps.
+
+"""
+import pytest
+
+from annealpy.metrics import StepMetrics, estimate_slope, format_metrics
+
+
+def test_approach_overshoot_and_settling():
+    """The band, overshoot and settling are tracked along the approach.
+
+    """
+    metrics = StepMetrics(10.0, target=100.0, tolerance=2.0)
+    for t, value in [(10, 20), (11, 90), (12, 99), (13, 105), (14, 101),
+                     (15, 100)]:
+        metrics.add_temperature(float(t), float(value))
+    result = metrics.as_dict(15.0)
+    assert result['time_to_band'] == 2.0
+    assert result['overshoot'] == 5.0
+    assert result['settling_time'] == 4.0
+    assert result['max_error'] == 5.0
+    assert result['rms_error'] == pytest.approx((27/4)**0.5)
+    # In the band from 12 to 13 and from 14 to 15.
+    assert result['time_in_tolerance'] == 2.0
+
+
+def test_settling_time_is_none_outside_the_band():
+    """A temperature outside of the band has not settled.
+
+    """
+    metrics = StepMetrics(0.0, target=100.0)
+    metrics.add_temperature(0.0, 150.0)
+    metrics.add_temperature(1.0, 99.0)
+    metrics.add_temperature(2.0, 90.0)
+    result = metrics.as_dict(2.0)
+    assert result['time_to_band'] == 1.0
+    assert result['settling_time'] is None
+    # The approach from above makes excursions below the target overshoots.
+    assert result['overshoot'] == 10.0
+
+
+def test_heater_duty_and_energy():
+    """The duty is the time average of the command.
+
+    """
+    metrics = StepMetrics(0.0, heater_power=1000.0)
+    metrics.set_command(0.0, 1.0)
+    metrics.set_command(1.0, 0.5)
+    metrics.set_command(3.0, 0.0)
+    result = metrics.as_dict(4.0)
+    assert result['heater_duty'] == pytest.approx(0.5)
+    assert result['energy'] == pytest.approx(2000.0)
+    assert 'target' not in result
+    assert 'rms' not in format_metrics(result)
+
+
+def test_estimate_slope():
+    """The slope of a noisy line is recovered.
+
+    """
+    samples = [(t, 3.0*t + (-1)**t*0.1) for t in range(10)]
+    assert estimate_slope(samples) == pytest.approx(3.0, abs=0.05)
+    assert estimate_slope(samples[:1]) == 0.0
+    assert estimate_slope([(1.0, 1.0), (1.0, 2.0)]) == 0.0
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the PID kernels.
+
+"""
+import numpy as np
+import pytest
+
+from annealpy.steps.pid import PID
+
+
+def test_integral_does_not_wind_up_in_saturation():
+    """A saturated output does not keep integrating the error.
+
+    """
+    kernel = PID(target=100, parameter_p=0.001,
+                 parameter_i=0.01).create_kernel()
+    for t in range(1000):
+        assert kernel.compute(float(t), 0.0) <= 1.0
+    assert kernel.get_state()['integral'] <= 1.0
+    # Once the target is exceeded, the output leaves the saturation at once.
+    assert kernel.compute(1000.0, 150.0) < 1.0
+
+
+def test_bumpless_start_matches_the_current_output():
+    """The first output after a bumpless start is the given output.
+
+    """
+    kernel = PID(target=100, parameter_p=0.01, parameter_i=0.001,
+                 parameter_d=1.0).create_kernel()
+    kernel.bumpless_start(0.3, 0.0, 90.0)
+    assert kernel.compute(0.0, 90.0) == pytest.approx(0.3)
+
+
+def test_state_round_trip():
+    """A kernel restored from a state resumes with the same integral.
+
+    """
+    pid = PID(target=100, parameter_p=0.01, parameter_i=0.001)
+    kernel = pid.create_kernel()
+    for t in range(10):
+        kernel.compute(float(t), 50.0)
+    state = kernel.get_state()
+    restored = pid.create_kernel()
+    restored.set_state(state)
+    # The first update only initializes the timing.
+    assert restored.compute(20.0, 50.0) == pytest.approx(
+        0.01*50 + state['integral'])
+
+
+def test_zone_kernel_matches_the_scalar_kernel():
+    """Without compensation, each zone is regulated as by a PIDKernel.
+
+    """
+    pid = PID(target=100, parameter_p=0.01, parameter_i=0.002,
+              parameter_d=0.5, derivative_filter=2.0)
+    zones = pid.create_zone_kernel(3)
+    kernels = [pid.create_kernel() for _ in range(3)]
+    for t in range(50):
+        values = np.array([20.0, 60.0, 99.0]) + t
+        outputs = zones.compute(float(t), values, 100.0)
+        expected = [k.compute(float(t), v) for k, v in zip(kernels, values)]
+        np.testing.assert_allclose(outputs, expected)
+
+
+def test_zone_kernel_compensations():
+    """The coupling is inverted and the gradient pulls the zones together.
+
+    """
+    pid = PID(parameter_p=0.01, parameter_i=0.001)
+    values = np.array([40.0, 50.0, 45.0])
+    raw = pid.create_zone_kernel(3).compute(0.0, values, 100.0)
+    coupled = pid.create_zone_kernel(3, coupling=0.2)
+    outputs = coupled.compute(0.0, values, 100.0)
+    np.testing.assert_allclose(coupled._coupling @ outputs, raw)
+
+    gradient = pid.create_zone_kernel(3, gradient_gain=1.0)
+    outputs = gradient.compute(0.0, values, 100.0)
+    assert outputs[0] > raw[0] and outputs[1] < raw[1]
+
+    coupled.bumpless_start(np.array([0.2, 0.3, 0.4]), 1.0, values, 100.0)
+    np.testing.assert_allclose(coupled.compute(1.0, values, 100.0),
+                               [0.2, 0.3, 0.4])
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the PID regulated step.
+
+"""
+import pytest
+
+from annealpy.steps.pid_regulated_step import PIDRegulatedStep
+
+
+def test_resume_keeps_the_integral(actuator):
+    """The integral restored from a checkpoint is not reset by the start.
+
+    """
+    # A pure integral regulator, integrating slowly enough for its output to
+    # remain its restored integral.
+    step = PIDRegulatedStep(target_temperature=200, parameter_i=1e-9,
+                            duration=1.0, interval=0.1)
+    step.resume(actuator, dict(elapsed=0.85,
+                               pid=dict(integral=0.4, derivative=0.0)))
+    integral = actuator.checkpoint_pid.get_state()['integral']
+    assert integral == pytest.approx(0.4, abs=1e-6)
+    assert actuator.heater_reg_state == pytest.approx(0.4, abs=1e-3)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the actuator executing the processes.
+
+"""
+import pytest
+
+
+def ramp(actuator, start, rate):
+    """Make the actuator read a temperature ramp.
+
+    """
+    origin = actuator.clock.now()
+    actuator.read_temperature = (
+        lambda: start + rate*(actuator.clock.now() - origin))
+
+
+def test_wait_until_ends_at_the_crossing(actuator):
+    """A rising threshold is detected when it is crossed, not later.
+
+    """
+    ramp(actuator, 20.0, 100.0)
+    start = actuator.clock.now()
+    assert actuator.wait_until(50.0, interval=0.1)
+    assert actuator.clock.now() - start == pytest.approx(0.3, abs=0.05)
+
+
+def test_wait_until_anticipates_the_crossing(actuator):
+    """The wait ends anticipation s before the predicted crossing.
+
+    """
+    ramp(actuator, 100.0, -100.0)
+    start = actuator.clock.now()
+    assert actuator.wait_until(50.0, rising=False, anticipation=0.2)
+    assert actuator.clock.now() - start == pytest.approx(0.3, abs=0.05)
+
+
+def test_wait_until_predicate(actuator):
+    """A predicate ends the wait when it returns True.
+
+    """
+    ramp(actuator, 20.0, 100.0)
+    assert actuator.wait_until(lambda value: value > 30.0)
+
+
+def test_wait_until_timeout_and_stop(actuator):
+    """The wait fails on timeout and when a stop is requested.
+
+    """
+    ramp(actuator, 20.0, 0.0)
+    start = actuator.clock.now()
+    assert not actuator.wait_until(50.0, timeout=0.2)
+    assert actuator.clock.now() - start == pytest.approx(0.2, abs=0.05)
+    actuator.stop_event.set()
+    assert not actuator.wait_until(50.0)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the sampling profiler.
+
+"""
+import json
+import os
+import time
+from threading import Event, Thread
+
+from annealpy.profiling import (PROFILE_DIRECTORY, ProfileConfig,
+                                SamplingProfiler, allocation_growth,
+                                read_profile, top_functions)
+
+
+def spin(stop):
+    """Keep the thread busy until stopped.
+
+    """
+    while not stop.is_set():
+        sum(range(100))
+
+
+def profile(directory, target, config):
+    """Profile a thread running target(stop) for 0.3 s.
+
+    """
+    stop = Event()
+    thread = Thread(target=target, args=(stop,), name='worker')
+    idle = Thread(target=stop.wait, name='idle')
+    profiler = SamplingProfiler(str(directory), 'test', config, [thread])
+    thread.start()
+    idle.start()
+    profiler.start()
+    time.sleep(0.3)
+    profiler.stop()
+    stop.set()
+    thread.join()
+    idle.join()
+    assert profiler.error is None
+    return profiler
+
+
+def test_profile_of_a_thread(tmp_path):
+    """The stacks of the profiled threads are written in collapsed form.
+
+    """
+    profiler = profile(tmp_path, spin, ProfileConfig(interval=0.005))
+    stacks = read_profile(str(tmp_path), 'test')
+    assert stacks == dict(profiler.stacks)
+    assert {stack[0] for stack in stacks} == {'worker'}
+    assert sum(stacks.values()) == profiler.samples
+    label, own, total = top_functions(stacks, 1)[0]
+    assert 'spin' in label and total == profiler.samples
+    with open(os.path.join(tmp_path, PROFILE_DIRECTORY, 'test.json')) as f:
+        summary = json.load(f)
+    assert summary['samples'] == profiler.samples
+    assert summary['overhead'] <= 0.05
+
+
+def test_top_functions_count_recursion_once():
+    """A function appearing several times in a stack is counted once.
+
+    """
+    stacks = {('main', 'a', 'b', 'a'): 3, ('main', 'a', 'c'): 1}
+    assert top_functions(stacks) == [('a', 3, 4), ('c', 1, 1)]
+
+
+leaked = []
+
+
+def leak(stop):
+    """Allocate memory which is never released.
+
+    """
+    while not stop.is_set():
+        leaked.append(bytearray(10000))
+        time.sleep(0.001)
+
+
+def test_allocation_growth(tmp_path):
+    """The growth of the allocations is traced back to its line.
+
+    """
+    profile(tmp_path, leak, ProfileConfig(tracemalloc=True))
+    try:
+        growth = allocation_growth(str(tmp_path), 'test', 1)
+        frame = growth[0].traceback[0]
+        assert frame.filename == __file__
+        assert growth[0].size_diff >= 10*10000
+    finally:
+        leaked.clear()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the time-proportioning drive of the heater switch.
+
+"""
+import time
+
+import numpy as np
+import pytest
+
+from annealpy.daq.pwm import TimeProportioningOutput, effective_duty
+
+
+@pytest.mark.parametrize('duty, expected', [(-0.5, 0.0), (0.05, 0.0),
+                                            (0.1, 0.1), (0.5, 0.5),
+                                            (0.92, 1.0), (1.5, 1.0)])
+def test_effective_duty_suppresses_short_pulses(duty, expected):
+    """Pulses shorter than the minimal pulse are suppressed.
+
+    """
+    assert effective_duty(duty, 10.0, 1.0) == expected
+    assert effective_duty(0.05, 10.0, 0.0) == 0.05
+
+
+def run_output(duty, duration, period=0.05, min_pulse=0.0):
+    """Cycle an output and return its edges as (state, time in s) pairs.
+
+    """
+    edges = []
+    output = TimeProportioningOutput(
+        lambda state: None, period, min_pulse,
+        report=lambda state, edge: edges.append((state, edge*1e-9)))
+    output.duty = duty
+    output.start()
+    time.sleep(duration)
+    output.stop()
+    assert output.error is None
+    return output, edges
+
+
+def test_output_follows_the_duty():
+    """The output is on for duty*period at the start of each cycle.
+
+    """
+    output, edges = run_output(0.4, 0.32)
+    rises = [t for state, t in edges if state]
+    falls = [t for state, t in edges if not state]
+    assert output.cycles >= 5
+    assert len(rises) >= 5
+    np.testing.assert_allclose(np.diff(rises), 0.05, atol=5e-3)
+    widths = [fall - rise for rise, fall in zip(rises, falls)]
+    np.testing.assert_allclose(widths, 0.02, atol=5e-3)
+
+
+def test_constant_outputs_are_written_once():
+    """A null or full duty does not toggle the output.
+
+    """
+    for duty, state in ((0.0, False), (0.99, True)):
+        output, edges = run_output(duty, 0.2, min_pulse=0.005)
+        assert edges == [(state, edges[0][1])]
+        assert output.state is state
+
+
+def test_invalid_period():
+    """The period must be positive.
+
+    """
+    with pytest.raises(ValueError):
+        TimeProportioningOutput(lambda state: None, 0.0)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the service executing the processes out of the application.
+
+"""
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from annealpy.process import AnnealerProcess
+from annealpy.recording import read_meta
+from annealpy.service import (SERVICE_FILE, _ServiceConnection, find_service,
+                              launch_service)
+from annealpy.steps import STEPS
+from annealpy.telemetry import TelemetryBatch
+
+
+def batch(samples, dropped=0):
+    """Batch holding a given number of samples.
+
+    """
+    return TelemetryBatch(0.0, dropped, 0,
+                          [('temperature', i, 20.0) for i in range(samples)],
+                          [], None)
+
+
+def test_client_receives_the_run(tmp_path):
+    """A client follows the run until its end and a single run is allowed.
+
+    """
+    process = AnnealerProcess(description='service')
+    process.add_step(None, STEPS['PIDRegulatedStep'](
+        target_temperature=40, duration=1, interval=0.01))
+    path = str(tmp_path / 'process.json')
+    process.save(path)
+    run_directory = tmp_path / 'run'
+    run_directory.mkdir()
+    config = dict(process_config_path=path, daq_config={},
+                  run_directory=str(run_directory))
+
+    client = launch_service(config)
+    try:
+        assert client.run_info['run_directory'] == str(run_directory)
+        with pytest.raises(RuntimeError):
+            launch_service(config)
+        samples = 0
+        received = client.get()
+        while received is not None:
+            samples += len(received.samples)
+            received = client.get()
+    finally:
+        client.close()
+    assert samples
+    assert client.status == 'Completed'
+    assert not client.is_alive() and not client.crashed_event.is_set()
+    assert read_meta(str(run_directory))['status'] == 'Completed'
+    # The service withdraws once the run is added to the catalog.
+    deadline = time.time() + 10
+    while os.path.exists(tmp_path / SERVICE_FILE):
+        assert time.time() < deadline
+        time.sleep(0.05)
+    assert find_service(str(tmp_path)) is None
+
+
+def test_discarded_samples_are_reported():
+    """The samples discarded for a slow client count as dropped.
+
+    """
+    sent = []
+    conn = SimpleNamespace(send=sent.append)
+    service = SimpleNamespace(_remove_client=lambda client: None)
+    client = _ServiceConnection(service, conn, queue_size=2)
+    client.push(('batch', batch(3)))
+    client.push(('batch', batch(2, dropped=1)))
+    client.push(('batch', batch(1, dropped=1)))
+    client.push(('end', 'Completed'))
+    client._send()
+    assert [m[0] for m in sent] == ['batch', 'end']
+    assert sent[0][1].dropped == 1 + 5
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the telemetry stream served to local viewers.
+
+"""
+import json
+import time
+from types import SimpleNamespace
+from urllib.request import urlopen
+
+import numpy as np
+import pytest
+
+from annealpy.app_state import ChannelStatus
+from annealpy.streaming import (FRAME_DATA, FRAME_RESET,
+                                TelemetryStreamServer, decode_frame,
+                                encode_frame, follow)
+
+
+@pytest.fixture
+def server():
+    """Server streaming a temperature and a heater switch history.
+
+    """
+    temperature = ChannelStatus(float, 'continuous', 100)
+    temperature.extend(np.arange(3.0), np.array([20.0, 21.0, 22.0]))
+    switch = ChannelStatus(bool, 'stepped', 100)
+    switch.extend(np.array([0.5]), np.array([True]))
+    app_state = SimpleNamespace(channels=dict(temperature=temperature,
+                                              heater_switch=switch))
+    server = TelemetryStreamServer(app_state)
+    server.start()
+    yield server
+    server.close()
+
+
+def wait_for(condition, timeout=5):
+    """Wait for a condition to become true.
+
+    """
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_frame_round_trip():
+    """Decoding an encoded frame gives back the samples.
+
+    """
+    frame = encode_frame({'a': ([0.0, 1.5], [2.0, -3.0]), 'é': ([], [])})
+    kind, channels = decode_frame(frame[4:])
+    assert kind == FRAME_DATA
+    np.testing.assert_array_equal(channels['a'][1], [2.0, -3.0])
+    assert len(channels['é'][0]) == 0
+
+
+def test_info(server):
+    """The root describes the channels.
+
+    """
+    with urlopen(server.url) as response:
+        info = json.loads(response.read())
+    assert info['channels'] == dict(temperature='continuous',
+                                    heater_switch='stepped')
+
+
+def test_follow_history_and_live_frames(server):
+    """A viewer receives the history, the live samples and the resets.
+
+    """
+    frames = follow(server.url, history=100)
+    kind, channels = next(frames)
+    assert kind == FRAME_DATA
+    np.testing.assert_array_equal(channels['temperature'][1],
+                                  [20.0, 21.0, 22.0])
+    np.testing.assert_array_equal(channels['heater_switch'][1], [1.0])
+
+    server.publish_samples([('temperature', 3000000000, 23.0),
+                            ('temperature', 4000000000, 24.0)])
+    kind, channels = next(frames)
+    np.testing.assert_array_equal(channels['temperature'][0], [3.0, 4.0])
+    np.testing.assert_array_equal(channels['temperature'][1], [23.0, 24.0])
+
+    server.publish_reset()
+    kind, channels = next(frames)
+    assert kind == FRAME_RESET and not channels
+    frames.close()
+
+
+def test_disconnected_viewers_are_forgotten(server):
+    """The viewers which left no longer receive frames.
+
+    """
+    frames = follow(server.url, history=10)
+    # The viewer is subscribed once the history is received.
+    next(frames)
+    assert len(server._clients) == 1
+    frames.close()
+
+    # The disconnection is noticed when writing to the viewer.
+    def forgotten():
+        server.publish_reset()
+        return not server._clients
+
+    wait_for(forgotten)
+
+
+def test_close_ends_the_streams(server):
+    """Closing the server ends the streams of the viewers.
+
+    """
+    frames = follow(server.url, history=10)
+    # The viewer is subscribed once the history is received.
+    next(frames)
+    server.close()
+    assert list(frames) == []
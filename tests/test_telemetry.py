@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the telemetry transport.
+
+"""
+import time
+from queue import Queue
+from threading import Thread
+
+from annealpy.telemetry import TelemetrySender, coalesce_samples
+
+
+def post_samples(sender, start, count, channel='temperature'):
+    """Post samples 1 ms apart, their value being their index.
+
+    """
+    for i in range(start, start + count):
+        sender.post(channel, i*1000000, float(i))
+
+
+def drain(queue):
+    """Get all the items waiting in a queue.
+
+    """
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_coalesce_samples_keeps_min_max_and_last():
+    """Each channel and interval is reduced to its extrema and last value.
+
+    """
+    samples = [('a', i*100000000, v) for i, v in enumerate((3, 1, 5, 4))]
+    samples += [('a', 1000000000, 2.0), ('b', 0, 7.0)]
+    reduced = coalesce_samples(samples, 1.0)
+    assert reduced == [('a', 100000000, 1), ('a', 200000000, 5),
+                       ('a', 300000000, 4), ('a', 1000000000, 2.0),
+                       ('b', 0, 7.0)]
+
+
+def test_drop_oldest_keeps_the_newest_batch():
+    """A stalled consumer only receives the newest batch, the others being
+    counted as dropped.
+
+    """
+    queue = Queue(1)
+    sender = TelemetrySender(queue, 'drop_oldest', flush_interval=0.01)
+    sender.start()
+    for i in range(3):
+        post_samples(sender, 100*i, 100)
+        time.sleep(0.05)
+    sender.close()
+    batch, = drain(queue)
+    assert batch.samples[-1][2] == 299.0
+    assert sender.dropped + len(batch.samples) == 300
+
+
+def test_block_loses_no_sample():
+    """A slow consumer receives all the samples in order.
+
+    """
+    queue = Queue(1)
+    received = []
+
+    def consume():
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            received.extend(batch.samples)
+            time.sleep(0.02)
+
+    consumer = Thread(target=consume)
+    consumer.start()
+    sender = TelemetrySender(queue, 'block', flush_interval=0.005)
+    sender.start()
+    for i in range(10):
+        post_samples(sender, 100*i, 100)
+        time.sleep(0.005)
+    sender.close()
+    queue.put(None)
+    consumer.join()
+    assert sender.dropped == 0
+    assert [v for _, _, v in received] == [float(i) for i in range(1000)]
+
+
+def test_coalesce_merges_the_samples_of_a_full_queue():
+    """The samples which cannot be sent are reduced until the queue frees.
+
+    """
+    queue = Queue(1)
+    queue.put('busy')
+    sender = TelemetrySender(queue, 'coalesce', flush_interval=0.01,
+                             coalesce_interval=1.0)
+    sender.start()
+    post_samples(sender, 0, 100)
+    time.sleep(0.1)
+    assert queue.get_nowait() == 'busy'
+    sender.close()
+    batches = drain(queue)
+    samples = [s for batch in batches for s in batch.samples]
+    assert [v for _, _, v in samples] == [0.0, 99.0]
+    assert sender.coalesced == 98
+    assert sender.dropped == 0
+
+
+class ListRecorder(object):
+    """Recorder keeping the written samples in memory.
+
+    """
+    def __init__(self):
+        self.samples = []
+        self.flushed = 0
+
+    def write(self, samples):
+        self.samples.extend(samples)
+
+    def flush(self):
+        self.flushed = len(self.samples)
+
+
+def test_close_writes_the_recorder_despite_a_stalled_consumer():
+    """All the samples are recorded when close returns.
+
+    """
+    queue = Queue(1)
+    queue.put('busy')
+    recorder = ListRecorder()
+    sender = TelemetrySender(queue, 'coalesce', flush_interval=0.01,
+                             recorder=recorder)
+    sender.start()
+    post_samples(sender, 0, 100)
+    time.sleep(0.05)
+    post_samples(sender, 100, 100)
+    sender.close(timeout=0)
+    assert len(recorder.samples) == 200
+    assert recorder.flushed == 200
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright 2018-2019 by AnnealPy Authors, see AUTHORS for more details.
+#
+# Distributed under the terms of the BSD 3-Clause license.
+#
+# The full license is in the file LICENCE, distributed with this software.
+# -----------------------------------------------------------------------------
+"""Tests of the players generating command waveforms.
+
+"""
+import time
+
+import numpy as np
+
+from annealpy.daq.waveform import (HardwareWaveformPlayer,
+                                   ThreadWaveformPlayer)
+
+
+class Output(object):
+    """Timed output streaming a buffer at its sample clock rate.
+
+    """
+    def __init__(self, rate, buffer_size):
+        self.rate = rate
+        self.buffer_size = buffer_size
+        self.volts = []
+        self.start_time = None
+        self.closed = False
+        self.max_pending = 0
+
+    def write(self, volts):
+        pending = len(self.volts) + len(volts) - self.generated()
+        self.max_pending = max(self.max_pending, pending)
+        self.volts.extend(volts)
+
+    def generated(self):
+        if self.start_time is None:
+            return 0
+        elapsed = time.monotonic() - self.start_time
+        return min(int(elapsed*self.rate), len(self.volts))
+
+    def start(self):
+        self.start_time = time.monotonic()
+
+    def close(self):
+        self.closed = True
+
+
+def test_hardware_player_streams_long_waveforms():
+    """Waveforms longer than the buffer are streamed as it empties.
+
+    """
+    samples = np.linspace(0, 1, 100)
+    output = Output(1000.0, 16)
+    reported = []
+    player = HardwareWaveformPlayer(
+        samples, 1000.0, samples*5, 16, output.write, output.generated,
+        output.start, output.close,
+        report=lambda start, stop: reported.extend(range(start, stop)))
+    player.start()
+    assert player.wait(5)
+    assert player.error is None and player.hardware_timed
+    np.testing.assert_array_equal(output.volts[:100], samples*5)
+    assert output.max_pending <= 16
+    assert output.closed
+    assert reported == list(range(100))
+
+
+def test_thread_player_writes_the_samples_in_time():
+    """Each sample is written at its time and the end is signaled.
+
+    """
+    writes = []
+    done = []
+    player = ThreadWaveformPlayer(
+        np.arange(20.0), 200.0,
+        lambda value: writes.append((time.monotonic_ns(), value)),
+        on_done=lambda: done.append(True))
+    player.start()
+    assert player.wait(5)
+    assert done and player.generated == 20 and player.error is None
+    values = [v for _, v in writes]
+    # Late samples may be skipped, but never written out of order.
+    assert values == sorted(set(values)) and values[-1] == 19.0
+    for at, value in writes:
+        assert at >= player.start_ns + value*5e6
+
+
+def test_thread_player_stop_and_error():
+    """A stopped player ends early and a failed write ends the generation.
+
+    """
+    player = ThreadWaveformPlayer(np.zeros(100), 10.0, lambda value: None)
+    player.start()
+    time.sleep(0.15)
+    player.stop()
+    assert player.done and player.generated < 100
+
+    def fail(value):
+        raise OSError('Unplugged')
+
+    player = ThreadWaveformPlayer(np.zeros(3), 100.0, fail)
+    player.start()
+    assert player.wait(5)
+    assert isinstance(player.error, OSError)